@@ -0,0 +1,209 @@
+"""Local AbacatePay stand-in for load and latency testing
+
+Implements the billing endpoints the backend uses (create/get/list) and can
+fire billing.paid webhooks back at /api/payments/webhook. Latency, error and
+duplicate-delivery rates are configurable so payment flows can be exercised
+without the real gateway.
+
+Run it and point the backend at it:
+
+    python fake_abacatepay.py --port 8090 --webhook-url http://localhost:8001 --webhook-rate 50
+    ABACATEPAY_API_URL=http://localhost:8090/v1 uvicorn server:app --port 8001
+"""
+import asyncio
+import os
+import random
+import uuid
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+import requests
+import typer
+import uvicorn
+from fastapi import FastAPI, HTTPException, Request
+
+class FakeGatewayConfig:
+    def __init__(self):
+        self.latency_ms = float(os.environ.get('FAKE_ABACATEPAY_LATENCY_MS', '50'))
+        self.latency_jitter_ms = float(os.environ.get('FAKE_ABACATEPAY_LATENCY_JITTER_MS', '20'))
+        self.error_rate = float(os.environ.get('FAKE_ABACATEPAY_ERROR_RATE', '0'))
+        self.duplicate_rate = float(os.environ.get('FAKE_ABACATEPAY_DUPLICATE_RATE', '0'))
+        self.webhook_url = os.environ.get('FAKE_ABACATEPAY_WEBHOOK_URL')  # Backend base URL
+        self.webhook_secret = os.environ.get('ABACATEPAY_WEBHOOK_SECRET', 'betarena_webhook_secret_2025')
+        self.webhook_rate = float(os.environ.get('FAKE_ABACATEPAY_WEBHOOK_RATE', '0'))  # Payments per second
+
+config = FakeGatewayConfig()
+billings: Dict[str, Dict[str, Any]] = {}
+pending_ids = []
+stats = {
+    "billings_created": 0,
+    "billings_paid": 0,
+    "errors_injected": 0,
+    "webhooks_sent": 0,
+    "webhooks_duplicated": 0,
+    "webhooks_failed": 0
+}
+
+app = FastAPI(title="Fake AbacatePay")
+
+async def simulate_gateway():
+    """Apply configured latency and maybe fail the request"""
+    delay = config.latency_ms + random.uniform(-config.latency_jitter_ms, config.latency_jitter_ms)
+    if delay > 0:
+        await asyncio.sleep(delay / 1000)
+    if random.random() < config.error_rate:
+        stats["errors_injected"] += 1
+        raise HTTPException(status_code=500, detail="Injected gateway error")
+
+def webhook_payload(billing: Dict[str, Any]) -> Dict[str, Any]:
+    """billing.paid payload in the shape the backend parses"""
+    return {
+        "event": "billing.paid",
+        "devMode": True,
+        "data": {
+            "externalId": billing["externalId"],
+            "payment": {
+                "amount": billing["amount"],
+                "fee": 80,
+                "method": "PIX"
+            },
+            "pixQrCode": {
+                "id": billing["id"],
+                "amount": billing["amount"],
+                "kind": "PIX",
+                "status": "PAID"
+            },
+            "billing": billing
+        }
+    }
+
+def post_webhook(payload: Dict[str, Any]):
+    url = f"{config.webhook_url.rstrip('/')}/api/payments/webhook"
+    try:
+        response = requests.post(url, params={"webhookSecret": config.webhook_secret}, json=payload, timeout=10)
+        if response.status_code >= 400:
+            stats["webhooks_failed"] += 1
+            print(f"❌ Webhook rejected: {response.status_code} {response.text[:200]}")
+            return
+        stats["webhooks_sent"] += 1
+    except requests.RequestException as e:
+        stats["webhooks_failed"] += 1
+        print(f"❌ Webhook delivery failed: {str(e)}")
+
+async def pay_billing(billing_id: str) -> Dict[str, Any]:
+    """Mark a billing paid and deliver its webhook (sometimes twice)"""
+    billing = billings.get(billing_id)
+    if not billing:
+        raise HTTPException(status_code=404, detail="Billing not found")
+    if billing["status"] == "PAID":
+        return billing
+
+    billing["status"] = "PAID"
+    billing["updatedAt"] = datetime.utcnow().isoformat()
+    stats["billings_paid"] += 1
+
+    if config.webhook_url:
+        payload = webhook_payload(billing)
+        await asyncio.to_thread(post_webhook, payload)
+        if random.random() < config.duplicate_rate:
+            stats["webhooks_duplicated"] += 1
+            await asyncio.sleep(random.uniform(0, 0.5))
+            await asyncio.to_thread(post_webhook, payload)
+    return billing
+
+@app.post("/v1/billing/create")
+async def create_billing(request: Request):
+    await simulate_gateway()
+    data = await request.json()
+    products = data.get("products") or []
+    if not products:
+        raise HTTPException(status_code=400, detail="products is required")
+
+    billing_id = f"bill_{uuid.uuid4().hex[:20]}"
+    now = datetime.utcnow().isoformat()
+    billing = {
+        "id": billing_id,
+        "url": f"https://fake.abacatepay.local/pay/{billing_id}",
+        "amount": sum(product["price"] * product.get("quantity", 1) for product in products),
+        "status": "PENDING",
+        "devMode": True,
+        "methods": data.get("methods", ["PIX"]),
+        "frequency": data.get("frequency", "ONE_TIME"),
+        "products": products,
+        "externalId": products[0].get("externalId"),
+        "customer": data.get("customer"),
+        "createdAt": now,
+        "updatedAt": now
+    }
+    billings[billing_id] = billing
+    pending_ids.append(billing_id)
+    stats["billings_created"] += 1
+    return {"data": billing, "error": None}
+
+@app.get("/v1/billing/get")
+async def get_billing(id: str):
+    await simulate_gateway()
+    billing = billings.get(id)
+    if not billing:
+        raise HTTPException(status_code=404, detail="Billing not found")
+    return {"data": billing, "error": None}
+
+@app.get("/v1/billing/list")
+async def list_billings():
+    await simulate_gateway()
+    return {"data": list(billings.values()), "error": None}
+
+@app.post("/v1/billing/{billing_id}/pay")
+async def pay_billing_endpoint(billing_id: str):
+    """Test hook: pay one billing now and fire its webhook"""
+    return {"data": await pay_billing(billing_id), "error": None}
+
+@app.get("/stats")
+async def get_stats():
+    return {
+        **stats,
+        "pending_billings": len(pending_ids),
+        "config": vars(config)
+    }
+
+async def pay_pending_billings():
+    """Pay queued billings at config.webhook_rate per second"""
+    interval = 1 / config.webhook_rate
+    while True:
+        if pending_ids:
+            billing_id = pending_ids.pop(0)
+            asyncio.create_task(pay_billing(billing_id))
+        await asyncio.sleep(interval)
+
+@app.on_event("startup")
+async def start_payer():
+    if config.webhook_rate > 0 and config.webhook_url:
+        asyncio.create_task(pay_pending_billings())
+        print(f"💸 Paying pending billings at {config.webhook_rate}/s -> {config.webhook_url}")
+
+cli = typer.Typer()
+
+@cli.command()
+def main(
+    host: str = "0.0.0.0",
+    port: int = 8090,
+    latency_ms: float = typer.Option(config.latency_ms, help="Mean added latency per call"),
+    latency_jitter_ms: float = typer.Option(config.latency_jitter_ms, help="Uniform jitter around the mean"),
+    error_rate: float = typer.Option(config.error_rate, help="Share of calls answered with HTTP 500"),
+    duplicate_rate: float = typer.Option(config.duplicate_rate, help="Share of webhooks delivered twice"),
+    webhook_url: Optional[str] = typer.Option(config.webhook_url, help="Backend base URL to deliver webhooks to"),
+    webhook_secret: str = typer.Option(config.webhook_secret),
+    webhook_rate: float = typer.Option(config.webhook_rate, help="Billings paid per second (0 = only via /pay)")
+):
+    config.latency_ms = latency_ms
+    config.latency_jitter_ms = latency_jitter_ms
+    config.error_rate = error_rate
+    config.duplicate_rate = duplicate_rate
+    config.webhook_url = webhook_url
+    config.webhook_secret = webhook_secret
+    config.webhook_rate = webhook_rate
+    print(f"🥑 Fake AbacatePay on {host}:{port} (latency {latency_ms}±{latency_jitter_ms} ms, errors {error_rate:.0%}, duplicates {duplicate_rate:.0%})")
+    uvicorn.run(app, host=host, port=port)
+
+if __name__ == "__main__":
+    cli()
@@ -1,20 +1,43 @@
 from fastapi import FastAPI, APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import IndexModel, UpdateOne, ReturnDocument, WriteConcern, ASCENDING, DESCENDING
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure, PyMongoError
 import os
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Set, Tuple
 import uuid
 from datetime import datetime, timedelta, timedelta
 from enum import Enum
+from collections import OrderedDict, deque
+import bisect
+import heapq
+import itertools
 from abacatepay import AbacatePay
 from abacatepay.products import Product
+from abacatepay.billings.models import BillingIn
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+import functools
+from contextvars import ContextVar
+import requests
 
 import json
+import base64
+import csv
+import io
+import time
+import zlib
+import random
+import hashlib
+import math
+import asyncio
 import bcrypt
+import numpy as np
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -92,6 +115,178 @@ mp_valid = abacate_valid
 mp = abacatepay_client
 mp_access_token = abacate_api_token
 
+# AbacatePay gateway access
+# The SDK is synchronous, so calls go through AbacatePayGateway, which runs
+# them on a bounded thread pool with timeouts, retries and a circuit breaker.
+ABACATEPAY_API_URL = os.environ.get('ABACATEPAY_API_URL')  # e.g. a local fake gateway
+ABACATEPAY_TIMEOUT_SECONDS = float(os.environ.get('ABACATEPAY_TIMEOUT_SECONDS', '10'))
+ABACATEPAY_MAX_CONCURRENCY = int(os.environ.get('ABACATEPAY_MAX_CONCURRENCY', '8'))
+ABACATEPAY_MAX_RETRIES = int(os.environ.get('ABACATEPAY_MAX_RETRIES', '3'))
+ABACATEPAY_BREAKER_THRESHOLD = int(os.environ.get('ABACATEPAY_BREAKER_THRESHOLD', '5'))
+ABACATEPAY_BREAKER_COOLDOWN_SECONDS = float(os.environ.get('ABACATEPAY_BREAKER_COOLDOWN_SECONDS', '30'))
+
+class GatewayUnavailable(Exception):
+    """Raised without calling AbacatePay while the circuit breaker is open"""
+
+class AbacatePayHttpClient:
+    """Minimal billing client over one pooled requests.Session
+
+    Speaks the same billing API as the SDK but keeps connections alive
+    between calls and applies a timeout to every request. Used when
+    ABACATEPAY_API_URL points somewhere other than the SDK's default.
+    """
+
+    def __init__(self, api_url: str, api_token: str, timeout: float, pool_size: int):
+        self.api_url = api_url.rstrip('/')
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update({'Authorization': f'Bearer {api_token}'})
+        self.billing = self
+
+    @staticmethod
+    def _billing(data: Dict[str, Any]) -> SimpleNamespace:
+        return SimpleNamespace(
+            id=data.get('id'),
+            url=data.get('url'),
+            amount=data.get('amount'),
+            status=data.get('status'),
+            dev_mode=data.get('devMode', False)
+        )
+
+    def create(self, data: Dict[str, Any]) -> SimpleNamespace:
+        payload = BillingIn.model_validate(data).model_dump(by_alias=True, mode='json')
+        response = self.session.post(f"{self.api_url}/billing/create", json=payload, timeout=self.timeout)
+        response.raise_for_status()
+        return self._billing(response.json()['data'])
+
+    def retrieve(self, billing_id: str) -> SimpleNamespace:
+        response = self.session.get(f"{self.api_url}/billing/get", params={'id': billing_id}, timeout=self.timeout)
+        response.raise_for_status()
+        return self._billing(response.json()['data'])
+
+class AbacatePayGateway:
+    """Async facade over a blocking billing client
+
+    Calls run on a dedicated pool of ABACATEPAY_MAX_CONCURRENCY threads so
+    they never block the event loop. A call that times out keeps its thread
+    until the underlying request gives up, which is why the pool is bounded.
+    After ABACATEPAY_BREAKER_THRESHOLD consecutive failures the breaker opens
+    and calls fail fast with GatewayUnavailable for the cooldown period.
+    """
+
+    def __init__(self, client, max_workers: int, timeout: float, max_retries: int,
+                 breaker_threshold: int, breaker_cooldown: float):
+        self.client = client
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="abacatepay")
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown = breaker_cooldown
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+        self.calls = 0
+        self.failures = 0
+        self.rejected = 0
+
+    @property
+    def breaker_open(self) -> bool:
+        if self.opened_at is None:
+            return False
+        if time.monotonic() - self.opened_at >= self.breaker_cooldown:
+            # Half-open: let the next call through to probe the gateway
+            return False
+        return True
+
+    def _record(self, success: bool):
+        if success:
+            self.consecutive_failures = 0
+            self.opened_at = None
+            return
+        self.failures += 1
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= self.breaker_threshold:
+            if self.opened_at is None:
+                print(f"🔌 AbacatePay circuit breaker opened after {self.consecutive_failures} failures")
+            self.opened_at = time.monotonic()
+
+    async def _call(self, fn, *args, retries: int):
+        loop = asyncio.get_running_loop()
+        for attempt in range(retries + 1):
+            if self.breaker_open:
+                self.rejected += 1
+                raise GatewayUnavailable("AbacatePay temporarily unavailable (circuit open)")
+
+            self.calls += 1
+            try:
+                result = await asyncio.wait_for(
+                    loop.run_in_executor(self.executor, functools.partial(fn, *args)),
+                    timeout=self.timeout
+                )
+            except Exception as e:
+                self._record(False)
+                if attempt >= retries:
+                    raise
+                # Full jitter keeps retries from many requests from lining up
+                backoff = random.uniform(0, 0.2 * 2 ** attempt)
+                print(f"🔁 AbacatePay call failed ({type(e).__name__}), retry {attempt + 1}/{retries} in {backoff:.2f}s")
+                await asyncio.sleep(backoff)
+                continue
+
+            self._record(True)
+            return result
+
+    async def create_billing(self, billing_data: Dict[str, Any]):
+        # Not idempotent on the gateway side - a retry could bill twice
+        return await self._call(self.client.billing.create, billing_data, retries=0)
+
+    @property
+    def can_lookup_billings(self) -> bool:
+        return self.client is not None
+
+    @property
+    def can_retrieve_billing(self) -> bool:
+        """Whether the client looks up one billing at a time (only the HTTP client does)"""
+        return hasattr(getattr(self.client, 'billing', None), 'retrieve')
+
+    async def list_billings(self):
+        return await self._call(self.client.billing.list, retries=self.max_retries)
+
+    async def retrieve_billing(self, billing_id: str):
+        """The billing with this id, or None if the gateway does not know it"""
+        if self.can_retrieve_billing:
+            return await self._call(self.client.billing.retrieve, billing_id, retries=self.max_retries)
+        # The SDK has no single-billing lookup, only the account's billing list
+        return next((billing for billing in await self.list_billings() if billing.id == billing_id), None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "failures": self.failures,
+            "rejected_by_breaker": self.rejected,
+            "consecutive_failures": self.consecutive_failures,
+            "breaker_open": self.breaker_open,
+            "timeout_seconds": self.timeout,
+            "max_concurrency": self.executor._max_workers
+        }
+
+if abacatepay_client and ABACATEPAY_API_URL:
+    abacatepay_client = AbacatePayHttpClient(
+        ABACATEPAY_API_URL, abacate_api_token, ABACATEPAY_TIMEOUT_SECONDS, ABACATEPAY_MAX_CONCURRENCY
+    )
+    print(f"🥑 AbacatePay API URL override: {ABACATEPAY_API_URL}")
+
+abacatepay_gateway = AbacatePayGateway(
+    abacatepay_client,
+    max_workers=ABACATEPAY_MAX_CONCURRENCY,
+    timeout=ABACATEPAY_TIMEOUT_SECONDS,
+    max_retries=ABACATEPAY_MAX_RETRIES,
+    breaker_threshold=ABACATEPAY_BREAKER_THRESHOLD,
+    breaker_cooldown=ABACATEPAY_BREAKER_COOLDOWN_SECONDS
+)
+
 # Create the main app without a prefix
 app = FastAPI()
 
@@ -125,53 +320,118 @@ class TransactionStatus(str, Enum):
     CANCELLED = "cancelled"
 
 # Webhook processing cache to prevent duplicates
-webhook_processing_cache = {}
+# The cache is only a per-process fast path; the webhook_events collection
+# (unique hash + TTL index) is the source of truth across workers and restarts.
 WEBHOOK_CACHE_TTL = 300  # 5 minutes cache
+WEBHOOK_INBOX_RETENTION_SECONDS = 7 * 24 * 3600  # Processed inbox entries are kept a week
+LOGIN_LOG_RETENTION_DAYS = int(os.environ.get('LOGIN_LOG_RETENTION_DAYS', '90'))
+LOGIN_LOG_RETENTION_SECONDS = LOGIN_LOG_RETENTION_DAYS * 24 * 3600
+LOGIN_LOGS_TIMESERIES = os.environ.get('LOGIN_LOGS_TIMESERIES', 'false').lower() == 'true'
+WEBHOOK_CACHE_MAX_ENTRIES = int(os.environ.get('WEBHOOK_CACHE_MAX_ENTRIES', '10000'))
+
+class WebhookDedupeCache:
+    """Bounded, insertion-ordered set of recently seen webhook hashes
+
+    Every entry gets the same TTL and is (re)appended at the tail, so the
+    oldest entry is always at the head. Eviction only ever pops from the
+    head, which is amortized O(1) per webhook.
+    """
+
+    def __init__(self, ttl_seconds: float, max_entries: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[str, float]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _evict(self, now: float):
+        cutoff = now - self.ttl_seconds
+        while self.entries:
+            oldest = next(iter(self.entries.values()))
+            if oldest > cutoff and len(self.entries) <= self.max_entries:
+                break
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def seen(self, key: str) -> Optional[float]:
+        """Seconds since key was added if it is still fresh, otherwise None"""
+        now = time.monotonic()
+        self._evict(now)
+        added = self.entries.get(key)
+        if added is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return now - added
+
+    def add(self, key: str):
+        now = time.monotonic()
+        self.entries[key] = now
+        self.entries.move_to_end(key)
+        self._evict(now)
+
+    def discard(self, key: str):
+        self.entries.pop(key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "size": len(self.entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions
+        }
+
+webhook_processing_cache = WebhookDedupeCache(WEBHOOK_CACHE_TTL, WEBHOOK_CACHE_MAX_ENTRIES)
+
+def webhook_event_hash(webhook_data: Dict[str, Any]) -> str:
+    """Unique identifier for a webhook based on its payment details"""
+    payment_data = webhook_data.get('data', {})
+    payment_info = payment_data.get('payment', {})
+    pix_info = payment_data.get('pixQrCode', {})
+    
+    # Create unique hash based on payment details
+    unique_data = {
+        'event': webhook_data.get('event'),
+        'amount': payment_info.get('amount'),
+        'fee': payment_info.get('fee'),
+        'pix_id': pix_info.get('id'),
+        'pix_status': pix_info.get('status'),
+        'dev_mode': webhook_data.get('devMode', False)
+    }
+    
+    return hashlib.md5(str(unique_data).encode()).hexdigest()
 
-def is_webhook_already_processed(webhook_data: Dict[str, Any]) -> bool:
+async def is_webhook_already_processed(webhook_data: Dict[str, Any]) -> bool:
     """Check if this webhook has already been processed to prevent duplicates"""
     try:
-        # Create a unique identifier for this webhook
-        payment_data = webhook_data.get('data', {})
-        payment_info = payment_data.get('payment', {})
-        pix_info = payment_data.get('pixQrCode', {})
-        
-        # Create unique hash based on payment details
-        unique_data = {
-            'event': webhook_data.get('event'),
-            'amount': payment_info.get('amount'),
-            'fee': payment_info.get('fee'),
-            'pix_id': pix_info.get('id'),
-            'pix_status': pix_info.get('status'),
-            'dev_mode': webhook_data.get('devMode', False)
-        }
-        
-        import hashlib
-        webhook_hash = hashlib.md5(str(unique_data).encode()).hexdigest()
-        
+        webhook_hash = webhook_event_hash(webhook_data)
         current_time = datetime.utcnow()
         
         # Check if this webhook was processed recently
-        if webhook_hash in webhook_processing_cache:
-            last_processed = webhook_processing_cache[webhook_hash]
-            time_diff = (current_time - last_processed).total_seconds()
-            
-            if time_diff < WEBHOOK_CACHE_TTL:
-                print(f"🚫 DUPLICATE WEBHOOK DETECTED - Hash: {webhook_hash[:8]}...")
-                print(f"   Last processed: {time_diff:.1f} seconds ago")
-                print(f"   Skipping duplicate processing")
-                return True
+        time_diff = webhook_processing_cache.seen(webhook_hash)
+        if time_diff is not None:
+            print(f"🚫 DUPLICATE WEBHOOK DETECTED - Hash: {webhook_hash[:8]}...")
+            print(f"   Last processed: {time_diff:.1f} seconds ago")
+            print(f"   Skipping duplicate processing")
+            return True
         
-        # Mark this webhook as processed
-        webhook_processing_cache[webhook_hash] = current_time
+        # Insert-or-conflict: the unique index decides, in one round trip
+        try:
+            await db.webhook_events.insert_one({
+                "hash": webhook_hash,
+                "event": webhook_data.get('event'),
+                "created_at": current_time
+            })
+        except DuplicateKeyError:
+            webhook_processing_cache.add(webhook_hash)
+            print(f"🚫 DUPLICATE WEBHOOK DETECTED - Hash: {webhook_hash[:8]}... (seen by another worker or before restart)")
+            return True
         
-        # Clean old entries from cache
-        expired_keys = [
-            key for key, timestamp in webhook_processing_cache.items()
-            if (current_time - timestamp).total_seconds() > WEBHOOK_CACHE_TTL
-        ]
-        for key in expired_keys:
-            del webhook_processing_cache[key]
+        # Mark this webhook as processed
+        webhook_processing_cache.add(webhook_hash)
         
         print(f"✅ NEW WEBHOOK - Hash: {webhook_hash[:8]}... (Processing)")
         return False
@@ -180,10 +440,85 @@ def is_webhook_already_processed(webhook_data: Dict[str, Any]) -> bool:
         print(f"⚠️ Error checking webhook duplication: {str(e)}")
         return False  # Process webhook if unsure
 
+async def forget_webhook(webhook_data: Dict[str, Any]):
+    """Let a webhook be processed again after its processing failed"""
+    webhook_hash = webhook_event_hash(webhook_data)
+    webhook_processing_cache.discard(webhook_hash)
+    await db.webhook_events.delete_one({"hash": webhook_hash})
+
+# Request-scoped user loader
+# Handlers ask the loader for users instead of calling db.users.find_one.
+# Lookups issued in the same event-loop tick are sent as one $in query, and
+# each user is fetched at most once per request. Balance mutations prime the
+# loader with the updated document so later reads in the request see it.
+class UserLoader:
+    def __init__(self):
+        self.cache: Dict[str, asyncio.Future] = {}
+        self.queue: List[str] = []
+        self.queries = 0
+
+    def load(self, user_id: str) -> "asyncio.Future":
+        """Future resolving to the user document, or None if it does not exist"""
+        future = self.cache.get(user_id)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = self.cache[user_id] = loop.create_future()
+            if not self.queue:
+                # Everything requested before the loop's next iteration joins this batch
+                loop.call_soon(lambda: asyncio.ensure_future(self._dispatch()))
+            self.queue.append(user_id)
+        return future
+
+    async def load_many(self, user_ids: List[str]) -> List[Optional[Dict[str, Any]]]:
+        return list(await asyncio.gather(*(self.load(user_id) for user_id in user_ids)))
+
+    async def _dispatch(self):
+        user_ids, self.queue = self.queue, []
+        self.queries += 1
+        try:
+            users = {user["id"]: user async for user in db.users.find({"id": {"$in": user_ids}})}
+        except Exception as e:
+            for user_id in user_ids:
+                future = self.cache.pop(user_id)
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for user_id in user_ids:
+            future = self.cache[user_id]
+            if not future.done():
+                future.set_result(users.get(user_id))
+
+    def prime(self, user: Dict[str, Any]):
+        """Remember a user document this request already has in hand"""
+        future = self.cache.get(user["id"])
+        if future is None or future.done():
+            future = self.cache[user["id"]] = asyncio.get_running_loop().create_future()
+        future.set_result(user)
+
+    def clear(self, user_id: str):
+        """Forget a user after a write the loader did not see"""
+        future = self.cache.get(user_id)
+        if future is not None and future.done():
+            del self.cache[user_id]
+
+user_loader_var: ContextVar[Optional[UserLoader]] = ContextVar("user_loader", default=None)
+
+def get_user_loader() -> UserLoader:
+    """Loader of the current request; outside a request (workers) a throwaway one"""
+    return user_loader_var.get() or UserLoader()
+
+@app.middleware("http")
+async def user_loader_scope(request: Request, call_next):
+    token = user_loader_var.set(UserLoader())
+    try:
+        return await call_next(request)
+    finally:
+        user_loader_var.reset(token)
+
 # Admin authentication middleware
 async def verify_admin_access(user_id: str):
     """Verify if user has admin privileges"""
-    user = await db.users.find_one({"id": user_id})
+    user = await get_user_loader().load(user_id)
     if not user:
         raise HTTPException(status_code=404, detail="Usuário não encontrado")
     
@@ -196,6 +531,78 @@ async def verify_admin_access(user_id: str):
     print(f"✅ Admin access verified for user: {user['name']} ({user_id})")
     return user
 
+# Balance mutations
+# Every change to users.balance goes through these so the sufficiency check
+# and the update happen in one conditional round trip.
+def require_positive_amount(amount: float):
+    # A negative debit would be a credit (and vice versa) that skips every check
+    if not amount > 0:
+        raise HTTPException(status_code=400, detail="Amount must be positive")
+
+async def debit_balance(user_id: str, amount: float) -> Optional[Dict[str, Any]]:
+    """Take amount from the user's balance only if it covers it
+
+    Returns the user document after the debit, or None when the user does
+    not exist or the balance is insufficient (see raise_debit_failure).
+    A non-positive amount is rejected with a 400.
+    """
+    require_positive_amount(amount)
+    user = await db.users.find_one_and_update(
+        {"id": user_id, "balance": {"$gte": amount}},
+        {"$inc": {"balance": -amount}},
+        return_document=ReturnDocument.AFTER
+    )
+    if user:
+        get_user_loader().prime(user)
+    return user
+
+async def credit_balance(user_id: str, amount: float) -> Optional[Dict[str, Any]]:
+    """Add amount to the user's balance, returning the updated user (None if missing)"""
+    require_positive_amount(amount)
+    user = await db.users.find_one_and_update(
+        {"id": user_id},
+        {"$inc": {"balance": amount}},
+        return_document=ReturnDocument.AFTER
+    )
+    if user:
+        get_user_loader().prime(user)
+    return user
+
+# Credits that must land exactly once even when retried (refunds, deposits,
+# payouts) carry a ledger id. The user document remembers the last
+# LEDGER_IDS_KEPT ids applied to it, so the "already applied?" check and the
+# $inc are one atomic single-document update. The matching transaction is
+# written with the same ledger id as its _id.
+LEDGER_IDS_KEPT = 200
+
+def ledger_credit(user_id: str, amount: float, ledger_id: str) -> UpdateOne:
+    """Bulk-write operation crediting amount at most once per ledger_id"""
+    return UpdateOne(
+        {"id": user_id, "applied_credits": {"$ne": ledger_id}},
+        {
+            "$inc": {"balance": amount},
+            "$push": {"applied_credits": {"$each": [ledger_id], "$slice": -LEDGER_IDS_KEPT}}
+        }
+    )
+
+async def insert_ledger_transactions(transactions: List[Dict[str, Any]]):
+    """Insert transactions keyed by ledger _id, skipping ones a retry already wrote"""
+    if not transactions:
+        return
+    try:
+        await db.transactions.insert_many(transactions, ordered=False)
+    except BulkWriteError as e:
+        if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+            raise
+
+async def raise_debit_failure(user_id: str, not_found_detail: str = "User not found",
+                              insufficient_detail: str = "Insufficient balance"):
+    """Turn a failed debit_balance into the right HTTP error"""
+    # Only reached on the failure path, so the extra lookup costs nothing normally
+    if not await get_user_loader().load(user_id):
+        raise HTTPException(status_code=404, detail=not_found_detail)
+    raise HTTPException(status_code=400, detail=insufficient_detail)
+
 # Models
 class User(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -250,6 +657,10 @@ class LoginLog(BaseModel):
     login_time: datetime = Field(default_factory=datetime.utcnow)
     success: bool = True
     failure_reason: Optional[str] = None
+    attempt_count: int = 1  # >1 for summaries of throttled attempts
+
+# Version 2: side, event_id, side_name and event_title are always stored
+BET_SCHEMA_VERSION = 2
 
 class Bet(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -277,6 +688,11 @@ class Bet(BaseModel):
     side: str  # "A" or "B" (e.g., "Brasil" or "Argentina")  
     event_id: str  # Common event ID for matching (e.g., "brasil_vs_argentina")
     side_name: str = ""  # Human readable side name (e.g., "Brasil", "Argentina")
+    pair_id: Optional[str] = None  # Id of the half that carries the pot when two bets are matched
+    schema_version: int = BET_SCHEMA_VERSION  # Bets below this still need the legacy backfill
+
+# Public bet fields; keeps internal bookkeeping (settlement_id, expiry_batch...) out of responses
+BET_PROJECTION = {"_id": 0, **{field: 1 for field in Bet.model_fields}}
 
 class BetCreate(BaseModel):
     event_title: str
@@ -307,11 +723,296 @@ class CreatePaymentRequest(BaseModel):
     user_id: str
     amount: float
 
+# Database indexes
+# Every hot query in this file must be covered by one of these declarations.
+# They are created at startup (idempotently) and compared against what is
+# actually on the server so drift shows up in the logs.
+INDEX_SPECS: Dict[str, List[IndexModel]] = {
+    "users": [
+        IndexModel([("id", ASCENDING)], name="users_id_unique", unique=True),
+        IndexModel([("email", ASCENDING)], name="users_email_unique", unique=True),
+        IndexModel([("email_verification_token", ASCENDING)], name="users_verification_token", sparse=True),
+        IndexModel([("created_at", DESCENDING), ("id", DESCENDING)], name="users_created_at_id"),
+    ],
+    "bets": [
+        IndexModel([("id", ASCENDING)], name="bets_id_unique", unique=True),
+        IndexModel([("invite_code", ASCENDING)], name="bets_invite_code"),
+        # find_matching_bet: only waiting bets are ever candidates
+        IndexModel(
+            [("event_id", ASCENDING), ("side", ASCENDING), ("amount", ASCENDING), ("created_at", ASCENDING)],
+            name="bets_waiting_match",
+            partialFilterExpression={"status": BetStatus.WAITING.value},
+        ),
+        IndexModel([("status", ASCENDING), ("expires_at", ASCENDING)], name="bets_status_expires_at"),
+        IndexModel([("event_id", ASCENDING), ("status", ASCENDING)], name="bets_event_status"),
+        IndexModel([("expiry_batch", ASCENDING)], name="bets_expiry_batch", sparse=True),
+        # Unrefunded expired bets: by claim token, and by claim age for the sweep
+        IndexModel([("refund_token", ASCENDING)], name="bets_unrefunded_token", partialFilterExpression={"refunded": False}),
+        IndexModel([("refund_claimed_at", ASCENDING)], name="bets_unrefunded_claimed_at", partialFilterExpression={"refunded": False}),
+        IndexModel([("pair_id", ASCENDING)], name="bets_pair_id", sparse=True),
+        IndexModel([("auction_id", ASCENDING)], name="bets_auction_id", sparse=True),
+        # Keyset pages: each branch of the user's $or is merged in (created_at, id) order
+        IndexModel([("creator_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], name="bets_creator_created_at_id"),
+        IndexModel([("opponent_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], name="bets_opponent_created_at_id"),
+        IndexModel([("status", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], name="bets_status_created_at_id"),
+        IndexModel([("created_at", DESCENDING), ("id", DESCENDING)], name="bets_created_at_id"),
+    ],
+    "transactions": [
+        IndexModel([("id", ASCENDING)], name="transactions_id_unique", unique=True),
+        IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], name="transactions_user_created_at_id"),
+        IndexModel([("created_at", DESCENDING), ("id", DESCENDING)], name="transactions_created_at_id"),
+        IndexModel([("payment_id", ASCENDING)], name="transactions_payment_id", sparse=True),
+        IndexModel([("approval_batch", ASCENDING)], name="transactions_approval_batch", sparse=True),
+        IndexModel([("credit_claimed_at", ASCENDING)], name="transactions_uncredited_claimed_at", partialFilterExpression={"credited": False}),
+        IndexModel(
+            [("status", ASCENDING), ("type", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)],
+            name="transactions_status_type_created_at_id",
+        ),
+    ],
+    "pool_stakes": [
+        IndexModel([("event_id", ASCENDING), ("status", ASCENDING)], name="pool_stakes_event_status"),
+        IndexModel([("settlement_id", ASCENDING)], name="pool_stakes_settlement", sparse=True),
+    ],
+    "pool_settlements": [
+        IndexModel([("event_id", ASCENDING)], name="pool_settlements_event_unique", unique=True),
+        IndexModel([("lease_until", ASCENDING)], name="pool_settlements_running", partialFilterExpression={"status": "running"}),
+    ],
+    "webhook_events": [
+        IndexModel([("hash", ASCENDING)], name="webhook_events_hash_unique", unique=True),
+        IndexModel([("created_at", ASCENDING)], name="webhook_events_ttl", expireAfterSeconds=WEBHOOK_CACHE_TTL),
+    ],
+    "webhook_inbox": [
+        IndexModel([("id", ASCENDING)], name="webhook_inbox_id_unique", unique=True),
+        IndexModel([("shard", ASCENDING), ("status", ASCENDING), ("received_at", ASCENDING)], name="webhook_inbox_shard_queue"),
+        IndexModel([("ordering_key", ASCENDING), ("status", ASCENDING), ("received_at", ASCENDING)], name="webhook_inbox_ordering_key"),
+        IndexModel([("processed_at", ASCENDING)], name="webhook_inbox_ttl", expireAfterSeconds=WEBHOOK_INBOX_RETENTION_SECONDS),
+    ],
+    "webhook_dead_letters": [
+        IndexModel([("id", ASCENDING)], name="webhook_dead_letters_id"),
+    ],
+    "login_logs": [
+        IndexModel([("user_id", ASCENDING), ("login_time", DESCENDING), ("id", DESCENDING)], name="login_logs_user_login_time_id"),
+        IndexModel([("email", ASCENDING), ("login_time", DESCENDING), ("id", DESCENDING)], name="login_logs_email_login_time_id"),
+        IndexModel([("ip_address", ASCENDING), ("login_time", DESCENDING)], name="login_logs_ip_login_time"),
+        IndexModel([("login_time", DESCENDING), ("id", DESCENDING)], name="login_logs_login_time_id"),
+        IndexModel([("login_time", ASCENDING)], name="login_logs_retention", expireAfterSeconds=LOGIN_LOG_RETENTION_SECONDS),
+    ],
+    "login_throttle": [
+        IndexModel([("expires_at", ASCENDING)], name="login_throttle_ttl", expireAfterSeconds=0),
+    ],
+}
+
+# Index options that must match for an existing index to count as "the same"
+INDEX_COMPARED_OPTIONS = ("unique", "sparse", "partialFilterExpression", "expireAfterSeconds")
+
+def index_drift(declared: List[IndexModel], existing: Dict[str, Any]) -> Dict[str, List[str]]:
+    """Compare declared indexes with index_information() output"""
+    drift = {"missing": [], "changed": [], "unexpected": []}
+    declared_names = set()
+
+    for model in declared:
+        spec = model.document
+        name = spec["name"]
+        declared_names.add(name)
+
+        current = existing.get(name)
+        if current is None:
+            drift["missing"].append(name)
+            continue
+
+        same_key = list(spec["key"].items()) == [tuple(k) for k in current["key"]]
+        same_options = all(
+            spec.get(option) == current.get(option)
+            for option in INDEX_COMPARED_OPTIONS
+        )
+        if not same_key or not same_options:
+            drift["changed"].append(name)
+
+    drift["unexpected"] = [
+        name for name in existing
+        if name != "_id_" and name not in declared_names
+    ]
+    return drift
+
+async def ensure_indexes() -> Dict[str, Dict[str, List[str]]]:
+    """Create missing indexes and report drift for every declared collection"""
+    report = {}
+
+    for collection_name, declared in INDEX_SPECS.items():
+        collection = db[collection_name]
+        try:
+            existing = await collection.index_information()
+        except PyMongoError as e:
+            print(f"⚠️ Could not read indexes for {collection_name}: {str(e)}")
+            continue
+
+        # Time-series collections carry retention themselves and reject TTL indexes
+        if "timeseries" in await collection.options():
+            declared = [model for model in declared if "expireAfterSeconds" not in model.document]
+
+        drift = index_drift(declared, existing)
+
+        # Only create what is missing - changed indexes need a manual drop,
+        # recreating them here would fail with an options conflict anyway
+        to_create = [model for model in declared if model.document["name"] in drift["missing"]]
+        created = []
+        for model in to_create:
+            try:
+                await collection.create_indexes([model])
+                created.append(model.document["name"])
+            except OperationFailure as e:
+                print(f"❌ Failed to create index {model.document['name']} on {collection_name}: {str(e)}")
+
+        drift["created"] = created
+        report[collection_name] = drift
+
+        if created:
+            print(f"🗂️ {collection_name}: created indexes {', '.join(created)}")
+        if drift["changed"]:
+            print(f"⚠️ {collection_name}: index definition drift on {', '.join(drift['changed'])} (drop and restart to recreate)")
+        if drift["unexpected"]:
+            print(f"⚠️ {collection_name}: undeclared indexes present: {', '.join(drift['unexpected'])}")
+
+    return report
+
+async def ensure_login_log_store():
+    """Set up login_logs retention before the generic index pass
+
+    With LOGIN_LOGS_TIMESERIES a fresh deployment gets a time-series
+    collection bucketed by email, and Mongo expires whole buckets. An
+    existing regular collection keeps its documents and is retained by the
+    TTL index in INDEX_SPECS instead. Either way a changed
+    LOGIN_LOG_RETENTION_DAYS is applied in place with collMod.
+    """
+    try:
+        if LOGIN_LOGS_TIMESERIES and "login_logs" not in await db.list_collection_names(filter={"name": "login_logs"}):
+            await db.create_collection(
+                "login_logs",
+                timeseries={"timeField": "login_time", "metaField": "email", "granularity": "minutes"},
+                expireAfterSeconds=LOGIN_LOG_RETENTION_SECONDS
+            )
+            print(f"🗂️ Created time-series login_logs ({LOGIN_LOG_RETENTION_DAYS} days retention)")
+            return
+
+        if "timeseries" in await db.login_logs.options():
+            await db.command("collMod", "login_logs", expireAfterSeconds=LOGIN_LOG_RETENTION_SECONDS)
+            return
+
+        retention_index = (await db.login_logs.index_information()).get("login_logs_retention")
+        if retention_index and retention_index.get("expireAfterSeconds") != LOGIN_LOG_RETENTION_SECONDS:
+            await db.command("collMod", "login_logs", index={
+                "name": "login_logs_retention",
+                "expireAfterSeconds": LOGIN_LOG_RETENTION_SECONDS
+            })
+            print(f"🗂️ login_logs retention changed to {LOGIN_LOG_RETENTION_DAYS} days")
+    except PyMongoError as e:
+        print(f"⚠️ Could not configure login_logs retention: {str(e)}")
+
+# Keyset pagination
+# List endpoints page by the sort key instead of skip(), so a deep page costs
+# the same as the first one. The cursor handed to clients is the sort key of
+# the last item they received, opaque to them.
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+LOGIN_LOG_PAGE_KEY = ["login_time", "id"]
+CREATED_AT_PAGE_KEY = ["created_at", "id"]
+
+def encode_cursor(doc: Dict[str, Any], fields: List[str]) -> str:
+    values = [
+        {"$date": doc[field].isoformat()} if isinstance(doc[field], datetime) else doc[field]
+        for field in fields
+    ]
+    return base64.urlsafe_b64encode(json.dumps(values).encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor: str, fields: List[str]) -> List[Any]:
+    try:
+        values = json.loads(
+            base64.urlsafe_b64decode(cursor.encode('ascii')),
+            object_hook=lambda value: datetime.fromisoformat(value["$date"]) if "$date" in value else value
+        )
+    except (ValueError, TypeError, KeyError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(values, list) or len(values) != len(fields):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return values
+
+def keyset_filter(fields: List[str], values: List[Any], descending: bool = True) -> Dict[str, Any]:
+    """Match documents strictly after values in (fields...) order"""
+    op = "$lt" if descending else "$gt"
+    branches = []
+    for i, field in enumerate(fields):
+        branch = {fields[j]: values[j] for j in range(i)}
+        branch[field] = {op: values[i]}
+        branches.append(branch)
+    return {"$or": branches}
+
+async def keyset_page(collection, query: Dict[str, Any], fields: List[str], limit: int,
+                      cursor: Optional[str] = None, descending: bool = True,
+                      projection: Optional[Dict[str, Any]] = None) -> tuple:
+    """One page of documents plus the cursor for the next page (None at the end)"""
+    if cursor:
+        query = {"$and": [query, keyset_filter(fields, decode_cursor(cursor, fields), descending)]}
+    direction = DESCENDING if descending else ASCENDING
+    # One extra document tells us whether another page exists
+    docs = await collection.find(query, projection).sort(
+        [(field, direction) for field in fields]
+    ).limit(limit + 1).to_list(length=limit + 1)
+    next_cursor = encode_cursor(docs[limit - 1], fields) if len(docs) > limit else None
+    return docs[:limit], next_cursor
+
 # User Routes
 # Password hashing utilities
+# Cost factor for new hashes. With BCRYPT_TARGET_MS set, startup calibration
+# replaces it with the highest cost whose hash fits that latency budget on
+# this machine, never going below BCRYPT_MIN_ROUNDS.
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', '12'))
+BCRYPT_TARGET_MS = float(os.environ.get('BCRYPT_TARGET_MS', '0'))
+BCRYPT_MIN_ROUNDS = int(os.environ.get('BCRYPT_MIN_ROUNDS', '10'))
+BCRYPT_MAX_ROUNDS = 16
+
+password_hash_rounds = BCRYPT_ROUNDS
+
+def calibrate_bcrypt_rounds(target_ms: float, min_rounds: int, max_rounds: int) -> int:
+    """Highest cost whose hash takes at most target_ms here
+
+    Each extra round doubles the work, so one timing at a cheap cost is
+    enough to extrapolate.
+    """
+    base_rounds = 8
+    salt = bcrypt.gensalt(rounds=base_rounds)
+    timings = []
+    for _ in range(3):
+        started = time.perf_counter()
+        bcrypt.hashpw(b"calibration", salt)
+        timings.append((time.perf_counter() - started) * 1000)
+    base_ms = min(timings)
+    
+    rounds = base_rounds + math.floor(math.log2(target_ms / base_ms)) if base_ms > 0 else max_rounds
+    return min(max(rounds, min_rounds), max_rounds)
+
+def hash_cost(hashed) -> Optional[int]:
+    """Cost factor stored in a $2b$NN$... hash"""
+    if isinstance(hashed, bytes):
+        hashed = hashed.decode('utf-8')
+    try:
+        return int(hashed.split('$')[2])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+def needs_rehash(hashed) -> bool:
+    return hash_cost(hashed) != password_hash_rounds
+
+def stored_password_hash(user: Dict[str, Any]):
+    """The hash a user's password is checked against
+
+    Older admin resets wrote the new hash to "password" and left the
+    previous password_hash in place, so "password" wins when present.
+    """
+    return user.get("password") or user.get("password_hash")
+
 def hash_password(password: str) -> str:
     """Hash a password using bcrypt"""
-    salt = bcrypt.gensalt()
+    salt = bcrypt.gensalt(rounds=password_hash_rounds)
     return bcrypt.hashpw(password.encode('utf-8'), salt).decode('utf-8')
 
 def verify_password(password: str, hashed) -> bool:
@@ -321,6 +1022,337 @@ def verify_password(password: str, hashed) -> bool:
         hashed = hashed.encode('utf-8')
     return bcrypt.checkpw(password.encode('utf-8'), hashed)
 
+# bcrypt holds a CPU for hundreds of milliseconds per call, so it runs on its
+# own small pool instead of the event loop. Jobs beyond the workers wait in
+# the pool's queue; past PASSWORD_HASH_MAX_QUEUE waiting jobs new requests
+# are turned away with 503 rather than piling up behind a login burst.
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', str(max(1, (os.cpu_count() or 2) - 1))))
+PASSWORD_HASH_MAX_QUEUE = int(os.environ.get('PASSWORD_HASH_MAX_QUEUE', '64'))
+
+password_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
+password_jobs = {"in_flight": 0, "completed": 0, "rejected": 0}
+
+async def run_password_job(fn, *args):
+    if password_jobs["in_flight"] >= PASSWORD_HASH_WORKERS + PASSWORD_HASH_MAX_QUEUE:
+        password_jobs["rejected"] += 1
+        raise HTTPException(
+            status_code=503,
+            detail="Servidor ocupado, tente novamente em instantes",
+            headers={"Retry-After": "1"}
+        )
+    
+    password_jobs["in_flight"] += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(password_executor, functools.partial(fn, *args))
+    finally:
+        password_jobs["in_flight"] -= 1
+        password_jobs["completed"] += 1
+
+async def hash_password_async(password: str) -> str:
+    return await run_password_job(hash_password, password)
+
+async def verify_password_async(password: str, hashed) -> bool:
+    return await run_password_job(verify_password, password, hashed)
+
+async def upgrade_password_hash(user: Dict[str, Any], password: str, stored_hash):
+    """Move a verified legacy or outdated-cost hash into password_hash"""
+    if "password" not in user and not needs_rehash(stored_hash):
+        return
+    await db.users.update_one(
+        {"id": user["id"]},
+        {"$set": {"password_hash": await hash_password_async(password)}, "$unset": {"password": ""}}
+    )
+    get_user_loader().clear(user["id"])
+    print(f"🔐 Rehashed password for {user['email']} (cost {hash_cost(stored_hash)} -> {password_hash_rounds})")
+
+@api_router.get("/admin/password-hashing/stats")
+async def get_password_hashing_stats():
+    """Occupancy of the bcrypt worker pool"""
+    return {
+        **password_jobs,
+        "queued": max(0, password_jobs["in_flight"] - PASSWORD_HASH_WORKERS),
+        "workers": PASSWORD_HASH_WORKERS,
+        "max_queue": PASSWORD_HASH_MAX_QUEUE,
+        "bcrypt_rounds": password_hash_rounds
+    }
+
+# Buffered login_logs writer
+# Login attempts are appended to an in-memory buffer and written with
+# insert_many once LOGIN_LOG_BATCH_SIZE records are waiting or every
+# LOGIN_LOG_FLUSH_INTERVAL_MS, whichever comes first. Writes use w=1 without
+# journaling: losing a few audit lines in a crash is preferable to holding
+# every login response on a journaled insert.
+LOGIN_LOG_BATCH_SIZE = int(os.environ.get('LOGIN_LOG_BATCH_SIZE', '200'))
+LOGIN_LOG_FLUSH_INTERVAL_MS = int(os.environ.get('LOGIN_LOG_FLUSH_INTERVAL_MS', '500'))
+LOGIN_LOG_MAX_BUFFER = int(os.environ.get('LOGIN_LOG_MAX_BUFFER', '20000'))
+
+class LoginLogWriter:
+    def __init__(self):
+        self.buffer: List[Dict[str, Any]] = []
+        self.wakeup = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+        self.written = 0
+        self.dropped = 0
+        self.failed_flushes = 0
+        self.flush_latencies: deque = deque(maxlen=100)
+
+    def add(self, log: Dict[str, Any]):
+        if len(self.buffer) >= LOGIN_LOG_MAX_BUFFER:
+            # Mongo is not keeping up; shed audit records rather than memory
+            self.dropped += 1
+            return
+        self.buffer.append(log)
+        if len(self.buffer) >= LOGIN_LOG_BATCH_SIZE:
+            self.wakeup.set()
+
+    async def flush(self):
+        while self.buffer:
+            batch = self.buffer[:LOGIN_LOG_BATCH_SIZE]
+            del self.buffer[:LOGIN_LOG_BATCH_SIZE]
+            started = time.perf_counter()
+            try:
+                # insert_many stamps an _id on every dict it is given, so a
+                # batch retried after a lost reply hits duplicate keys for the
+                # documents that did land instead of writing them twice
+                await db.login_logs.with_options(
+                    write_concern=WriteConcern(w=1, j=False)
+                ).insert_many(batch, ordered=False)
+            except BulkWriteError as e:
+                # Written documents and duplicates of earlier attempts are done;
+                # only documents the server rejected for another reason go back
+                failed = [
+                    error["index"] for error in e.details.get("writeErrors", [])
+                    if error.get("code") != 11000
+                ]
+                retry = [{key: value for key, value in batch[index].items() if key != "_id"} for index in failed]
+                self.written += len(batch) - len(retry)
+                if retry:
+                    self.requeue(retry, e)
+                    return
+                continue
+            except PyMongoError as e:
+                self.requeue(batch, e)
+                return
+            self.flush_latencies.append((time.perf_counter() - started) * 1000)
+            self.written += len(batch)
+
+    def requeue(self, batch: List[Dict[str, Any]], error: Exception):
+        """Keep a failed batch for the next flush unless the buffer is full"""
+        self.failed_flushes += 1
+        room = max(0, LOGIN_LOG_MAX_BUFFER - len(self.buffer))
+        self.dropped += len(batch) - min(room, len(batch))
+        self.buffer[:0] = batch[:room]
+        print(f"❌ Failed to write {len(batch)} login logs: {str(error)}")
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the flusher and drain whatever is still buffered"""
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        await self.flush()
+        print(f"📝 Login log writer drained ({self.written} written, {len(self.buffer)} left, {self.dropped} dropped)")
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=LOGIN_LOG_FLUSH_INTERVAL_MS / 1000)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            await self.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        latencies = list(self.flush_latencies)
+        return {
+            "buffer_depth": len(self.buffer),
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed_flushes": self.failed_flushes,
+            "last_flush_ms": round(latencies[-1], 2) if latencies else None,
+            "p50_flush_ms": round(float(np.percentile(latencies, 50)), 2) if latencies else None,
+            "p99_flush_ms": round(float(np.percentile(latencies, 99)), 2) if latencies else None,
+            "batch_size": LOGIN_LOG_BATCH_SIZE,
+            "flush_interval_ms": LOGIN_LOG_FLUSH_INTERVAL_MS
+        }
+
+login_log_writer = LoginLogWriter()
+
+@api_router.get("/admin/login-logs/writer-stats")
+async def get_login_log_writer_stats():
+    """Buffer depth and flush latency of the login_logs writer"""
+    return login_log_writer.stats()
+
+# Login throttling
+# Failed attempts are counted in per-email and per-IP sliding windows held in
+# memory. Over-limit attempts are rejected before the user lookup and before
+# bcrypt. Successful logins never count, so users sharing an address (or the
+# proxy in front of us) are not locked out by each other's normal logins.
+# The client address comes from X-Forwarded-For only when the connection is
+# from one of LOGIN_TRUSTED_PROXIES. With LOGIN_THROTTLE_SHARED the counts
+# are also kept in Mongo (in LOGIN_THROTTLE_BUCKET_SECONDS buckets) so all
+# instances enforce the same limit.
+LOGIN_THROTTLE_WINDOW_SECONDS = float(os.environ.get('LOGIN_THROTTLE_WINDOW_SECONDS', '300'))
+LOGIN_MAX_FAILURES_PER_EMAIL = int(os.environ.get('LOGIN_MAX_FAILURES_PER_EMAIL', '5'))
+LOGIN_MAX_FAILURES_PER_IP = int(os.environ.get('LOGIN_MAX_FAILURES_PER_IP', '100'))
+LOGIN_TRUSTED_PROXIES = {ip.strip() for ip in os.environ.get('LOGIN_TRUSTED_PROXIES', '').split(',') if ip.strip()}
+LOGIN_THROTTLE_MAX_KEYS = int(os.environ.get('LOGIN_THROTTLE_MAX_KEYS', '100000'))
+LOGIN_THROTTLE_SHARED = os.environ.get('LOGIN_THROTTLE_SHARED', 'false').lower() == 'true'
+LOGIN_THROTTLE_BUCKET_SECONDS = int(os.environ.get('LOGIN_THROTTLE_BUCKET_SECONDS', '30'))
+LOGIN_THROTTLE_SUMMARY_SECONDS = float(os.environ.get('LOGIN_THROTTLE_SUMMARY_SECONDS', '60'))
+
+class SlidingWindowCounter:
+    """Timestamps of recent events per key, oldest keys evicted first"""
+
+    def __init__(self, limit: int, window_seconds: float, max_keys: int):
+        self.limit = limit
+        self.window = window_seconds
+        self.max_keys = max_keys
+        self.events: "OrderedDict[str, deque]" = OrderedDict()
+
+    def _recent(self, key: str, now: float) -> Optional[deque]:
+        events = self.events.get(key)
+        if events is None:
+            return None
+        while events and events[0] <= now - self.window:
+            events.popleft()
+        if not events:
+            del self.events[key]
+            return None
+        return events
+
+    def retry_after(self, key: str, now: float) -> float:
+        """Seconds until key may try again, 0 when under the limit"""
+        events = self._recent(key, now)
+        if events is None or len(events) < self.limit:
+            return 0.0
+        return events[-self.limit] + self.window - now
+
+    def record(self, key: str, now: float):
+        events = self._recent(key, now)
+        if events is None:
+            # maxlen: older timestamps beyond the limit never matter
+            events = self.events[key] = deque(maxlen=self.limit)
+            if len(self.events) > self.max_keys:
+                self.events.popitem(last=False)
+        else:
+            self.events.move_to_end(key)
+        events.append(now)
+
+def login_client_ip(request: Request) -> str:
+    """Client address, taken from X-Forwarded-For only behind a trusted proxy"""
+    peer = request.client.host if request.client else "unknown"
+    if peer not in LOGIN_TRUSTED_PROXIES:
+        return peer
+    # Rightmost hop not added by one of our own proxies is the real client
+    hops = [hop.strip() for hop in request.headers.get("x-forwarded-for", "").split(",") if hop.strip()]
+    for hop in reversed(hops):
+        if hop not in LOGIN_TRUSTED_PROXIES:
+            return hop
+    return peer
+
+class LoginThrottle:
+    def __init__(self):
+        self.by_email = SlidingWindowCounter(LOGIN_MAX_FAILURES_PER_EMAIL, LOGIN_THROTTLE_WINDOW_SECONDS, LOGIN_THROTTLE_MAX_KEYS)
+        self.by_ip = SlidingWindowCounter(LOGIN_MAX_FAILURES_PER_IP, LOGIN_THROTTLE_WINDOW_SECONDS, LOGIN_THROTTLE_MAX_KEYS)
+        # (email, ip) -> [attempts, first_seen, user_agent] since the last summary
+        self.throttled: Dict[tuple, list] = {}
+        self.task: Optional[asyncio.Task] = None
+
+    def _buckets(self, kind: str, key: str) -> List[str]:
+        current = int(time.time() // LOGIN_THROTTLE_BUCKET_SECONDS)
+        count = int(np.ceil(LOGIN_THROTTLE_WINDOW_SECONDS / LOGIN_THROTTLE_BUCKET_SECONDS))
+        return [f"{kind}:{key}:{bucket}" for bucket in range(current - count + 1, current + 1)]
+
+    async def _shared_count(self, kind: str, key: str) -> int:
+        cursor = db.login_throttle.find({"_id": {"$in": self._buckets(kind, key)}}, {"count": 1})
+        return sum([bucket["count"] async for bucket in cursor])
+
+    async def _shared_record(self, kind: str, key: str):
+        bucket_id = self._buckets(kind, key)[-1]
+        await db.login_throttle.update_one(
+            {"_id": bucket_id},
+            {"$inc": {"count": 1}, "$setOnInsert": {
+                "expires_at": datetime.utcnow() + timedelta(seconds=LOGIN_THROTTLE_WINDOW_SECONDS + LOGIN_THROTTLE_BUCKET_SECONDS)
+            }},
+            upsert=True
+        )
+
+    async def check(self, email: str, ip: str, user_agent: str):
+        """Raise 429 if email or IP is over its failure limit"""
+        now = time.monotonic()
+        retry_after = max(self.by_email.retry_after(email, now), self.by_ip.retry_after(ip, now))
+        if not retry_after and LOGIN_THROTTLE_SHARED:
+            if (await self._shared_count("ip", ip) >= LOGIN_MAX_FAILURES_PER_IP
+                    or await self._shared_count("email", email) >= LOGIN_MAX_FAILURES_PER_EMAIL):
+                retry_after = LOGIN_THROTTLE_BUCKET_SECONDS
+        
+        if retry_after:
+            summary = self.throttled.setdefault((email, ip), [0, datetime.utcnow(), user_agent])
+            summary[0] += 1
+            raise HTTPException(
+                status_code=429,
+                detail=f"Muitas tentativas de login. Tente novamente em {int(np.ceil(retry_after))} segundos.",
+                headers={"Retry-After": str(int(np.ceil(retry_after)))}
+            )
+
+    async def record_failure(self, email: str, ip: str):
+        now = time.monotonic()
+        self.by_email.record(email, now)
+        self.by_ip.record(ip, now)
+        if LOGIN_THROTTLE_SHARED:
+            await self._shared_record("email", email)
+            await self._shared_record("ip", ip)
+
+    async def flush_summaries(self):
+        """Queue one login_logs entry per throttled (email, IP) pair"""
+        if not self.throttled:
+            return
+        throttled, self.throttled = self.throttled, {}
+        for (email, ip), (attempts, first_seen, user_agent) in throttled.items():
+            login_log_writer.add(LoginLog(
+                user_id="unknown",
+                email=email,
+                ip_address=ip,
+                user_agent=user_agent,
+                login_time=first_seen,
+                success=False,
+                failure_reason="Throttled",
+                attempt_count=attempts
+            ).dict())
+        print(f"🚦 Logged {sum(entry[0] for entry in throttled.values())} throttled login attempts from {len(throttled)} sources")
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        await self.flush_summaries()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(LOGIN_THROTTLE_SUMMARY_SECONDS)
+            try:
+                await self.flush_summaries()
+            except Exception as e:
+                print(f"❌ Failed to log throttled logins: {str(e)}")
+
+login_throttle = LoginThrottle()
+
 # User Routes
 @api_router.post("/users", response_model=UserResponse)
 async def create_user(user_data: UserCreate):
@@ -340,7 +1372,7 @@ async def create_user(user_data: UserCreate):
         raise HTTPException(status_code=400, detail="Senha deve ter pelo menos 6 caracteres")
     
     # Hash the password
-    password_hash = hash_password(user_data.password)
+    password_hash = await hash_password_async(user_data.password)
     
     # Generate email verification token
     import secrets
@@ -372,9 +1404,10 @@ async def create_user(user_data: UserCreate):
 @api_router.post("/users/login", response_model=UserResponse)
 async def login_user(login_data: UserLogin, request: Request):
     """Login user with email and password - requires verified email"""
+    client_ip = login_client_ip(request)
+    
     # Function to log login attempts
     async def log_login_attempt(user_id: str, email: str, success: bool, failure_reason: str = None):
-        client_ip = request.client.host if request.client else "unknown"
         user_agent = request.headers.get("user-agent", "unknown")
         
         login_log = LoginLog(
@@ -385,11 +1418,15 @@ async def login_user(login_data: UserLogin, request: Request):
             success=success,
             failure_reason=failure_reason
         )
-        await db.login_logs.insert_one(login_log.dict())
+        login_log_writer.add(login_log.dict())
+    
+    # Throttle before touching the database or bcrypt
+    await login_throttle.check(login_data.email, client_ip, request.headers.get("user-agent", "unknown"))
     
     # Find user by email
     user = await db.users.find_one({"email": login_data.email})
     if not user:
+        await login_throttle.record_failure(login_data.email, client_ip)
         await log_login_attempt("unknown", login_data.email, False, "Email not found")
         raise HTTPException(status_code=401, detail="Email não encontrado ou não verificado")
     
@@ -402,10 +1439,14 @@ async def login_user(login_data: UserLogin, request: Request):
         )
     
     # Verify password
-    if not verify_password(login_data.password, user["password_hash"]):
+    stored_hash = stored_password_hash(user)
+    if not stored_hash or not await verify_password_async(login_data.password, stored_hash):
+        await login_throttle.record_failure(login_data.email, client_ip)
         await log_login_attempt(user["id"], login_data.email, False, "Invalid password")
         raise HTTPException(status_code=401, detail="Senha incorreta")
     
+    await upgrade_password_hash(user, login_data.password, stored_hash)
+    
     # Update last login time
     await db.users.update_one(
         {"id": user["id"]},
@@ -471,7 +1512,7 @@ async def manual_verify_email(email: str):
 @api_router.get("/users/{user_id}")
 async def get_user_by_id(user_id: str):
     """Get user data by ID including admin status"""
-    user = await db.users.find_one({"id": user_id})
+    user = await get_user_loader().load(user_id)
     if not user:
         raise HTTPException(status_code=404, detail="Usuário não encontrado")
     
@@ -492,17 +1533,23 @@ async def get_user_by_id(user_id: str):
     return user_data
 
 @api_router.get("/users")
-async def get_all_users():
-    """Get all users for admin purposes"""
-    cursor = db.users.find({}, {"password_hash": 0, "email_verification_token": 0})
-    users = await cursor.to_list(length=100)
-    return users
+async def get_all_users(limit: int = DEFAULT_PAGE_SIZE, cursor: Optional[str] = None):
+    """Get users for admin purposes, newest first"""
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    users, next_cursor = await keyset_page(
+        db.users, {}, CREATED_AT_PAGE_KEY, limit, cursor,
+        projection={"_id": 0, "password_hash": 0, "password": 0, "email_verification_token": 0, "applied_credits": 0}
+    )
+    return {"items": users, "next_cursor": next_cursor}
 
 @api_router.get("/users/{user_id}/login-logs")
-async def get_user_login_logs(user_id: str, limit: int = 10):
-    """Get login logs for a specific user"""
-    cursor = db.login_logs.find({"user_id": user_id}).sort("login_time", -1).limit(limit)
-    logs = await cursor.to_list(length=limit)
+async def get_user_login_logs(user_id: str, limit: int = 10, cursor: Optional[str] = None):
+    """Get login logs for a specific user, newest first
+
+    Pass the returned next_cursor back as cursor to get the following page.
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    logs, next_cursor = await keyset_page(db.login_logs, {"user_id": user_id}, LOGIN_LOG_PAGE_KEY, limit, cursor)
     
     # Format logs for response
     formatted_logs = []
@@ -518,13 +1565,13 @@ async def get_user_login_logs(user_id: str, limit: int = 10):
         }
         formatted_logs.append(formatted_log)
     
-    return {"login_logs": formatted_logs}
+    return {"login_logs": formatted_logs, "next_cursor": next_cursor}
 
 @api_router.get("/admin/login-logs")
-async def get_all_login_logs(limit: int = 50):
-    """Get all login logs (admin only)"""
-    cursor = db.login_logs.find({}).sort("login_time", -1).limit(limit)
-    logs = await cursor.to_list(length=limit)
+async def get_all_login_logs(limit: int = 50, cursor: Optional[str] = None):
+    """Get all login logs (admin only), newest first, one page per call"""
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    logs, next_cursor = await keyset_page(db.login_logs, {}, LOGIN_LOG_PAGE_KEY, limit, cursor)
     
     # Format logs for response
     formatted_logs = []
@@ -541,7 +1588,7 @@ async def get_all_login_logs(limit: int = 50):
         }
         formatted_logs.append(formatted_log)
     
-    return {"login_logs": formatted_logs}
+    return {"login_logs": formatted_logs, "next_cursor": next_cursor}
 
 @api_router.post("/payments/check-status/{transaction_id}")
 async def check_payment_status(transaction_id: str):
@@ -564,34 +1611,20 @@ async def check_payment_status(transaction_id: str):
             }
         
         # Check with AbacatePay API if payment was completed
-        if abacatepay_client and abacate_valid:
+        if abacatepay_gateway.can_lookup_billings:
             try:
                 # Get payment details from AbacatePay
                 payment_id = transaction.get("payment_id") or transaction.get("external_reference")
                 if payment_id:
                     # Try to get payment status from AbacatePay
-                    payment_details = abacatepay_client.billing.retrieve(payment_id)
+                    payment_details = await abacatepay_gateway.retrieve_billing(payment_id)
                     
                     print(f"🥑 AbacatePay payment status: {payment_details}")
                     
                     # If payment is completed, process it
-                    if hasattr(payment_details, 'status') and payment_details.status == 'paid':
+                    if str(getattr(payment_details, 'status', '')).lower() == 'paid':
                         print(f"✅ Payment confirmed as paid, processing...")
-                        
-                        # Simulate webhook data for processing
-                        webhook_data = {
-                            "event": "billing.paid",
-                            "data": {
-                                "externalId": transaction_id,
-                                "payment": {
-                                    "amount": int(transaction["amount"] * 100),
-                                    "fee": 80  # R$ 0.80 in cents
-                                }
-                            }
-                        }
-                        
-                        # Process the payment
-                        await process_abacatepay_payment_success(webhook_data)
+                        await approve_deposits([transaction_id], "status_check")
                         
                         return {
                             "transaction_id": transaction_id,
@@ -701,7 +1734,7 @@ async def create_payment_preference(request: CreatePaymentRequest):
         }
     
     # Get user details for payment
-    user = await db.users.find_one({"id": request.user_id})
+    user = await get_user_loader().load(request.user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
@@ -759,7 +1792,7 @@ async def create_payment_preference(request: CreatePaymentRequest):
         secure_webhook_url = generate_webhook_url(frontend_url, abacate_webhook_secret)
         print(f"🔗 Required HTTPS webhook URL for dashboard: {secure_webhook_url}")
         
-        billing_response = abacatepay_client.billing.create(data=billing_data)
+        billing_response = await abacatepay_gateway.create_billing(billing_data)
         
         # Update transaction with payment ID
         await db.transactions.update_one(
@@ -787,6 +1820,10 @@ async def create_payment_preference(request: CreatePaymentRequest):
             "webhook_url_needed": generate_webhook_url(frontend_url, abacate_webhook_secret)
         }
     
+    except GatewayUnavailable as e:
+        await db.transactions.delete_one({"id": transaction.id})
+        raise HTTPException(status_code=503, detail=f"AbacatePay indisponível no momento, tente novamente: {str(e)}")
+    
     except Exception as e:
         logging.error(f"AbacatePay payment creation error: {str(e)}")
         print(f"❌ AbacatePay Error Details: {str(e)}")
@@ -806,22 +1843,9 @@ async def simulate_payment_approval(transaction_id: str):
     if transaction["status"] == TransactionStatus.APPROVED:
         return {"message": "Payment already approved", "status": "approved"}
     
-    # Update transaction status to approved
-    await db.transactions.update_one(
-        {"id": transaction_id},
-        {
-            "$set": {
-                "status": TransactionStatus.APPROVED,
-                "mp_payment_id": f"demo_payment_{transaction_id}",
-                "updated_at": datetime.utcnow()
-            }
-        }
-    )
-    
-    # Add balance to user
-    await db.users.update_one(
-        {"id": transaction["user_id"]},
-        {"$inc": {"balance": transaction["amount"]}}
+    # Approve and credit the user
+    await approve_deposits(
+        [transaction_id], "simulation", details={"mp_payment_id": f"demo_payment_{transaction_id}"}
     )
     
     return {
@@ -846,84 +1870,285 @@ async def test_webhook_endpoint():
         "https_enforced": True
     }
 
-@api_router.post("/payments/webhook")
-async def webhook_abacatepay(request: Request):
-    """AbacatePay webhook endpoint with duplicate protection"""
-    start_time = datetime.utcnow()
-    
-    try:
-        # Get client IP for logging
-        client_ip = request.client.host if request.client else "unknown"
-        print(f"🥑 AbacatePay Webhook received from IP: {client_ip} at {start_time.isoformat()}")
-        
-        # Validate webhook secret from query parameters
-        webhook_secret = request.query_params.get('webhookSecret')
-        print(f"🔐 Webhook secret provided: {'Yes' if webhook_secret else 'No'}")
-        
-        if not webhook_secret or webhook_secret != abacate_webhook_secret:
-            print(f"❌ Invalid AbacatePay webhook secret. Expected: {abacate_webhook_secret[:10]}...")
-            print(f"❌ Received: {webhook_secret[:10] + '...' if webhook_secret else 'None'}")
-            raise HTTPException(status_code=401, detail="Invalid webhook secret")
+@api_router.get("/payments/gateway-stats")
+async def get_gateway_stats():
+    """Call, failure and circuit breaker counters for AbacatePay"""
+    return abacatepay_gateway.stats()
 
-        # Parse webhook payload
-        webhook_data = await request.json()
-        event_type = webhook_data.get('event')
-        
-        print(f"🥑 AbacatePay Webhook Event: {event_type}")
+@api_router.get("/payments/webhook-cache-stats")
+async def get_webhook_cache_stats():
+    """Hit/miss/eviction counters of the in-process webhook dedupe cache"""
+    return webhook_processing_cache.stats()
 
-        result = {"received": True, "event": event_type}
+# Webhook inbox
+# The webhook endpoint only validates the secret and appends the raw payload
+# to webhook_inbox, so AbacatePay gets its 200 in milliseconds. A pool of
+# workers drains the inbox. Payloads for the same transaction always land on
+# the same worker (shard), and an entry is only claimed once no earlier entry
+# for its transaction is still waiting or being processed - by this or any
+# other backend process - so events for one transaction are never reordered
+# by retries. A failing entry in backoff only holds back its own transaction;
+# the worker moves on to other transactions in the shard. A claim is a lease:
+# an entry left processing longer than WEBHOOK_LEASE_SECONDS belongs to a
+# worker that died and is picked up again.
+WEBHOOK_WORKERS = int(os.environ.get('WEBHOOK_WORKERS', '4'))
+# How many unfinished entries of a shard a worker looks through for one it may take
+WEBHOOK_SCAN_LIMIT = int(os.environ.get('WEBHOOK_SCAN_LIMIT', '500'))
+WEBHOOK_MAX_ATTEMPTS = int(os.environ.get('WEBHOOK_MAX_ATTEMPTS', '5'))
+WEBHOOK_RETRY_BASE_SECONDS = 2
+WEBHOOK_LEASE_SECONDS = float(os.environ.get('WEBHOOK_LEASE_SECONDS', '300'))
 
-        if event_type == 'billing.paid':
-            process_result = await process_abacatepay_payment_success(webhook_data)
-            result.update(process_result or {})
-        elif event_type == 'billing.failed':
-            await process_abacatepay_payment_failure(webhook_data)
-        elif event_type == 'billing.cancelled':
-            await process_abacatepay_payment_cancellation(webhook_data)
-        else:
-            print(f"⚠️ Unknown AbacatePay webhook event: {event_type}")
-            result["warning"] = f"Unknown event type: {event_type}"
+def webhook_ordering_key(webhook_data: Dict[str, Any]) -> Optional[str]:
+    """The transaction a webhook belongs to, used to keep its events in order"""
+    payment_data = webhook_data.get('data', {}) or {}
+    return (
+        payment_data.get('externalId') or
+        payment_data.get('external_reference') or
+        (payment_data.get('pixQrCode') or {}).get('id') or
+        (payment_data.get('billing') or {}).get('id')
+    )
 
-        # Calculate processing time
-        end_time = datetime.utcnow()
-        processing_time = (end_time - start_time).total_seconds()
-        
-        result.update({
-            "message": f"Webhook processed successfully: {event_type}",
-            "processing_time_seconds": processing_time,
-            "processed_at": end_time.isoformat()
-        })
-        
-        print(f"✅ Webhook processing completed in {processing_time:.3f} seconds")
-        return result
-        
-    except HTTPException as he:
-        # Re-raise HTTP exceptions
-        raise he
-    except Exception as e:
-        processing_time = (datetime.utcnow() - start_time).total_seconds()
-        print(f"❌ AbacatePay Webhook Error after {processing_time:.3f} seconds: {str(e)}")
-        import traceback
-        print(f"❌ Full traceback: {traceback.format_exc()}")
-        raise HTTPException(status_code=400, detail=f"Webhook processing error: {str(e)}")
+async def dispatch_abacatepay_event(webhook_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Run the handler for one AbacatePay webhook event"""
+    event_type = webhook_data.get('event')
+    print(f"🥑 AbacatePay Webhook Event: {event_type}")
+    
+    result = {"event": event_type}
+    if event_type == 'billing.paid':
+        process_result = await process_abacatepay_payment_success(webhook_data)
+        result.update(process_result or {})
+    elif event_type == 'billing.failed':
+        await process_abacatepay_payment_failure(webhook_data)
+    elif event_type == 'billing.cancelled':
+        await process_abacatepay_payment_cancellation(webhook_data)
+    else:
+        print(f"⚠️ Unknown AbacatePay webhook event: {event_type}")
+        result["warning"] = f"Unknown event type: {event_type}"
+    return result
 
-async def process_abacatepay_payment_success(webhook_data: Dict[str, Any]):
-    """Process successful AbacatePay payment with duplicate protection"""
-    try:
-        print(f"🥑 AbacatePay payment success webhook received")
-        
-        # Check for duplicate webhook processing
-        if is_webhook_already_processed(webhook_data):
-            print(f"🚫 DUPLICATE WEBHOOK IGNORED - Preventing multiple processing")
-            return {"status": "duplicate_ignored", "message": "Webhook already processed"}
-        
-        print(f"🥑 Processing NEW webhook - Full payload: {json.dumps(webhook_data, indent=2)}")
-        
-        payment_data = webhook_data.get('data', {})
-        payment_info = payment_data.get('payment', {})
-        pix_info = payment_data.get('pixQrCode', {})
+class WebhookInbox:
+    """Workers that drain webhook_inbox with retries and a dead-letter collection"""
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self.wakeups = [asyncio.Event() for _ in range(workers)]
+        self.tasks: List[asyncio.Task] = []
+
+    def shard_for(self, ordering_key: Optional[str]) -> int:
+        # crc32 rather than hash() so every process agrees on the shard
+        return zlib.crc32((ordering_key or "").encode()) % self.workers
+
+    def notify(self, shard: int):
+        self.wakeups[shard].set()
+
+    def claimable(self) -> Dict[str, Any]:
+        """Entries a worker may take: pending, or processing with an expired lease"""
+        return {"$or": [
+            {"status": "pending"},
+            {"status": "processing", "locked_at": {"$lt": datetime.utcnow() - timedelta(seconds=WEBHOOK_LEASE_SECONDS)}}
+        ]}
+
+    async def start(self):
+        # Anything a dead worker left mid-processing is retried; entries other
+        # live processes are still working on keep their lease
+        try:
+            await db.webhook_inbox.update_many(
+                {"status": "processing", "locked_at": {"$lt": datetime.utcnow() - timedelta(seconds=WEBHOOK_LEASE_SECONDS)}},
+                {"$set": {"status": "pending"}}
+            )
+        except PyMongoError as e:
+            print(f"⚠️ Could not release expired webhook leases: {str(e)}")
+        self.tasks = [asyncio.create_task(self._work(shard)) for shard in range(self.workers)]
+        print(f"📥 Webhook inbox started with {self.workers} workers")
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    async def _wait(self, shard: int, timeout: float):
+        try:
+            await asyncio.wait_for(self.wakeups[shard].wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+        self.wakeups[shard].clear()
+
+    async def _next_entry(self, shard: int) -> Tuple[Optional[Dict[str, Any]], float]:
+        """The oldest entry of the shard that may run now, else how long to wait
+
+        Walks the shard's unfinished entries in arrival order. An entry that
+        is in backoff or leased elsewhere blocks the later entries with its
+        ordering key and nothing else.
+        """
+        current_time = datetime.utcnow()
+        lease_cutoff = current_time - timedelta(seconds=WEBHOOK_LEASE_SECONDS)
+        blocked: Set[str] = set()
+        wait = 1.0
         
-        # Extract payment details from real AbacatePay format
+        unfinished = db.webhook_inbox.find(
+            {"shard": shard, "status": {"$in": ["pending", "processing"]}},
+            {"_id": 0, "id": 1, "ordering_key": 1, "status": 1, "locked_at": 1, "next_attempt_at": 1}
+        ).sort("received_at", ASCENDING).limit(WEBHOOK_SCAN_LIMIT)
+        async for entry in unfinished:
+            key = entry.get("ordering_key")
+            if key in blocked:
+                continue
+            if entry["status"] == "processing" and entry["locked_at"] >= lease_cutoff:
+                delay = WEBHOOK_LEASE_SECONDS
+            else:
+                delay = (entry["next_attempt_at"] - current_time).total_seconds()
+                if delay <= 0:
+                    return entry, 0.0
+            wait = min(wait, delay)
+            if key:
+                blocked.add(key)
+        return None, wait
+
+    async def _work(self, shard: int):
+        while True:
+            try:
+                head, wait = await self._next_entry(shard)
+                if not head:
+                    await self._wait(shard, wait)
+                    continue
+
+                entry = await db.webhook_inbox.find_one_and_update(
+                    {"id": head["id"], **self.claimable()},
+                    {"$set": {"status": "processing", "locked_at": datetime.utcnow()}, "$inc": {"attempts": 1}},
+                    return_document=ReturnDocument.AFTER
+                )
+                if entry:
+                    await self._process(entry)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"❌ Webhook worker {shard} error: {str(e)}")
+                await asyncio.sleep(1)
+
+    async def _process(self, entry: Dict[str, Any]):
+        start_time = datetime.utcnow()
+        try:
+            webhook_data = json.loads(entry["body"])
+        except ValueError as e:
+            # Retrying will never make a malformed payload parse
+            await self._dead_letter(entry, f"Invalid JSON: {str(e)}")
+            return
+
+        try:
+            result = await dispatch_abacatepay_event(webhook_data)
+        except Exception as e:
+            if entry["attempts"] >= WEBHOOK_MAX_ATTEMPTS:
+                await self._dead_letter(entry, str(e))
+                return
+            backoff = WEBHOOK_RETRY_BASE_SECONDS * 2 ** (entry["attempts"] - 1)
+            backoff *= random.uniform(0.5, 1.5)
+            await db.webhook_inbox.update_one(
+                {"id": entry["id"]},
+                {"$set": {
+                    "status": "pending",
+                    "last_error": str(e),
+                    "next_attempt_at": datetime.utcnow() + timedelta(seconds=backoff)
+                }}
+            )
+            print(f"🔁 Webhook {entry['id']} failed (attempt {entry['attempts']}), retrying in {backoff:.1f}s: {str(e)}")
+            return
+
+        processed_at = datetime.utcnow()
+        await db.webhook_inbox.update_one(
+            {"id": entry["id"]},
+            {"$set": {"status": "done", "processed_at": processed_at, "result": result}}
+        )
+        print(f"✅ Webhook {entry['id']} processed in {(processed_at - start_time).total_seconds():.3f} seconds")
+
+    async def _dead_letter(self, entry: Dict[str, Any], error: str):
+        entry.pop("_id", None)
+        entry.update({"status": "dead", "last_error": error, "dead_at": datetime.utcnow()})
+        await db.webhook_dead_letters.insert_one(entry)
+        await db.webhook_inbox.delete_one({"id": entry["id"]})
+        print(f"☠️ Webhook {entry['id']} moved to dead letters after {entry['attempts']} attempts: {error}")
+
+webhook_inbox = WebhookInbox(WEBHOOK_WORKERS)
+
+@api_router.post("/payments/webhook")
+async def webhook_abacatepay(request: Request):
+    """AbacatePay webhook endpoint - stores the payload and acknowledges immediately"""
+    start_time = datetime.utcnow()
+    
+    # Get client IP for logging
+    client_ip = request.client.host if request.client else "unknown"
+    print(f"🥑 AbacatePay Webhook received from IP: {client_ip} at {start_time.isoformat()}")
+    
+    # Validate webhook secret from query parameters
+    webhook_secret = request.query_params.get('webhookSecret')
+    if not webhook_secret or webhook_secret != abacate_webhook_secret:
+        print(f"❌ Invalid AbacatePay webhook secret. Received: {webhook_secret[:10] + '...' if webhook_secret else 'None'}")
+        raise HTTPException(status_code=401, detail="Invalid webhook secret")
+    
+    body = await request.body()
+    event_type = None
+    ordering_key = None
+    try:
+        webhook_data = json.loads(body)
+        event_type = webhook_data.get('event')
+        ordering_key = webhook_ordering_key(webhook_data)
+    except (ValueError, AttributeError):
+        # Stored anyway - the worker dead-letters it so nothing is silently lost
+        pass
+    
+    shard = webhook_inbox.shard_for(ordering_key)
+    inbox_id = str(uuid.uuid4())
+    await db.webhook_inbox.insert_one({
+        "id": inbox_id,
+        "body": body.decode('utf-8', errors='replace'),
+        "event": event_type,
+        "ordering_key": ordering_key,
+        "shard": shard,
+        "status": "pending",
+        "attempts": 0,
+        "client_ip": client_ip,
+        "received_at": start_time,
+        "next_attempt_at": start_time
+    })
+    webhook_inbox.notify(shard)
+    
+    return {
+        "received": True,
+        "queued": True,
+        "inbox_id": inbox_id,
+        "event": event_type,
+        "ack_time_seconds": (datetime.utcnow() - start_time).total_seconds()
+    }
+
+@api_router.get("/payments/webhook-inbox/stats")
+async def get_webhook_inbox_stats():
+    """Inbox depth per status and dead-letter count"""
+    statuses = await db.webhook_inbox.aggregate([
+        {"$group": {"_id": "$status", "count": {"$sum": 1}}}
+    ]).to_list(length=None)
+    return {
+        "workers": webhook_inbox.workers,
+        "inbox": {status["_id"]: status["count"] for status in statuses},
+        "dead_letters": await db.webhook_dead_letters.estimated_document_count()
+    }
+
+async def process_abacatepay_payment_success(webhook_data: Dict[str, Any]):
+    """Process successful AbacatePay payment with duplicate protection"""
+    try:
+        print(f"🥑 AbacatePay payment success webhook received")
+        
+        # Check for duplicate webhook processing
+        if await is_webhook_already_processed(webhook_data):
+            print(f"🚫 DUPLICATE WEBHOOK IGNORED - Preventing multiple processing")
+            return {"status": "duplicate_ignored", "message": "Webhook already processed"}
+        
+        print(f"🥑 Processing NEW webhook - Event: {webhook_data.get('event')}, keys: {list((webhook_data.get('data') or {}).keys())}")
+        
+        payment_data = webhook_data.get('data', {})
+        payment_info = payment_data.get('payment', {})
+        pix_info = payment_data.get('pixQrCode', {})
+        
+        # Extract payment details from real AbacatePay format
         amount = payment_info.get('amount', 0) / 100  # Convert from cents to reais
         fee = payment_info.get('fee', 80) / 100  # AbacatePay fee in reais
         
@@ -971,6 +2196,13 @@ async def process_abacatepay_payment_success(webhook_data: Dict[str, Any]):
             print(f"📋 Transaction found by amount matching: {'Yes' if transaction else 'No'}")
         
         if transaction:
+            # A retry after an approval whose credit failed finishes that credit;
+            # the ledger id keeps it from landing twice
+            if transaction.get("status") == TransactionStatus.APPROVED and transaction.get("credited") is False:
+                print(f"🔁 Finishing the credit of approved transaction {transaction['id']}")
+                credited = await credit_approved_deposits(transaction["approval_batch"])
+                return {"status": "processed", "message": "Payment credit completed", "amount": transaction["amount"] if credited else 0.0}
+            
             # CRITICAL: Check if transaction was already processed to prevent double crediting
             if transaction.get("status") == TransactionStatus.APPROVED:
                 print(f"🚫 TRANSACTION ALREADY APPROVED - Preventing double credit")
@@ -982,52 +2214,25 @@ async def process_abacatepay_payment_success(webhook_data: Dict[str, Any]):
             print(f"   Transaction ID: {transaction['id']}")
             print(f"   Original Amount: R$ {transaction['amount']}")
             
-            # Update transaction status atomically to prevent race conditions
-            result = await db.transactions.update_one(
-                {
-                    "id": transaction["id"],
-                    "status": TransactionStatus.PENDING  # Only update if still pending
-                },
-                {"$set": {
-                    "status": TransactionStatus.APPROVED,
-                    "updated_at": datetime.utcnow(),
-                    "fee": fee,
-                    "net_amount": amount - fee,
+            # Approve and credit in one claimed step - only one webhook wins the approval
+            approved = await approve_deposits(
+                [transaction["id"]], "webhook", fee=fee,
+                details={
                     "external_reference": billing_id,
                     "payment_method": "PIX",
                     "webhook_processed_at": datetime.utcnow()
-                }}
+                }
             )
             
-            if result.modified_count == 0:
+            if not approved:
                 print(f"🚫 RACE CONDITION DETECTED - Transaction already processed by another webhook")
                 return {"status": "race_condition", "message": "Transaction already being processed"}
             
-            print(f"✅ Transaction updated to APPROVED (atomic update successful)")
-            
-            # Get current user balance before update
-            user = await db.users.find_one({"id": transaction["user_id"]})
-            old_balance = user.get("balance", 0) if user else 0
-            
             # Credit user balance - FULL AMOUNT (AbacatePay fee absorbed by platform)
-            credit_amount = amount  # User gets full amount, platform absorbs AbacatePay fee
-            update_result = await db.users.update_one(
-                {"id": transaction["user_id"]},
-                {"$inc": {"balance": credit_amount}}
-            )
-            
-            if update_result.modified_count == 0:
-                print(f"⚠️ WARNING: User balance update failed")
-                return {"status": "balance_update_failed", "message": "Failed to update user balance"}
-            
-            # Get updated balance
-            updated_user = await db.users.find_one({"id": transaction["user_id"]})
-            new_balance = updated_user.get("balance", 0) if updated_user else 0
+            credit_amount = approved[0]["amount"]
             
             print(f"✅ AbacatePay: Balance updated for user {transaction['user_id']}")
-            print(f"   Old balance: R$ {old_balance:.2f}")
             print(f"   Credit amount: +R$ {credit_amount:.2f}")
-            print(f"   New balance: R$ {new_balance:.2f}")
             
             # Success notification
             print(f"🎉 PAYMENT PROCESSED SUCCESSFULLY (NO DUPLICATES)!")
@@ -1054,6 +2259,11 @@ async def process_abacatepay_payment_success(webhook_data: Dict[str, Any]):
         print(f"❌ Error processing AbacatePay success: {str(e)}")
         import traceback
         print(f"❌ Full traceback: {traceback.format_exc()}")
+        # A retry of this webhook must not be dropped as a duplicate
+        try:
+            await forget_webhook(webhook_data)
+        except PyMongoError:
+            pass
         raise e
 
 async def process_abacatepay_payment_failure(webhook_data: Dict[str, Any]):
@@ -1102,12 +2312,10 @@ async def process_abacatepay_payment_cancellation(webhook_data: Dict[str, Any]):
 
 @api_router.post("/payments/withdraw")
 async def withdraw_funds(withdraw_request: WithdrawRequest):
-    user = await db.users.find_one({"id": withdraw_request.user_id})
+    # Deduct from user balance
+    user = await debit_balance(withdraw_request.user_id, withdraw_request.amount)
     if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    
-    if user["balance"] < withdraw_request.amount:
-        raise HTTPException(status_code=400, detail="Insufficient balance")
+        await raise_debit_failure(withdraw_request.user_id)
     
     # Create withdrawal transaction
     fee = 0.0  # No fee for withdrawal
@@ -1124,12 +2332,6 @@ async def withdraw_funds(withdraw_request: WithdrawRequest):
     )
     await db.transactions.insert_one(transaction.dict())
     
-    # Deduct from user balance
-    await db.users.update_one(
-        {"id": withdraw_request.user_id},
-        {"$inc": {"balance": -withdraw_request.amount}}
-    )
-    
     # In a real implementation, you would integrate with a transfer API
     # For now, we'll mark it as approved immediately
     await db.transactions.update_one(
@@ -1145,9 +2347,13 @@ async def withdraw_funds(withdraw_request: WithdrawRequest):
     return {"message": "Withdrawal request processed", "transaction_id": transaction.id}
 
 @api_router.get("/transactions/{user_id}")
-async def get_user_transactions(user_id: str):
-    transactions = await db.transactions.find({"user_id": user_id}).sort("created_at", -1).to_list(100)
-    return [Transaction(**tx) for tx in transactions]
+async def get_user_transactions(user_id: str, limit: int = DEFAULT_PAGE_SIZE, cursor: Optional[str] = None):
+    """User's transactions newest first, one page per call"""
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    transactions, next_cursor = await keyset_page(
+        db.transactions, {"user_id": user_id}, CREATED_AT_PAGE_KEY, limit, cursor
+    )
+    return {"items": [Transaction(**tx) for tx in transactions], "next_cursor": next_cursor}
 
 @api_router.post("/admin/make-admin/{user_email}")
 async def make_user_admin(user_email: str):
@@ -1174,7 +2380,7 @@ async def make_user_admin(user_email: str):
 @api_router.get("/admin/check-admin/{user_id}")
 async def check_admin_status(user_id: str):
     """Check if a user is admin"""
-    user = await db.users.find_one({"id": user_id})
+    user = await get_user_loader().load(user_id)
     if not user:
         raise HTTPException(status_code=404, detail="Usuário não encontrado")
     
@@ -1185,53 +2391,454 @@ async def check_admin_status(user_id: str):
         "is_admin": user.get("is_admin", False)
     }
 
+# In-memory order book for automatic matching
+def opposite_side(side: str) -> str:
+    return "B" if side == "A" else "A"
+
+class BetOrderBook:
+    """FIFO queues of waiting bets keyed by (event_id, side, amount)
+
+    Matching pops from the head of the opposite queue with no awaits in
+    between, so two requests in the same process can never grab the same
+    resting bet. connect_bets still claims the bet conditionally in Mongo,
+    which covers other worker processes.
+
+    Each (event_id, side) also has a price ladder sorted by (amount, arrival)
+    so tolerance mode can find the closest amount with two bisects.
+    """
+
+    # Only what create_bet needs from a resting bet
+    FIELDS = ("id", "event_id", "side", "side_name", "amount", "creator_id", "creator_name", "expires_at")
+
+    def __init__(self):
+        self.queues: Dict[tuple, "OrderedDict[str, Dict]"] = {}
+        self.ladders: Dict[tuple, List[tuple]] = {}
+        self.entries: Dict[str, Dict] = {}
+        self.sequence = itertools.count()
+        self.loaded = False
+
+    @staticmethod
+    def book_key(event_id: str, side: str, amount: float) -> tuple:
+        return (event_id, side, round(float(amount), 2))
+
+    def add(self, bet: Dict[str, Any]):
+        key = self.book_key(bet["event_id"], bet["side"], bet["amount"])
+        entry = {field: bet.get(field) for field in self.FIELDS}
+        entry["amount"] = key[2]
+        entry["rung"] = (key[2], next(self.sequence), entry["id"])
+        self.queues.setdefault(key, OrderedDict())[entry["id"]] = entry
+        bisect.insort(self.ladders.setdefault(key[:2], []), entry["rung"])
+        self.entries[entry["id"]] = entry
+
+    def restore(self, popped: Dict[str, Any]):
+        """Put back a bet taken by pop_match/pop_closest at its old place in line"""
+        entry = {field: popped.get(field) for field in self.FIELDS}
+        entry["amount"] = popped["amount"]
+        entry["rung"] = popped["rung"]
+        key = self.book_key(entry["event_id"], entry["side"], entry["amount"])
+        queue = self.queues.setdefault(key, OrderedDict())
+        queue[entry["id"]] = entry
+        # It was the oldest at its amount when it was popped
+        queue.move_to_end(entry["id"], last=False)
+        bisect.insort(self.ladders.setdefault(key[:2], []), entry["rung"])
+        self.entries[entry["id"]] = entry
+
+    def remove(self, bet_id: str) -> Optional[Dict]:
+        entry = self.entries.pop(bet_id, None)
+        if entry is None:
+            return None
+
+        key = self.book_key(entry["event_id"], entry["side"], entry["amount"])
+        queue = self.queues[key]
+        queue.pop(bet_id, None)
+        if not queue:
+            del self.queues[key]
+
+        ladder = self.ladders[key[:2]]
+        index = bisect.bisect_left(ladder, entry["rung"])
+        del ladder[index]
+        if not ladder:
+            del self.ladders[key[:2]]
+        return entry
+
+    def pop_match(self, event_id: str, side: str, amount: float) -> Optional[Dict]:
+        """Take the oldest unexpired bet from the opposite side at the same amount"""
+        key = self.book_key(event_id, opposite_side(side), amount)
+        current_time = datetime.utcnow()
+
+        while key in self.queues:
+            bet_id = next(iter(self.queues[key]))
+            entry = self.remove(bet_id)
+            # Expired bets are left for the expiry processing to refund
+            if entry["expires_at"] and entry["expires_at"] <= current_time:
+                continue
+            return entry
+
+        return None
+
+    def pop_closest(self, event_id: str, side: str, amount: float, tolerance: float) -> Optional[Dict]:
+        """Take the opposite bet whose amount is closest to ours within the band
+
+        Equal amounts are served oldest first. Returns None if nothing on the
+        other side is within ``tolerance`` of ``amount``.
+        """
+        amount = round(float(amount), 2)
+        current_time = datetime.utcnow()
+
+        while True:
+            ladder = self.ladders.get((event_id, opposite_side(side)))
+            if not ladder:
+                return None
+
+            candidates = []
+            # Oldest bet at the smallest amount >= ours
+            above = bisect.bisect_left(ladder, (amount,))
+            if above < len(ladder):
+                candidates.append(ladder[above])
+            # Oldest bet at the largest amount < ours
+            if above > 0:
+                below_amount = ladder[above - 1][0]
+                candidates.append(ladder[bisect.bisect_left(ladder, (below_amount,))])
+
+            candidates = [rung for rung in candidates if abs(rung[0] - amount) <= tolerance + 1e-9]
+            if not candidates:
+                return None
+
+            best = min(candidates, key=lambda rung: (round(abs(rung[0] - amount), 2), rung[1]))
+            entry = self.remove(best[2])
+            if entry["expires_at"] and entry["expires_at"] <= current_time:
+                continue
+            return entry
+
+    def take_event(self, event_id: str) -> List[Dict]:
+        """Remove and return every unexpired bet resting on an event, oldest first"""
+        rungs = self.ladders.get((event_id, "A"), []) + self.ladders.get((event_id, "B"), [])
+        rungs.sort(key=lambda rung: rung[1])
+        current_time = datetime.utcnow()
+
+        taken = []
+        for rung in rungs:
+            entry = self.remove(rung[2])
+            if entry["expires_at"] and entry["expires_at"] <= current_time:
+                continue
+            taken.append(entry)
+        return taken
+
+    def __len__(self):
+        return len(self.entries)
+
+    async def rebuild(self):
+        """Load every waiting bet from Mongo, oldest first"""
+        self.queues.clear()
+        self.ladders.clear()
+        self.entries.clear()
+
+        projection = {field: 1 for field in self.FIELDS}
+        projection["_id"] = 0
+        cursor = db.bets.find(
+            {"status": BetStatus.WAITING, "opponent_id": None, "event_id": {"$exists": True}},
+            projection
+        ).sort("created_at", ASCENDING)
+        async for bet in cursor:
+            if "side" in bet:
+                self.add(bet)
+
+        self.loaded = True
+        print(f"📒 Order book rebuilt with {len(self)} waiting bets")
+
+order_book = BetOrderBook()
+
+# Amount band (R$) for pairing bets of different amounts. 0 keeps exact matching.
+BET_MATCH_TOLERANCE = float(os.environ.get('BET_MATCH_TOLERANCE', '0'))
+
 async def find_matching_bet(event_id: str, side: str, amount: float) -> Optional[Dict]:
-    """Find a matching bet for automatic pairing"""
+    """Find a matching bet for automatic pairing
+
+    The returned bet carries ``matched_amount``: the stake both sides play
+    for, which is the smaller of the two amounts in tolerance mode.
+    """
     # Look for opposite side bet with same event_id and amount
-    opposite_side = "B" if side == "A" else "A"
-    
-    matching_bet = await db.bets.find_one({
-        "event_id": event_id,
-        "side": opposite_side,
-        "amount": amount,
-        "status": BetStatus.WAITING,
-        "opponent_id": None  # Still looking for opponent
-    })
+    if order_book.loaded:
+        if BET_MATCH_TOLERANCE > 0:
+            matching_bet = order_book.pop_closest(event_id, side, amount, BET_MATCH_TOLERANCE)
+        else:
+            matching_bet = order_book.pop_match(event_id, side, amount)
+    else:
+        # Book not loaded yet (startup still running) - ask Mongo directly
+        matching_bet = await db.bets.find_one({
+            "event_id": event_id,
+            "side": opposite_side(side),
+            "amount": amount,
+            "status": BetStatus.WAITING,
+            "opponent_id": None  # Still looking for opponent
+        }, sort=[("created_at", ASCENDING)])
     
     if matching_bet:
+        matching_bet["matched_amount"] = min(float(amount), float(matching_bet["amount"]))
         print(f"🎯 Found matching bet for event {event_id}: {matching_bet['id']}")
-        print(f"   Original side: {side}, Matching side: {opposite_side}")
+        print(f"   Original side: {side}, Matching side: {opposite_side(side)}")
+        if matching_bet["amount"] != amount:
+            print(f"   Amounts: R$ {amount:.2f} vs R$ {matching_bet['amount']:.2f}, matched at R$ {matching_bet['matched_amount']:.2f}")
     
     return matching_bet
 
-async def connect_bets(bet1_id: str, bet2_id: str, user2_id: str, user2_name: str):
-    """Connect two matching bets"""
-    try:
-        # Update the original bet with opponent info
-        await db.bets.update_one(
-            {"id": bet1_id},
-            {"$set": {
-                "opponent_id": user2_id,
-                "opponent_name": user2_name,
-                "status": BetStatus.ACTIVE
-            }}
-        )
-        
-        # Mark the second bet as connected (we'll keep both for reference)
-        await db.bets.update_one(
-            {"id": bet2_id},
-            {"$set": {
-                "opponent_id": "MATCHED",  # Special marker
-                "status": BetStatus.ACTIVE
-            }}
-        )
-        
-        print(f"✅ Connected bets: {bet1_id} ↔ {bet2_id}")
-        
-        return True
-    except Exception as e:
-        print(f"❌ Error connecting bets: {str(e)}")
+async def connect_bets(bet1_id: str, bet2_id: str, user2_id: str, user2_name: str, matched_amount: Optional[float] = None):
+    """Connect two matching bets
+
+    ``matched_amount`` overrides the stake on both bets when they were
+    paired by tolerance matching with different amounts. Returns False if
+    bet1 was taken by someone else; database errors propagate so the caller
+    can give the candidate back.
+    """
+    # The original bet carries the pot for the pair; the second bet is
+    # inserted by the caller with the same pair_id and is never paid.
+    update = {
+        "opponent_id": user2_id,
+        "opponent_name": user2_name,
+        "status": BetStatus.ACTIVE,
+        "pair_id": bet1_id
+    }
+    if matched_amount is not None:
+        update["amount"] = matched_amount
+    
+    # Claim the original bet - only succeeds if nobody else matched it first
+    result = await db.bets.update_one(
+        {"id": bet1_id, "status": BetStatus.WAITING, "opponent_id": None},
+        {"$set": update}
+    )
+    if result.modified_count == 0:
+        print(f"🚫 Bet {bet1_id} was already matched or is no longer waiting")
         return False
+    
+    print(f"✅ Connected bets: {bet1_id} ↔ {bet2_id}")
+    
+    return True
+
+async def refund_stake_difference(user_id: str, difference: float, description: str):
+    """Give back the part of a stake that was not matched in tolerance mode"""
+    if difference <= 0:
+        return
+    
+    await credit_balance(user_id, difference)
+    
+    refund_transaction = Transaction(
+        user_id=user_id,
+        amount=difference,
+        fee=0.0,
+        net_amount=difference,
+        type=TransactionType.BET_CREDIT,
+        status=TransactionStatus.APPROVED,
+        description=description
+    )
+    await db.transactions.insert_one(refund_transaction.dict())
+
+# How many resting bets create_bet tries before giving up and waiting
+MAX_MATCH_ATTEMPTS = 3
+
+# Batch call-auction matching
+# Events listed in BET_AUCTION_EVENTS skip one-by-one matching in create_bet.
+# Their bets are collected for BET_AUCTION_WINDOW_MS and paired in a single
+# vectorized pass together with whatever is resting in the order book.
+BET_AUCTION_EVENTS = {
+    event_id.strip() for event_id in os.environ.get('BET_AUCTION_EVENTS', '').split(',')
+    if event_id.strip()
+}
+BET_AUCTION_WINDOW_MS = int(os.environ.get('BET_AUCTION_WINDOW_MS', '250'))
+
+def pair_auction_bets(sides: np.ndarray, amounts: np.ndarray) -> np.ndarray:
+    """Pair side A with side B at equal amounts, oldest first
+
+    Bets are given in arrival order. Returns an (n, 2) array of
+    (side A index, side B index) pairs.
+    """
+    cents = np.round(amounts * 100).astype(np.int64)
+    arrival = np.arange(len(cents))
+
+    def ranked(mask):
+        # Order one side by (amount, arrival) and number bets within each amount
+        indexes = arrival[mask]
+        indexes = indexes[np.lexsort((indexes, cents[indexes]))]
+        side_cents = cents[indexes]
+        _, group_starts = np.unique(side_cents, return_index=True)
+        group_sizes = np.diff(np.append(group_starts, len(side_cents)))
+        ranks = np.arange(len(side_cents)) - np.repeat(group_starts, group_sizes)
+        # The n-th A bet at an amount pairs with the n-th B bet at that amount
+        return indexes, side_cents * len(cents) + ranks
+
+    a_indexes, a_keys = ranked(sides == "A")
+    b_indexes, b_keys = ranked(sides == "B")
+    _, a_positions, b_positions = np.intersect1d(a_keys, b_keys, assume_unique=True, return_indices=True)
+    return np.column_stack((a_indexes[a_positions], b_indexes[b_positions]))
+
+class CallAuction:
+    """Per-event batches of incoming bets, cleared after a short window"""
+
+    def __init__(self, window_seconds: float):
+        self.window_seconds = window_seconds
+        self.pending: Dict[str, "OrderedDict[str, Dict]"] = {}
+        self.opened_at: Dict[str, float] = {}
+        self.timers: Dict[str, asyncio.Task] = {}
+        self.stats = deque(maxlen=200)
+
+    def submit(self, bet: Dict[str, Any]):
+        event_id = bet["event_id"]
+        if event_id not in self.pending:
+            self.pending[event_id] = OrderedDict()
+            self.opened_at[event_id] = time.perf_counter()
+            self.timers[event_id] = asyncio.create_task(self._clear_after_window(event_id))
+        self.pending[event_id][bet["id"]] = {field: bet.get(field) for field in BetOrderBook.FIELDS}
+
+    def remove(self, bet_id: str) -> Optional[Dict]:
+        for batch in self.pending.values():
+            if bet_id in batch:
+                return batch.pop(bet_id)
+        return None
+
+    async def _clear_after_window(self, event_id: str):
+        await asyncio.sleep(self.window_seconds)
+        try:
+            await self.clear(event_id)
+        except Exception as e:
+            print(f"❌ Auction for {event_id} failed: {str(e)}")
+
+    async def clear(self, event_id: str) -> Optional[Dict[str, Any]]:
+        """Pair everything collected for the event and commit it in one bulk write"""
+        batch = self.pending.pop(event_id, None)
+        opened_at = self.opened_at.pop(event_id, time.perf_counter())
+        self.timers.pop(event_id, None)
+        if batch is None:
+            return None
+
+        clear_started = time.perf_counter()
+        resting = order_book.take_event(event_id)
+        bets = resting + list(batch.values())
+        if not bets:
+            return None
+
+        auction_id = str(uuid.uuid4())
+        try:
+            sides = np.array([bet["side"] for bet in bets])
+            amounts = np.array([bet["amount"] for bet in bets], dtype=float)
+            pairs = pair_auction_bets(sides, amounts)
+
+            # Stakes were already debited when each bet was created, so pairing
+            # only has to flip both bets to active with their opponent. Every
+            # claim carries this auction's id so we can tell which ones landed.
+            operations = []
+            for a_index, b_index in pairs.tolist():
+                first, second = bets[a_index], bets[b_index]
+                for bet, opponent in ((first, second), (second, first)):
+                    operations.append(UpdateOne(
+                        {"id": bet["id"], "status": BetStatus.WAITING, "opponent_id": None},
+                        {"$set": {
+                            "opponent_id": opponent["creator_id"],
+                            "opponent_name": opponent["creator_name"],
+                            "status": BetStatus.ACTIVE,
+                            "pair_id": first["id"],
+                            "auction_id": auction_id
+                        }}
+                    ))
+
+            claimed = set()
+            if operations:
+                result = await db.bets.bulk_write(operations, ordered=False)
+                if result.modified_count == len(operations):
+                    claimed = {bets[index]["id"] for pair in pairs.tolist() for index in pair}
+                else:
+                    claimed = {
+                        bet["id"] async for bet in
+                        db.bets.find({"auction_id": auction_id}, {"_id": 0, "id": 1})
+                    }
+
+            # A bet whose partner changed state before the commit (cancelled,
+            # expired, joined) goes back to waiting instead of staying active alone
+            paired = set()
+            rollbacks = []
+            for a_index, b_index in pairs.tolist():
+                first, second = bets[a_index], bets[b_index]
+                if first["id"] in claimed and second["id"] in claimed:
+                    paired.update((a_index, b_index))
+                    continue
+                for index, bet in ((a_index, first), (b_index, second)):
+                    if bet["id"] in claimed:
+                        rollbacks.append(UpdateOne(
+                            {"id": bet["id"], "auction_id": auction_id, "status": BetStatus.ACTIVE},
+                            {"$set": {"opponent_id": None, "opponent_name": None, "status": BetStatus.WAITING, "pair_id": None},
+                             "$unset": {"auction_id": ""}}
+                        ))
+                    else:
+                        paired.add(index)  # No longer waiting; keep it out of the book
+            if rollbacks:
+                await db.bets.bulk_write(rollbacks, ordered=False)
+                print(f"⚠️ Auction {event_id}: {len(rollbacks)} bets lost their partner before commit and went back to waiting")
+
+            # Whatever did not pair rests in the book for the next auction
+            for index, bet in enumerate(bets):
+                if index not in paired:
+                    order_book.add(bet)
+
+        except Exception:
+            await self._abort(event_id, auction_id, resting, list(batch.values()))
+            raise
+
+        finished = time.perf_counter()
+        stats = {
+            "event_id": event_id,
+            "cleared_at": datetime.utcnow().isoformat(),
+            "incoming_bets": len(batch),
+            "resting_bets": len(resting),
+            "matched_pairs": len(pairs),
+            "match_rate": round(2 * len(pairs) / len(bets), 4),
+            "bets_committed": len(claimed) - len(rollbacks),
+            "window_latency_ms": round((finished - opened_at) * 1000, 2),
+            "clear_duration_ms": round((finished - clear_started) * 1000, 2)
+        }
+        self.stats.append(stats)
+        print(f"🔨 Auction {event_id}: {len(pairs)} pairs from {len(bets)} bets in {stats['clear_duration_ms']} ms")
+        return stats
+
+    async def _abort(self, event_id: str, auction_id: str, resting: List[Dict], incoming: List[Dict]):
+        """Undo a clear that failed part way and put every bet back in the book"""
+        try:
+            await db.bets.update_many(
+                {"auction_id": auction_id, "status": BetStatus.ACTIVE},
+                {"$set": {"opponent_id": None, "opponent_name": None, "status": BetStatus.WAITING, "pair_id": None},
+                 "$unset": {"auction_id": ""}}
+            )
+        except PyMongoError as e:
+            # Claims are conditional on WAITING, so a still-active bet left
+            # in the book is skipped by the matcher rather than paired twice
+            print(f"⚠️ Auction {event_id}: could not roll back claims of {auction_id}: {str(e)}")
+        # Resting bets keep their place in line (restore puts each at the front)
+        for entry in reversed(resting):
+            order_book.restore(entry)
+        for bet in incoming:
+            order_book.add(bet)
+
+    async def clear_all(self):
+        for event_id in list(self.pending):
+            timer = self.timers.get(event_id)
+            if timer:
+                timer.cancel()
+            await self.clear(event_id)
+
+call_auction = CallAuction(BET_AUCTION_WINDOW_MS / 1000)
+
+def forget_waiting_bet(bet_id: str):
+    """Drop a bet that is no longer waiting from every in-memory matcher"""
+    order_book.remove(bet_id)
+    call_auction.remove(bet_id)
+
+@api_router.get("/admin/auctions/stats")
+async def get_auction_stats(limit: int = 50):
+    """Recent call-auction results (match rate and latency per auction)"""
+    recent = list(call_auction.stats)[-limit:]
+    return {
+        "auction_events": sorted(BET_AUCTION_EVENTS),
+        "window_ms": BET_AUCTION_WINDOW_MS,
+        "open_auctions": {event_id: len(batch) for event_id, batch in call_auction.pending.items()},
+        "auctions": list(reversed(recent))
+    }
 
 # Bet Routes (Modified for real currency)
 @api_router.post("/bets", response_model=Bet)
@@ -1239,22 +2846,10 @@ async def create_bet(bet_data: BetCreate):
     """Create a new bet with automatic matching system"""
     print(f"🎯 Creating bet for event: {bet_data.event_id}, side: {bet_data.side} ({bet_data.side_name})")
     
-    # Check if user exists and has enough balance
-    user = await db.users.find_one({"id": bet_data.creator_id})
+    # Deduct amount from creator's balance (fails if missing or not enough balance)
+    user = await debit_balance(bet_data.creator_id, bet_data.amount)
     if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    
-    if user["balance"] < bet_data.amount:
-        raise HTTPException(status_code=400, detail="Insufficient balance")
-    
-    # Look for matching bet FIRST (before deducting balance)
-    matching_bet = await find_matching_bet(bet_data.event_id, bet_data.side, bet_data.amount)
-    
-    # Deduct amount from creator's balance
-    await db.users.update_one(
-        {"id": bet_data.creator_id},
-        {"$inc": {"balance": -bet_data.amount}}
-    )
+        await raise_debit_failure(bet_data.creator_id)
     
     # Create bet debit transaction
     fee = 0.0  # No fee for bet creation
@@ -1276,77 +2871,141 @@ async def create_bet(bet_data: BetCreate):
     bet_dict["creator_name"] = user["name"]
     bet = Bet(**bet_dict)
     
-    # Check if we found a matching bet for automatic connection
-    if matching_bet:
+    if bet.event_id in BET_AUCTION_EVENTS:
+        # Matched in the next auction for this event
+        await db.bets.insert_one(bet.dict())
+        call_auction.submit(bet.dict())
+        expiry_scheduler.schedule(bet.id, bet.expires_at)
+        print(f"🔨 Bet queued for auction on event {bet.event_id}")
+        return bet
+    
+    # Look for a matching bet for automatic connection. A candidate can be
+    # lost to another worker between lookup and claim, so try a few.
+    for _ in range(MAX_MATCH_ATTEMPTS):
+        matching_bet = await find_matching_bet(bet_data.event_id, bet_data.side, bet_data.amount)
+        if not matching_bet:
+            break
+        
         print(f"🎉 AUTO-MATCHING: Found opposite bet!")
         print(f"   Original bet: {matching_bet['side']} ({matching_bet.get('side_name', 'Unknown')})")
         print(f"   New bet: {bet.side} ({bet.side_name})")
         
+        # Both sides play for the smaller stake when amounts differ
+        matched_amount = matching_bet["matched_amount"]
+        amounts_differ = matched_amount != matching_bet["amount"] or matched_amount != bet.amount
+        
+        # Update the original matching bet
+        try:
+            success = await connect_bets(
+                matching_bet["id"], bet.id, bet.creator_id, bet.creator_name,
+                matched_amount if amounts_differ else None
+            )
+        except PyMongoError as e:
+            # The candidate is still waiting in Mongo - keep it in the book and
+            # let the new bet wait too rather than fail after the debit
+            print(f"❌ Error connecting bets: {str(e)}")
+            if "rung" in matching_bet:
+                order_book.restore(matching_bet)
+            break
+        if not success:
+            print("⚠️ Failed to connect bets, trying next candidate")
+            continue
+        
         # Connect the bets automatically
         bet.opponent_id = matching_bet["creator_id"]
         bet.opponent_name = matching_bet["creator_name"] 
         bet.status = BetStatus.ACTIVE
+        bet.pair_id = matching_bet["id"]
         
-        # Also deduct from the matching bet's creator (if not already done)
-        matching_user = await db.users.find_one({"id": matching_bet["creator_id"]})
-        if matching_user and matching_user["balance"] >= matching_bet["amount"]:
-            await db.users.update_one(
-                {"id": matching_bet["creator_id"]},
-                {"$inc": {"balance": -matching_bet["amount"]}}
+        if amounts_differ:
+            await refund_stake_difference(
+                bet.creator_id, bet.amount - matched_amount,
+                f"Ajuste de valor - aposta pareada em R$ {matched_amount:.2f}"
             )
-            
+            await refund_stake_difference(
+                matching_bet["creator_id"], matching_bet["amount"] - matched_amount,
+                f"Ajuste de valor - aposta pareada em R$ {matched_amount:.2f}"
+            )
+            bet.amount = matched_amount
+        
+        # Also deduct from the matching bet's creator (if not already done)
+        matching_user = await debit_balance(matching_bet["creator_id"], matched_amount)
+        if matching_user:
             # Create transaction for matching bet user
             matching_transaction = Transaction(
                 user_id=matching_bet["creator_id"],
-                amount=matching_bet["amount"],
+                amount=matched_amount,
                 fee=0.0,
-                net_amount=matching_bet["amount"],
+                net_amount=matched_amount,
                 type=TransactionType.BET_DEBIT,
                 status=TransactionStatus.APPROVED,
                 description=f"Aposta conectada - {bet_data.event_description} ({matching_bet.get('side_name', 'Unknown')})"
             )
             await db.transactions.insert_one(matching_transaction.dict())
         
-        # Update the original matching bet
-        success = await connect_bets(matching_bet["id"], bet.id, bet.creator_id, bet.creator_name)
-        
-        if success:
-            print(f"✅ BETS CONNECTED AUTOMATICALLY!")
-            print(f"   {matching_bet['creator_name']} ({matching_bet['side']}) vs {bet.creator_name} ({bet.side})")
-        else:
-            print(f"⚠️ Failed to connect bets, bet will remain in waiting status")
-    else:
+        print(f"✅ BETS CONNECTED AUTOMATICALLY!")
+        print(f"   {matching_bet['creator_name']} ({matching_bet['side']}) vs {bet.creator_name} ({bet.side})")
+        break
+    
+    if bet.status == BetStatus.WAITING:
         print(f"⏳ No matching bet found, bet will wait for opponent")
     
     await db.bets.insert_one(bet.dict())
+    
+    if bet.status == BetStatus.WAITING:
+        order_book.add(bet.dict())
+        expiry_scheduler.schedule(bet.id, bet.expires_at)
+    
     return bet
 
+async def claim_waiting_bet(bet_filter: Dict[str, Any], user_id: str) -> Optional[Dict[str, Any]]:
+    """Atomically move a waiting bet with no opponent to active for user_id
+
+    Only one of any number of concurrent joiners can win the claim. Returns
+    the claimed bet, or None if it did not match or was already taken.
+    """
+    return await db.bets.find_one_and_update(
+        {**bet_filter, "status": BetStatus.WAITING, "opponent_id": None},
+        {"$set": {"opponent_id": user_id, "status": BetStatus.ACTIVE}},
+        return_document=ReturnDocument.AFTER
+    )
+
+async def release_claimed_bet(bet: Dict[str, Any], user_id: str):
+    """Undo claim_waiting_bet when the joiner could not pay"""
+    result = await db.bets.update_one(
+        {"id": bet["id"], "opponent_id": user_id, "status": BetStatus.ACTIVE},
+        {"$set": {"opponent_id": None, "opponent_name": None, "status": BetStatus.WAITING}}
+    )
+    if result.modified_count:
+        expiry_scheduler.schedule(bet["id"], bet["expires_at"])
+        if "event_id" in bet and "side" in bet:
+            order_book.add(bet)
+
 @api_router.post("/bets/{bet_id}/join", response_model=Bet)
 async def join_bet(bet_id: str, join_data: JoinBet):
-    # Get the bet
-    bet = await db.bets.find_one({"id": bet_id})
+    # Claim the bet first - the predicate guarantees a single winner
+    bet = await claim_waiting_bet({"id": bet_id, "creator_id": {"$ne": join_data.user_id}}, join_data.user_id)
     if not bet:
-        raise HTTPException(status_code=404, detail="Bet not found")
-    
-    if bet["status"] != BetStatus.WAITING:
+        bet = await db.bets.find_one({"id": bet_id})
+        if not bet:
+            raise HTTPException(status_code=404, detail="Bet not found")
+        
+        if bet["creator_id"] == join_data.user_id:
+            raise HTTPException(status_code=400, detail="Cannot join your own bet")
+        
         raise HTTPException(status_code=400, detail="Bet is not available to join")
     
-    if bet["creator_id"] == join_data.user_id:
-        raise HTTPException(status_code=400, detail="Cannot join your own bet")
+    forget_waiting_bet(bet_id)
     
-    # Check if user exists and has enough balance
-    user = await db.users.find_one({"id": join_data.user_id})
+    # Deduct amount from opponent's balance (fails if missing or not enough balance)
+    try:
+        user = await debit_balance(join_data.user_id, bet["amount"])
+    except Exception:
+        await release_claimed_bet(bet, join_data.user_id)
+        raise
     if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    
-    if user["balance"] < bet["amount"]:
-        raise HTTPException(status_code=400, detail="Insufficient balance")
-    
-    # Deduct amount from opponent's balance
-    await db.users.update_one(
-        {"id": join_data.user_id},
-        {"$inc": {"balance": -bet["amount"]}}
-    )
+        await release_claimed_bet(bet, join_data.user_id)
+        await raise_debit_failure(join_data.user_id)
     
     # Create bet debit transaction for opponent
     fee = 0.0  # No fee for bet join
@@ -1363,20 +3022,14 @@ async def join_bet(bet_id: str, join_data: JoinBet):
     )
     await db.transactions.insert_one(transaction.dict())
     
-    # Update bet with opponent info
+    # Name is only known after the debit returns the user
     await db.bets.update_one(
         {"id": bet_id},
-        {
-            "$set": {
-                "opponent_id": join_data.user_id,
-                "opponent_name": user["name"],
-                "status": BetStatus.ACTIVE
-            }
-        }
+        {"$set": {"opponent_name": user["name"]}}
     )
+    bet["opponent_name"] = user["name"]
     
-    updated_bet = await db.bets.find_one({"id": bet_id})
-    return Bet(**updated_bet)
+    return Bet(**bet)
 
 @api_router.post("/bets/{bet_id}/declare-winner", response_model=Bet)
 async def declare_winner(bet_id: str, winner_data: DeclareWinner):
@@ -1391,6 +3044,13 @@ async def declare_winner(bet_id: str, winner_data: DeclareWinner):
     if not bet:
         raise HTTPException(status_code=404, detail="Bet not found")
     
+    # A matched pair is paid once, through the half that carries the pot
+    if not carries_pot(bet) and bet.get("pair_id"):
+        bet_id = bet["pair_id"]
+        bet = await db.bets.find_one({"id": bet_id})
+        if not bet:
+            raise HTTPException(status_code=404, detail="Bet not found")
+    
     if bet["status"] != BetStatus.ACTIVE:
         raise HTTPException(status_code=400, detail="Bet is not active")
     
@@ -1399,7 +3059,7 @@ async def declare_winner(bet_id: str, winner_data: DeclareWinner):
         raise HTTPException(status_code=400, detail="Winner must be one of the participants")
     
     # Get winner info
-    winner = await db.users.find_one({"id": winner_data.winner_id})
+    winner = await get_user_loader().load(winner_data.winner_id)
     if not winner:
         raise HTTPException(status_code=404, detail="Winner not found")
     
@@ -1409,10 +3069,7 @@ async def declare_winner(bet_id: str, winner_data: DeclareWinner):
     winner_payout = total_pot - platform_fee  # 80% to winner
     
     # Transfer winnings to winner (total pot minus 20% platform fee)
-    await db.users.update_one(
-        {"id": winner_data.winner_id},
-        {"$inc": {"balance": winner_payout}}
-    )
+    await credit_balance(winner_data.winner_id, winner_payout)
     
     # Create bet credit transaction for winner (showing net amount received)
     winner_transaction = Transaction(
@@ -1454,96 +3111,693 @@ async def declare_winner(bet_id: str, winner_data: DeclareWinner):
         }
     )
     
+    # Close the other half of the pair without paying it again
+    await db.bets.update_many(
+        {"pair_id": bet_id, "id": {"$ne": bet_id}, "status": BetStatus.ACTIVE},
+        {
+            "$set": {
+                "winner_id": winner_data.winner_id,
+                "winner_name": winner["name"],
+                "status": BetStatus.COMPLETED,
+                "completed_at": datetime.utcnow()
+            }
+        }
+    )
+    
     updated_bet = await db.bets.find_one({"id": bet_id})
     return Bet(**updated_bet)
 
-@api_router.get("/bets", response_model=List[Bet])
-async def get_all_bets():
-    """Get all bets with legacy compatibility"""
-    bets = await db.bets.find().sort("created_at", -1).to_list(1000)
-    
-    # Fix for legacy bets without new required fields
-    fixed_bets = []
-    for bet in bets:
-        # Add default values for missing required fields
-        if "side" not in bet:
-            bet["side"] = "A"  # Default side
-        if "event_id" not in bet:
-            bet["event_id"] = f"legacy_{bet['id'][:8]}"  # Generate legacy event_id
-        if "side_name" not in bet:
-            bet["side_name"] = "Lado A"  # Default side name
-        if "event_title" not in bet:
-            bet["event_title"] = bet.get("event_description", "Evento Legacy")  # Use description as title
-        
-        try:
-            fixed_bets.append(Bet(**bet))
-        except Exception as e:
-            print(f"❌ Failed to process bet {bet.get('id', 'unknown')}: {str(e)}")
-    
-    return fixed_bets
+# Event-level bulk settlement
+PLATFORM_FEE_RATE = 0.20  # Same 20% declare_winner takes from every pot
+SETTLEMENT_CHUNK_SIZE = int(os.environ.get('SETTLEMENT_CHUNK_SIZE', '500'))
+# A chunk still ACTIVE this long after a settlement tagged it was left by a failed run
+SETTLEMENT_CLAIM_GRACE_SECONDS = 60
+
+# Progress of the latest settlement per event, served by the progress endpoint
+settlement_progress: Dict[str, Dict[str, Any]] = {}
+
+class SettleEvent(BaseModel):
+    winning_side: str  # "A" or "B"
+    admin_user_id: str
+
+def carries_pot(bet: Dict[str, Any]) -> bool:
+    """Whether settling this bet pays out its pot
+
+    Two matched bets describe the same wager, so only the half named by
+    pair_id is paid. The MATCHED marker is how older pairs flagged the
+    other half.
+    """
+    return bet.get("opponent_id") != "MATCHED" and bet.get("pair_id") in (None, bet["id"])
+
+async def settle_bet_chunk(bets: List[Dict[str, Any]], winning_side: str, settled_at: datetime) -> Dict[str, float]:
+    """Pay out one chunk of claimed bets with a bulk write per collection
+
+    Payouts and their transactions are keyed by the bet (settle:<bet_id>),
+    so settling a chunk again after a partial failure pays nobody twice.
+    """
+    credits = []
+    transactions = []
+    bet_updates = []
+    paid = 0.0
+    fees = 0.0
+
+    for bet in bets:
+        creator_won = bet.get("side") == winning_side
+        winner_id = bet["creator_id"] if creator_won else bet["opponent_id"]
+        winner_name = bet["creator_name"] if creator_won else bet.get("opponent_name")
+        update = {
+            "winner_id": winner_id,
+            "winner_name": winner_name,
+            "status": BetStatus.COMPLETED,
+            "completed_at": settled_at
+        }
+
+        if carries_pot(bet):
+            total_pot = bet["amount"] * 2
+            platform_fee = total_pot * PLATFORM_FEE_RATE
+            winner_payout = total_pot - platform_fee
+            ledger_id = f"settle:{bet['id']}:{winner_id}"
+            credits.append(ledger_credit(winner_id, winner_payout, ledger_id))
+            paid += winner_payout
+            fees += platform_fee
+            update.update({
+                "platform_fee": platform_fee,
+                "winner_payout": winner_payout,
+                "total_pot": total_pot
+            })
+            transactions.append({"_id": ledger_id, **Transaction(
+                user_id=winner_id,
+                amount=total_pot,
+                fee=platform_fee,
+                net_amount=winner_payout,
+                type=TransactionType.BET_CREDIT,
+                status=TransactionStatus.APPROVED,
+                description=f"Vitória na aposta - {bet['event_description']}"
+            ).dict()})
+            transactions.append({"_id": f"settle-fee:{bet['id']}", **Transaction(
+                user_id="platform",
+                amount=platform_fee,
+                fee=0.0,
+                net_amount=platform_fee,
+                type=TransactionType.PLATFORM_FEE,
+                status=TransactionStatus.APPROVED,
+                description=f"Taxa da plataforma (20%) - {bet['event_description']}"
+            ).dict()})
+
+        bet_updates.append(UpdateOne({"id": bet["id"]}, {"$set": update}))
+
+    if credits:
+        await db.users.bulk_write(credits, ordered=False)
+    await insert_ledger_transactions(transactions)
+    if bet_updates:
+        await db.bets.bulk_write(bet_updates, ordered=False)
+
+    return {"paid": paid, "fees": fees}
+
+@api_router.post("/events/{event_id}/settle")
+async def settle_event(event_id: str, settle_data: SettleEvent):
+    """Settle every active bet on an event in bulk - ADMIN ONLY"""
+    admin_user = await verify_admin_access(settle_data.admin_user_id)
+    if settle_data.winning_side not in ("A", "B"):
+        raise HTTPException(status_code=400, detail="winning_side must be A or B")
+    
+    current = settlement_progress.get(event_id)
+    if current and current["status"] == "running":
+        raise HTTPException(status_code=409, detail="Settlement already running for this event")
+    
+    print(f"🏁 Admin {admin_user['name']} is settling event {event_id} (side {settle_data.winning_side} won)")
+    
+    def active_query() -> Dict[str, Any]:
+        # Untagged bets, plus bets a failed settlement tagged and never finished
+        cutoff = datetime.utcnow() - timedelta(seconds=SETTLEMENT_CLAIM_GRACE_SECONDS)
+        return {"event_id": event_id, "status": BetStatus.ACTIVE, "settlement_claimed_at": {"$not": {"$gt": cutoff}}}
+    
+    settlement_id = str(uuid.uuid4())
+    started = time.perf_counter()
+    settled_at = datetime.utcnow()
+    progress = {
+        "settlement_id": settlement_id,
+        "event_id": event_id,
+        "winning_side": settle_data.winning_side,
+        "status": "running",
+        "total_bets": await db.bets.count_documents(active_query()),
+        "settled_bets": 0,
+        "total_paid": 0.0,
+        "total_fees": 0.0,
+        "started_at": settled_at.isoformat()
+    }
+    settlement_progress[event_id] = progress
+    
+    try:
+        while True:
+            chunk_query = active_query()
+            chunk_ids = [
+                bet["id"] async for bet in
+                db.bets.find(chunk_query, {"id": 1, "_id": 0}).limit(SETTLEMENT_CHUNK_SIZE)
+            ]
+            if not chunk_ids:
+                break
+            
+            # Tag the chunk first so a concurrent settlement does not take it as well
+            await db.bets.update_many(
+                {**chunk_query, "id": {"$in": chunk_ids}},
+                {"$set": {"settlement_id": settlement_id, "settlement_claimed_at": datetime.utcnow()}}
+            )
+            claimed = await db.bets.find(
+                {"id": {"$in": chunk_ids}, "settlement_id": settlement_id}, {"_id": 0}
+            ).to_list(length=len(chunk_ids))
+            
+            totals = await settle_bet_chunk(claimed, settle_data.winning_side, settled_at)
+            progress["settled_bets"] += len(claimed)
+            progress["total_paid"] += totals["paid"]
+            progress["total_fees"] += totals["fees"]
+            print(f"   🏁 {event_id}: {progress['settled_bets']}/{progress['total_bets']} bets settled")
+    except Exception as e:
+        progress["status"] = "failed"
+        progress["error"] = str(e)
+        print(f"❌ Settlement of {event_id} failed: {str(e)}")
+        # Hand the unfinished chunk back so a re-run can take it at once;
+        # if this fails too, the re-run takes it after the claim grace period
+        try:
+            await db.bets.update_many(
+                {"settlement_id": settlement_id, "status": BetStatus.ACTIVE},
+                {"$unset": {"settlement_id": "", "settlement_claimed_at": ""}}
+            )
+        except PyMongoError:
+            pass
+        raise HTTPException(status_code=500, detail=f"Settlement failed: {str(e)}")
+    
+    progress["status"] = "completed"
+    progress["duration_seconds"] = round(time.perf_counter() - started, 3)
+    print(f"✅ Event {event_id} settled: {progress['settled_bets']} bets, R$ {progress['total_paid']:.2f} paid in {progress['duration_seconds']}s")
+    return progress
+
+@api_router.get("/events/{event_id}/settle/progress")
+async def get_settlement_progress(event_id: str):
+    """Progress of the latest settlement for an event"""
+    progress = settlement_progress.get(event_id)
+    if not progress:
+        raise HTTPException(status_code=404, detail="No settlement found for this event")
+    return progress
+
+# Parimutuel pool betting
+# Instead of 1v1 bets, stakes on an event go into one pool per side. Winners
+# split the whole pool (minus the platform fee) in proportion to their stake.
+# A settlement document stays "running" until every payout is written, and
+# the process running it holds a lease on it; startup finishes settlements
+# whose lease expired, which pays only the users not paid before the crash.
+POOL_WRITE_CHUNK_SIZE = 1000
+POOL_SETTLEMENT_LEASE_SECONDS = 300
+
+class PoolStakeStatus(str, Enum):
+    OPEN = "open"
+    SETTLING = "settling"
+    WON = "won"
+    LOST = "lost"
+    REFUNDED = "refunded"
+
+class PoolStake(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    event_id: str
+    side: str  # "A" or "B"
+    user_id: str
+    amount: float
+    status: PoolStakeStatus = PoolStakeStatus.OPEN
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+class PoolStakeCreate(BaseModel):
+    user_id: str
+    side: str
+    amount: float
+
+class SettlePool(BaseModel):
+    winning_side: str
+    admin_user_id: str
+
+def compute_pool_payouts(sides: np.ndarray, amounts: np.ndarray, winning_side: str,
+                         fee_rate: float = PLATFORM_FEE_RATE):
+    """Return (payout per stake, platform fee, refunded) for a settled pool
+
+    If either side is empty there is nobody to win from, so every stake is
+    refunded in full and no fee is taken.
+    """
+    winners = sides == winning_side
+    total = amounts.sum()
+    winning_total = amounts[winners].sum()
+
+    if winning_total == 0 or winning_total == total:
+        return amounts.copy(), 0.0, True
+
+    distributable = total * (1 - fee_rate)
+    payouts = np.where(winners, amounts * (distributable / winning_total), 0.0)
+    payouts = np.floor(payouts * 100) / 100  # Never pay out fractions of a cent
+    return payouts, float(total - payouts.sum()), False
+
+@api_router.post("/pools/{event_id}/stakes", response_model=PoolStake)
+async def create_pool_stake(event_id: str, stake_data: PoolStakeCreate):
+    """Put a stake into one side of an event pool"""
+    if stake_data.side not in ("A", "B"):
+        raise HTTPException(status_code=400, detail="side must be A or B")
+    if stake_data.amount <= 0:
+        raise HTTPException(status_code=400, detail="Amount must be positive")
+    if await db.pool_settlements.find_one({"event_id": event_id}, {"_id": 1}):
+        raise HTTPException(status_code=400, detail="Pool is already settled")
+    
+    user = await debit_balance(stake_data.user_id, stake_data.amount)
+    if not user:
+        await raise_debit_failure(stake_data.user_id)
+    
+    stake = PoolStake(event_id=event_id, **stake_data.dict())
+    await db.pool_stakes.insert_one(stake.dict())
+    
+    transaction = Transaction(
+        user_id=stake_data.user_id,
+        amount=stake_data.amount,
+        fee=0.0,
+        net_amount=stake_data.amount,
+        type=TransactionType.BET_DEBIT,
+        status=TransactionStatus.APPROVED,
+        description=f"Aposta no bolão - {event_id} (Lado {stake_data.side})"
+    )
+    await db.transactions.insert_one(transaction.dict())
+    
+    # Settlement may have started between the check above and the insert.
+    # Settlement moves every OPEN stake to SETTLING after writing its
+    # pool_settlements document, so a stake that is still OPEN once that
+    # document exists was missed and is refunded here.
+    if await db.pool_settlements.find_one({"event_id": event_id}, {"_id": 1}):
+        await refund_late_pool_stake(stake)
+        raise HTTPException(status_code=400, detail="Pool is already settled")
+    
+    return stake
+
+async def refund_late_pool_stake(stake: PoolStake):
+    """Give back a stake that arrived after its pool started settling"""
+    result = await db.pool_stakes.update_one(
+        {"event_id": stake.event_id, "status": PoolStakeStatus.OPEN, "id": stake.id},
+        {"$set": {"status": PoolStakeStatus.REFUNDED}}
+    )
+    if result.modified_count == 0:
+        return  # Settlement picked it up after all
+    
+    await credit_balance(stake.user_id, stake.amount)
+    await db.transactions.insert_one(Transaction(
+        user_id=stake.user_id,
+        amount=stake.amount,
+        fee=0.0,
+        net_amount=stake.amount,
+        type=TransactionType.BET_CREDIT,
+        status=TransactionStatus.APPROVED,
+        description=f"Reembolso do bolão - {stake.event_id} (aposta após o encerramento)"
+    ).dict())
+    print(f"↩️ Refunded late stake {stake.id} on settled pool {stake.event_id}")
+
+@api_router.get("/pools/{event_id}")
+async def get_pool(event_id: str):
+    """Current size of each side of an event pool"""
+    sides = await db.pool_stakes.aggregate([
+        {"$match": {"event_id": event_id}},
+        {"$group": {"_id": "$side", "total": {"$sum": "$amount"}, "stakes": {"$sum": 1}}}
+    ]).to_list(length=None)
+    settlement = await db.pool_settlements.find_one({"event_id": event_id}, {"_id": 0})
+    
+    return {
+        "event_id": event_id,
+        "sides": {side["_id"]: {"total": side["total"], "stakes": side["stakes"]} for side in sides},
+        "total_pool": sum(side["total"] for side in sides),
+        "settlement": settlement
+    }
+
+@api_router.post("/pools/{event_id}/settle")
+async def settle_pool(event_id: str, settle_data: SettlePool):
+    """Settle an event pool in one vectorized pass - ADMIN ONLY"""
+    admin_user = await verify_admin_access(settle_data.admin_user_id)
+    if settle_data.winning_side not in ("A", "B"):
+        raise HTTPException(status_code=400, detail="winning_side must be A or B")
+    
+    # The unique index on event_id makes this the settle-once guard
+    current_time = datetime.utcnow()
+    settlement = {
+        "id": str(uuid.uuid4()),
+        "event_id": event_id,
+        "winning_side": settle_data.winning_side,
+        "settled_by": admin_user["id"],
+        "status": "running",
+        "started_at": current_time,
+        "lease_until": current_time + timedelta(seconds=POOL_SETTLEMENT_LEASE_SECONDS)
+    }
+    try:
+        await db.pool_settlements.insert_one(dict(settlement))
+    except DuplicateKeyError:
+        raise HTTPException(status_code=409, detail="Pool already settled")
+    
+    print(f"🏊 Admin {admin_user['name']} is settling pool {event_id} (side {settle_data.winning_side} won)")
+    return await run_pool_settlement(settlement)
+
+async def run_pool_settlement(settlement: Dict[str, Any]) -> Dict[str, Any]:
+    """Pay out a pool settlement, or finish one a crashed run left running
+
+    Stakes are tagged only until the settlement records stakes_tagged, so a
+    resumed run settles exactly the stakes the first run did and computes
+    the same payouts. Credits carry the ledger id pool:<settlement_id>:<user_id>,
+    so users paid before a crash are not paid again.
+    """
+    settlement_id = settlement["id"]
+    event_id = settlement["event_id"]
+    winning_side = settlement["winning_side"]
+    started = time.perf_counter()
+    
+    if not settlement.get("stakes_tagged"):
+        # Tag what we are settling so stakes arriving from now on are not touched
+        await db.pool_stakes.update_many(
+            {"event_id": event_id, "status": PoolStakeStatus.OPEN},
+            {"$set": {"status": PoolStakeStatus.SETTLING, "settlement_id": settlement_id}}
+        )
+        await db.pool_settlements.update_one({"id": settlement_id}, {"$set": {"stakes_tagged": True}})
+    user_ids, sides, amounts = [], [], []
+    cursor = db.pool_stakes.find(
+        {"settlement_id": settlement_id},
+        {"_id": 0, "user_id": 1, "side": 1, "amount": 1}
+    ).batch_size(10000)
+    async for stake in cursor:
+        user_ids.append(stake["user_id"])
+        sides.append(stake["side"])
+        amounts.append(stake["amount"])
+    loaded = time.perf_counter()
+    
+    amounts = np.array(amounts, dtype=float)
+    payouts, platform_fee, refunded = compute_pool_payouts(np.array(sides), amounts, winning_side)
+    
+    # Collapse to one credit per user
+    unique_users, user_index = np.unique(np.array(user_ids, dtype=object), return_inverse=True)
+    user_payouts = np.bincount(user_index, weights=payouts, minlength=len(unique_users))
+    credited = [(user_id, round(float(amount), 2)) for user_id, amount in zip(unique_users.tolist(), user_payouts) if amount > 0]
+    computed = time.perf_counter()
+    
+    description = (
+        f"Reembolso do bolão - {event_id}" if refunded
+        else f"Vitória no bolão - {event_id} (Lado {winning_side})"
+    )
+    for offset in range(0, len(credited), POOL_WRITE_CHUNK_SIZE):
+        chunk = credited[offset:offset + POOL_WRITE_CHUNK_SIZE]
+        await db.users.bulk_write(
+            [ledger_credit(user_id, amount, f"pool:{settlement_id}:{user_id}") for user_id, amount in chunk],
+            ordered=False
+        )
+        await insert_ledger_transactions([
+            {"_id": f"pool:{settlement_id}:{user_id}", **Transaction(
+                user_id=user_id,
+                amount=amount,
+                fee=0.0,
+                net_amount=amount,
+                type=TransactionType.BET_CREDIT,
+                status=TransactionStatus.APPROVED,
+                description=description
+            ).dict()} for user_id, amount in chunk
+        ])
+    
+    if platform_fee > 0:
+        await insert_ledger_transactions([{"_id": f"pool-fee:{settlement_id}", **Transaction(
+            user_id="platform",
+            amount=platform_fee,
+            fee=0.0,
+            net_amount=platform_fee,
+            type=TransactionType.PLATFORM_FEE,
+            status=TransactionStatus.APPROVED,
+            description=f"Taxa da plataforma (20%) - bolão {event_id}"
+        ).dict()}])
+    
+    if refunded:
+        await db.pool_stakes.update_many({"settlement_id": settlement_id}, {"$set": {"status": PoolStakeStatus.REFUNDED}})
+    else:
+        await db.pool_stakes.update_many(
+            {"settlement_id": settlement_id, "side": winning_side},
+            {"$set": {"status": PoolStakeStatus.WON}}
+        )
+        await db.pool_stakes.update_many(
+            {"settlement_id": settlement_id, "side": {"$ne": winning_side}},
+            {"$set": {"status": PoolStakeStatus.LOST}}
+        )
+    finished = time.perf_counter()
+    
+    result = {
+        "status": "completed",
+        "refunded": refunded,
+        "stakes": len(amounts),
+        "users_credited": len(credited),
+        "total_pool": float(amounts.sum()),
+        "total_paid": float(payouts.sum()),
+        "platform_fee": platform_fee,
+        "load_ms": round((loaded - started) * 1000, 2),
+        "compute_ms": round((computed - loaded) * 1000, 2),
+        "write_ms": round((finished - computed) * 1000, 2),
+        "completed_at": datetime.utcnow()
+    }
+    await db.pool_settlements.update_one({"id": settlement_id}, {"$set": result, "$unset": {"lease_until": ""}})
+    
+    print(f"✅ Pool {event_id} settled: {len(amounts)} stakes, compute {result['compute_ms']} ms, total {round((finished - started) * 1000, 2)} ms")
+    return {"settlement_id": settlement_id, "event_id": event_id, "winning_side": winning_side, **result}
+
+async def resume_pool_settlements() -> int:
+    """Finish every running pool settlement whose lease expired, returning how many"""
+    resumed = 0
+    while True:
+        current_time = datetime.utcnow()
+        settlement = await db.pool_settlements.find_one_and_update(
+            {"status": "running", "lease_until": {"$not": {"$gt": current_time}}},
+            {"$set": {"lease_until": current_time + timedelta(seconds=POOL_SETTLEMENT_LEASE_SECONDS)}},
+            return_document=ReturnDocument.AFTER
+        )
+        if not settlement:
+            return resumed
+        print(f"🏊 Resuming interrupted settlement of pool {settlement['event_id']}")
+        await run_pool_settlement(settlement)
+        resumed += 1
+
+def normalize_legacy_bet(bet: Dict[str, Any]) -> Dict[str, Any]:
+    """Fill in fields that bets created before 1v1 sides existed are missing"""
+    if "side" not in bet:
+        bet["side"] = "A"  # Default side
+    if "event_id" not in bet:
+        bet["event_id"] = f"legacy_{bet['id'][:8]}"  # Generate legacy event_id
+    if "side_name" not in bet:
+        bet["side_name"] = "Lado A"  # Default side name
+    if "event_title" not in bet:
+        bet["event_title"] = bet.get("event_description", "Evento Legacy")  # Use description as title
+    return bet
+
+def bet_model(bet: Dict[str, Any]) -> Bet:
+    """Bet for a stored document; only pre-backfill documents need defaults"""
+    if bet.get("schema_version", 0) < BET_SCHEMA_VERSION:
+        normalize_legacy_bet(bet)
+    return Bet(**bet)
+
+def bet_documents(bets: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Response items for a page of bets read with BET_PROJECTION
+
+    Current documents are returned as stored. Only documents the backfill
+    has not reached yet (or could not repair) are normalized and validated.
+    """
+    items = []
+    for bet in bets:
+        if bet.get("schema_version", 0) >= BET_SCHEMA_VERSION:
+            items.append(bet)
+            continue
+        try:
+            items.append(bet_model(bet).model_dump())
+        except Exception as e:
+            print(f"❌ Failed to process bet {bet.get('id', 'unknown')}: {str(e)}")
+    return items
+
+# Legacy bet backfill
+# Writes the legacy defaults into old bets once and stamps them with
+# BET_SCHEMA_VERSION so read paths can return them as stored. Works through
+# the bets in id order, BET_BACKFILL_CHUNK_SIZE at a time, and records the
+# last id in the migrations collection after every chunk, so an interrupted
+# run resumes where it stopped. Updates only touch documents still below the
+# target version, which makes re-running it harmless. One process at a time
+# holds a lease on the migration document, and startup skips the run once
+# the migration is marked completed.
+BET_BACKFILL_CHUNK_SIZE = int(os.environ.get('BET_BACKFILL_CHUNK_SIZE', '500'))
+BET_BACKFILL_ON_STARTUP = os.environ.get('BET_BACKFILL_ON_STARTUP', 'true').lower() == 'true'
+BET_BACKFILL_LEASE_SECONDS = 300
+BET_BACKFILL_MIGRATION_ID = f"bets_schema_v{BET_SCHEMA_VERSION}"
+LEGACY_BET_QUERY = {"schema_version": {"$not": {"$gte": BET_SCHEMA_VERSION}}}
+
+bet_backfill_lock = asyncio.Lock()
+bet_backfill_task: Optional[asyncio.Task] = None
+
+async def run_bet_backfill(skip_completed: bool = False) -> Optional[Dict[str, Any]]:
+    """Run the backfill if no other process holds its lease
+
+    Returns the final migration state, or None when the run was skipped.
+    """
+    async with bet_backfill_lock:
+        started = time.perf_counter()
+        current_time = datetime.utcnow()
+        state = await db.migrations.find_one({"_id": BET_BACKFILL_MIGRATION_ID}) or {}
+        if skip_completed and state.get("status") == "completed":
+            print(f"🧱 Bet backfill to schema v{BET_SCHEMA_VERSION} already completed")
+            return None
+        
+        # Take the lease; the filter only matches when nobody holds a live
+        # one, and the upsert fails on _id when somebody does
+        run_id = str(uuid.uuid4())
+        try:
+            claimed = await db.migrations.find_one_and_update(
+                {"_id": BET_BACKFILL_MIGRATION_ID, "$or": [
+                    {"status": {"$ne": "running"}},
+                    {"lease_until": {"$not": {"$gt": current_time}}}
+                ]},
+                {"$set": {
+                    "status": "running",
+                    "run_id": run_id,
+                    "lease_until": current_time + timedelta(seconds=BET_BACKFILL_LEASE_SECONDS),
+                    "updated_at": current_time
+                }, "$setOnInsert": {"started_at": current_time, "migrated": 0, "invalid": 0}},
+                upsert=True,
+                return_document=ReturnDocument.BEFORE
+            )
+        except DuplicateKeyError:
+            print("🧱 Bet backfill is running in another process")
+            return None
+        
+        # Resume an interrupted run; a finished one starts over to catch stragglers
+        previous = claimed or {}
+        last_id = previous.get("last_id") if previous.get("status") == "running" else None
+        remaining = await db.bets.count_documents(LEGACY_BET_QUERY)
+        await db.migrations.update_one(
+            {"_id": BET_BACKFILL_MIGRATION_ID, "run_id": run_id},
+            {"$set": {"last_id": last_id, "remaining_at_start": remaining}}
+        )
+        print(f"🧱 Bet backfill to schema v{BET_SCHEMA_VERSION}: {remaining} legacy bets" + (f", resuming after {last_id}" if last_id else ""))
+        
+        while True:
+            query = dict(LEGACY_BET_QUERY)
+            if last_id:
+                query["id"] = {"$gt": last_id}
+            chunk = await db.bets.find(query, {"_id": 0}).sort("id", ASCENDING).limit(
+                BET_BACKFILL_CHUNK_SIZE
+            ).to_list(length=BET_BACKFILL_CHUNK_SIZE)
+            if not chunk:
+                break
+            
+            updates = []
+            invalid_ids = []
+            for bet in chunk:
+                defaults = {
+                    field: value for field, value in normalize_legacy_bet(dict(bet)).items()
+                    if field not in bet
+                }
+                try:
+                    Bet(**bet, **defaults)
+                except Exception as e:
+                    # Left at its old version; reads keep skipping it as before
+                    print(f"⚠️ Bet {bet.get('id', 'unknown')} cannot be migrated: {str(e)}")
+                    invalid_ids.append(bet["id"])
+                    continue
+                updates.append(UpdateOne(
+                    {"id": bet["id"], **LEGACY_BET_QUERY},
+                    {"$set": {**defaults, "schema_version": BET_SCHEMA_VERSION}}
+                ))
+            
+            if updates:
+                await db.bets.bulk_write(updates, ordered=False)
+            last_id = chunk[-1]["id"]
+            now = datetime.utcnow()
+            renewed = await db.migrations.update_one(
+                {"_id": BET_BACKFILL_MIGRATION_ID, "run_id": run_id},
+                {
+                    "$set": {
+                        "last_id": last_id,
+                        "updated_at": now,
+                        "lease_until": now + timedelta(seconds=BET_BACKFILL_LEASE_SECONDS)
+                    },
+                    "$inc": {"migrated": len(updates), "invalid": len(invalid_ids)},
+                    "$push": {"invalid_ids": {"$each": invalid_ids, "$slice": -100}}
+                }
+            )
+            if renewed.matched_count == 0:
+                # Our lease expired and another process took over from last_id
+                print(f"⚠️ Bet backfill lease lost after {last_id}, stopping")
+                return None
+        
+        elapsed = round(time.perf_counter() - started, 2)
+        await db.migrations.update_one(
+            {"_id": BET_BACKFILL_MIGRATION_ID, "run_id": run_id},
+            {"$set": {"status": "completed", "last_id": None, "completed_at": datetime.utcnow(), "duration_seconds": elapsed},
+             "$unset": {"lease_until": ""}}
+        )
+        state = await db.migrations.find_one({"_id": BET_BACKFILL_MIGRATION_ID})
+        print(f"✅ Bet backfill completed in {elapsed}s ({state['migrated']} migrated, {state['invalid']} invalid in total)")
+        return state
+
+def start_bet_backfill(skip_completed: bool = False) -> bool:
+    """Run the backfill in the background unless it is already running here"""
+    global bet_backfill_task
+    if bet_backfill_task and not bet_backfill_task.done():
+        return False
+    bet_backfill_task = asyncio.create_task(run_bet_backfill(skip_completed))
+    return True
+
+@api_router.post("/admin/migrations/bets-backfill")
+async def trigger_bet_backfill(admin_user_id: str):
+    """ADMIN: Start (or resume) the legacy bet backfill"""
+    await verify_admin_access(admin_user_id)
+    started = start_bet_backfill()
+    return {
+        "started": started,
+        "message": "Backfill started" if started else "Backfill already running",
+        "migration_id": BET_BACKFILL_MIGRATION_ID
+    }
+
+@api_router.get("/admin/migrations/bets-backfill")
+async def get_bet_backfill_progress(admin_user_id: str):
+    """ADMIN: Progress of the legacy bet backfill"""
+    await verify_admin_access(admin_user_id)
+    state = await db.migrations.find_one({"_id": BET_BACKFILL_MIGRATION_ID}) or {"status": "not_started"}
+    state.pop("_id", None)
+    return {
+        "migration_id": BET_BACKFILL_MIGRATION_ID,
+        "schema_version": BET_SCHEMA_VERSION,
+        "running": bool(bet_backfill_task and not bet_backfill_task.done()),
+        "legacy_bets_remaining": await db.bets.count_documents(LEGACY_BET_QUERY),
+        **state
+    }
+
+@api_router.get("/bets")
+async def get_all_bets(limit: int = DEFAULT_PAGE_SIZE, cursor: Optional[str] = None):
+    """Get bets newest first, one page per call"""
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    bets, next_cursor = await keyset_page(db.bets, {}, CREATED_AT_PAGE_KEY, limit, cursor, projection=BET_PROJECTION)
+    return {"items": bet_documents(bets), "next_cursor": next_cursor}
 
 @api_router.get("/bets/waiting")
-async def get_waiting_bets():
-    """Get all waiting bets that haven't expired"""
+async def get_waiting_bets(limit: int = DEFAULT_PAGE_SIZE, cursor: Optional[str] = None):
+    """Get waiting bets that haven't expired, newest first"""
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
     current_time = datetime.utcnow()
-    bets = await db.bets.find({
+    bets, next_cursor = await keyset_page(db.bets, {
         "status": BetStatus.WAITING,
         "expires_at": {"$gt": current_time}
-    }).to_list(length=1000)
-    
-    # Fix for legacy bets without new required fields
-    fixed_bets = []
-    for bet in bets:
-        # Add default values for missing required fields
-        if "side" not in bet:
-            bet["side"] = "A"  # Default side
-        if "event_id" not in bet:
-            bet["event_id"] = f"legacy_{bet['id'][:8]}"  # Generate legacy event_id
-        if "side_name" not in bet:
-            bet["side_name"] = "Lado A"  # Default side name
-        if "event_title" not in bet:
-            bet["event_title"] = bet.get("event_description", "Evento Legacy")  # Use description as title
-        
-        try:
-            fixed_bets.append(Bet(**bet))
-        except Exception as e:
-            print(f"❌ Failed to process bet {bet.get('id', 'unknown')}: {str(e)}")
-    
-    return fixed_bets
+    }, CREATED_AT_PAGE_KEY, limit, cursor, projection=BET_PROJECTION)
+    return {"items": bet_documents(bets), "next_cursor": next_cursor}
 
 @api_router.get("/bets/user/{user_id}")
-async def get_user_bets(user_id: str):
-    """Get user bets with legacy compatibility"""
-    bets = await db.bets.find({
+async def get_user_bets(user_id: str, limit: int = DEFAULT_PAGE_SIZE, cursor: Optional[str] = None):
+    """Get user bets newest first"""
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    bets, next_cursor = await keyset_page(db.bets, {
         "$or": [
             {"creator_id": user_id},
             {"opponent_id": user_id}
         ]
-    }).sort("created_at", -1).to_list(1000)
-    
-    # Fix for legacy bets without new required fields
-    fixed_bets = []
-    for bet in bets:
-        # Add default values for missing required fields
-        if "side" not in bet:
-            bet["side"] = "A"  # Default side
-        if "event_id" not in bet:
-            bet["event_id"] = f"legacy_{bet['id'][:8]}"  # Generate legacy event_id
-        if "side_name" not in bet:
-            bet["side_name"] = "Lado A"  # Default side name
-        if "event_title" not in bet:
-            bet["event_title"] = bet.get("event_description", "Evento Legacy")  # Use description as title
-        
-        try:
-            fixed_bets.append(Bet(**bet))
-        except Exception as e:
-            print(f"❌ Failed to process bet {bet.get('id', 'unknown')}: {str(e)}")
-    
-    return fixed_bets
+    }, CREATED_AT_PAGE_KEY, limit, cursor, projection=BET_PROJECTION)
+    return {"items": bet_documents(bets), "next_cursor": next_cursor}
 
 @api_router.get("/bets/invite/{invite_code}")
 async def get_bet_by_invite(invite_code: str):
-    """Get bet details by invite code with expiration check and legacy compatibility"""
+    """Get bet details by invite code with expiration check"""
     bet = await db.bets.find_one({"invite_code": invite_code})
     if not bet:
         raise HTTPException(status_code=404, detail="Convite não encontrado")
@@ -1553,73 +3807,55 @@ async def get_bet_by_invite(invite_code: str):
     if bet["expires_at"] < current_time and bet["status"] == BetStatus.WAITING:
         raise HTTPException(status_code=410, detail="Este convite expirou")
     
-    # Add default values for missing required fields (legacy compatibility)
-    if "side" not in bet:
-        bet["side"] = "A"  # Default side
-    if "event_id" not in bet:
-        bet["event_id"] = f"legacy_{bet['id'][:8]}"  # Generate legacy event_id
-    if "side_name" not in bet:
-        bet["side_name"] = "Lado A"  # Default side name
-    if "event_title" not in bet:
-        bet["event_title"] = bet.get("event_description", "Evento Legacy")  # Use description as title
-    
     try:
-        return Bet(**bet)
+        return bet_model(bet)
     except Exception as e:
         print(f"❌ Failed to process bet {bet.get('id', 'unknown')}: {str(e)}")
         raise HTTPException(status_code=500, detail="Erro interno do servidor ao processar convite")
 
 @api_router.post("/bets/join-by-invite/{invite_code}")
 async def join_bet_by_invite(invite_code: str, join_data: JoinBet):
-    """Join a bet using invite code with legacy compatibility"""
-    bet = await db.bets.find_one({"invite_code": invite_code})
-    if not bet:
-        raise HTTPException(status_code=404, detail="Convite não encontrado")
-    
-    # Check if bet is still valid (not expired)
+    """Join a bet using invite code"""
+    user_id = join_data.user_id
     current_time = datetime.utcnow()
-    if bet["expires_at"] < current_time and bet["status"] == BetStatus.WAITING:
-        raise HTTPException(status_code=410, detail="Este convite expirou")
     
-    if bet["status"] != BetStatus.WAITING:
+    # Claim the bet first - only unexpired waiting bets can be claimed
+    bet = await claim_waiting_bet(
+        {"invite_code": invite_code, "expires_at": {"$gt": current_time}},
+        user_id
+    )
+    if not bet:
+        bet = await db.bets.find_one({"invite_code": invite_code})
+        if not bet:
+            raise HTTPException(status_code=404, detail="Convite não encontrado")
+        
+        # Check if bet is still valid (not expired)
+        if bet["expires_at"] < current_time and bet["status"] == BetStatus.WAITING:
+            raise HTTPException(status_code=410, detail="Este convite expirou")
+        
         raise HTTPException(status_code=400, detail="Esta aposta não está mais disponível")
     
-    # Add default values for missing required fields (legacy compatibility)
-    if "side" not in bet:
-        bet["side"] = "A"  # Default side
-    if "event_id" not in bet:
-        bet["event_id"] = f"legacy_{bet['id'][:8]}"  # Generate legacy event_id
-    if "side_name" not in bet:
-        bet["side_name"] = "Lado A"  # Default side name
-    if "event_title" not in bet:
-        bet["event_title"] = bet.get("event_description", "Evento Legacy")  # Use description as title
-    
-    user_id = join_data.user_id
+    forget_waiting_bet(bet["id"])
     
-    # Check if user has enough balance
-    user = await db.users.find_one({"id": user_id})
+    # Deduct amount from joiner's balance (fails if missing or not enough balance)
+    try:
+        user = await debit_balance(user_id, bet["amount"])
+    except Exception:
+        await release_claimed_bet(bet, user_id)
+        raise
     if not user:
-        raise HTTPException(status_code=404, detail="Usuário não encontrado")
-    
-    if user["balance"] < bet["amount"]:
-        raise HTTPException(status_code=400, detail="Saldo insuficiente")
-    
-    # Deduct amount from joiner's balance
-    await db.users.update_one(
-        {"id": user_id},
-        {"$inc": {"balance": -bet["amount"]}}
-    )
+        await release_claimed_bet(bet, user_id)
+        await raise_debit_failure(user_id, "Usuário não encontrado", "Saldo insuficiente")
     
-    # Update bet with opponent information
+    # Name is only known after the debit returns the user
     await db.bets.update_one(
         {"id": bet["id"]},
         {"$set": {
-            "opponent_id": user_id,
             "opponent_name": user["name"],
-            "status": BetStatus.ACTIVE,
             "updated_at": current_time
         }}
     )
+    bet["opponent_name"] = user["name"]
     
     # Create transaction record for joiner
     transaction = Transaction(
@@ -1633,23 +3869,10 @@ async def join_bet_by_invite(invite_code: str, join_data: JoinBet):
     )
     await db.transactions.insert_one(transaction.dict())
     
-    # Get updated bet
-    updated_bet = await db.bets.find_one({"id": bet["id"]})
-    
-    # Add default values for legacy compatibility if needed
-    if "side" not in updated_bet:
-        updated_bet["side"] = "A"
-    if "event_id" not in updated_bet:
-        updated_bet["event_id"] = f"legacy_{updated_bet['id'][:8]}"
-    if "side_name" not in updated_bet:
-        updated_bet["side_name"] = "Lado A"
-    if "event_title" not in updated_bet:
-        updated_bet["event_title"] = updated_bet.get("event_description", "Evento Legacy")
-    
     try:
-        return Bet(**updated_bet)
+        return bet_model(bet)
     except Exception as e:
-        print(f"❌ Failed to process updated bet {updated_bet.get('id', 'unknown')}: {str(e)}")
+        print(f"❌ Failed to process updated bet {bet.get('id', 'unknown')}: {str(e)}")
         raise HTTPException(status_code=500, detail="Erro interno do servidor ao processar aposta atualizada")
 
 # Health Check
@@ -1659,39 +3882,69 @@ async def root():
 
 # Admin Payment Management Endpoints
 @api_router.get("/admin/pending-deposits")
-async def get_pending_deposits():
-    """Get all pending deposit transactions for admin approval"""
+async def get_pending_deposits(limit: int = 200, cursor: Optional[str] = None):
+    """Get pending deposit transactions for admin approval, newest first
+
+    The page (with user name and email joined in) and the totals over all
+    pending deposits are two aggregations run side by side. Pass
+    next_cursor back as cursor for the following page.
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    pending = {"status": TransactionStatus.PENDING, "type": TransactionType.DEPOSIT}
+    page_match = pending
+    if cursor:
+        page_match = {"$and": [pending, keyset_filter(CREATED_AT_PAGE_KEY, decode_cursor(cursor, CREATED_AT_PAGE_KEY))]}
+    page_pipeline = [
+        # Served by transactions_status_type_created_at_id, so deep pages
+        # start at the cursor instead of skipping everything before it
+        {"$match": page_match},
+        {"$sort": {"created_at": -1, "id": -1}},
+        {"$limit": limit + 1},
+        {"$lookup": {
+            "from": "users",
+            "let": {"user_id": "$user_id"},
+            "pipeline": [
+                {"$match": {"$expr": {"$eq": ["$id", "$$user_id"]}}},
+                {"$project": {"_id": 0, "name": 1, "email": 1}}
+            ],
+            "as": "user"
+        }},
+        # Deposits of deleted users stay on the page (and keep the cursor going)
+        {"$unwind": {"path": "$user", "preserveNullAndEmptyArrays": True}},
+        {"$project": {
+            "_id": 0,
+            "id": 1,
+            "user_id": 1,
+            "user_name": "$user.name",
+            "user_email": "$user.email",
+            "amount": 1,
+            "platform_fee": {"$ifNull": ["$fee", 0.80]},  # Platform absorbs this fee
+            "net_amount": "$amount",  # User gets full amount
+            "external_reference": {"$ifNull": ["$external_reference", "N/A"]},
+            "description": {"$ifNull": ["$description", ""]},
+            "created_at": 1,
+            "status": 1
+        }}
+    ]
+    totals_pipeline = [
+        {"$match": pending},
+        {"$group": {"_id": None, "count": {"$sum": 1}, "amount": {"$sum": "$amount"}}}
+    ]
+    
     try:
-        # Find all pending deposit transactions
-        pending_deposits = await db.transactions.find({
-            "status": TransactionStatus.PENDING,
-            "type": TransactionType.DEPOSIT
-        }).sort("created_at", -1).to_list(length=1000)
-        
-        # Enrich with user information
-        enriched_deposits = []
-        for deposit in pending_deposits:
-            user = await db.users.find_one({"id": deposit["user_id"]})
-            if user:
-                enriched_deposit = {
-                    "id": deposit["id"],
-                    "user_id": deposit["user_id"],
-                    "user_name": user["name"],
-                    "user_email": user["email"],
-                    "amount": deposit["amount"],
-                    "platform_fee": deposit.get("fee", 0.80),  # Platform absorbs this fee
-                    "net_amount": deposit["amount"],  # User gets full amount
-                    "external_reference": deposit.get("external_reference", "N/A"),
-                    "description": deposit.get("description", ""),
-                    "created_at": deposit["created_at"],
-                    "status": deposit["status"]
-                }
-                enriched_deposits.append(enriched_deposit)
+        deposits, totals = await asyncio.gather(
+            db.transactions.aggregate(page_pipeline).to_list(length=limit + 1),
+            db.transactions.aggregate(totals_pipeline).to_list(length=1)
+        )
+        
+        next_cursor = encode_cursor(deposits[limit - 1], CREATED_AT_PAGE_KEY) if len(deposits) > limit else None
+        totals = totals[0] if totals else {"count": 0, "amount": 0}
         
         return {
-            "pending_deposits": enriched_deposits,
-            "total_count": len(enriched_deposits),
-            "total_amount": sum(d["amount"] for d in enriched_deposits)
+            "pending_deposits": deposits[:limit],
+            "total_count": totals["count"],
+            "total_amount": totals["amount"],
+            "next_cursor": next_cursor
         }
         
     except Exception as e:
@@ -1715,32 +3968,28 @@ async def admin_approve_deposit(transaction_id: str):
             }
         
         # Get user info
-        user = await db.users.find_one({"id": transaction["user_id"]})
+        user_loader = get_user_loader()
+        user = await user_loader.load(transaction["user_id"])
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
         
         print(f"🔧 Admin manual approval for deposit: {transaction_id} - User: {user['name']}")
         
-        # Update transaction to approved
-        await db.transactions.update_one(
-            {"id": transaction_id},
-            {"$set": {
-                "status": TransactionStatus.APPROVED,
-                "updated_at": datetime.utcnow()
-            }}
-        )
+        # Approve and credit through the shared path so a concurrent webhook or
+        # reconciliation pass cannot credit the same deposit twice
+        if not await approve_deposits([transaction_id], "admin"):
+            return {
+                "message": "Deposit already approved", 
+                "status": "already_approved",
+                "transaction_id": transaction_id
+            }
         
-        # Credit user balance - FULL AMOUNT (AbacatePay fee absorbed by platform)
         net_amount = transaction["amount"]  # User gets full amount, platform absorbs AbacatePay fee
         platform_fee = transaction.get("fee", 0.80)  # Platform absorbs this fee
         
-        await db.users.update_one(
-            {"id": transaction["user_id"]},
-            {"$inc": {"balance": net_amount}}
-        )
-        
-        # Get updated user balance
-        updated_user = await db.users.find_one({"id": transaction["user_id"]})
+        # approve_deposits credits with a bulk write the loader cannot see
+        user_loader.clear(transaction["user_id"])
+        updated_user = await user_loader.load(transaction["user_id"])
         
         print(f"✅ Deposit approved: {transaction_id}, User: {user['name']}, Amount: R$ {transaction['amount']}, Net: R$ {net_amount} (FULL), Platform Fee: R$ {platform_fee}, New Balance: R$ {updated_user['balance']}")
         
@@ -1762,50 +4011,288 @@ async def admin_approve_deposit(transaction_id: str):
         raise HTTPException(status_code=500, detail=f"Failed to approve deposit: {str(e)}")
 
 # Auto Payment Verification System
-@api_router.post("/admin/auto-verify-payments")
-async def auto_verify_pending_payments():
-    """Automatically verify and process pending payments older than 5 minutes"""
-    print("🔄 Auto-verifying pending payments older than 5 minutes")
-    
+# Pending deposits are reconciled against AbacatePay by a background worker.
+# It walks PENDING deposits in (created_at, id) order one page at a time,
+# asks the gateway for each billing with at most RECONCILE_CONCURRENCY calls
+# in flight (with the SDK, which can only list billings, it lists them once
+# per pass), and approves everything the gateway reports as paid in one
+# batch through approve_deposits.
+RECONCILE_INTERVAL_SECONDS = float(os.environ.get('RECONCILE_INTERVAL_SECONDS', '60'))
+RECONCILE_PAGE_SIZE = int(os.environ.get('RECONCILE_PAGE_SIZE', '200'))
+RECONCILE_CONCURRENCY = int(os.environ.get('RECONCILE_CONCURRENCY', '8'))
+# Give the webhook a head start before polling the gateway for a deposit
+RECONCILE_MIN_AGE_SECONDS = float(os.environ.get('RECONCILE_MIN_AGE_SECONDS', '120'))
+# A credit claim still unfinished this long after it was taken was left by a failed run
+DEPOSIT_CREDIT_GRACE_SECONDS = 60
+
+async def approve_deposits(transaction_ids: List[str], source: str, fee: Optional[float] = None,
+                           details: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    """Approve pending deposits and credit their users, at most once each
+
+    Every path that approves a deposit (webhook, reconciliation, status
+    check, admin tools) goes through here. fee is the gateway fee when the
+    caller knows it, and details are extra fields recorded on the deposits.
+
+    Deposits are tagged with an approval batch in the same update that flips
+    them to APPROVED, so only the ones this call actually approved are
+    credited - a deposit approved concurrently elsewhere is skipped. The
+    batch id is also the credit claim, and deposits stay credited=False
+    until the balance update lands, so a failed credit is finished by
+    credit_approved_deposits.
+    """
+    if not transaction_ids:
+        return []
+    
+    batch_id = str(uuid.uuid4())
     current_time = datetime.utcnow()
-    five_minutes_ago = current_time - timedelta(minutes=5)
-    
-    # Find pending transactions older than 5 minutes
-    pending_transactions = await db.transactions.find({
-        "status": TransactionStatus.PENDING,
-        "type": TransactionType.DEPOSIT,
-        "created_at": {"$lt": five_minutes_ago}
-    }).to_list(length=1000)
-    
-    processed_count = 0
+    if fee is None:
+        fee_expression = {"$ifNull": ["$fee", 0.80]}  # AbacatePay fixed fee, as the webhook records it
+    else:
+        fee_expression = {"$literal": fee}
+    approval = {
+        "status": TransactionStatus.APPROVED.value,
+        "updated_at": current_time,
+        "fee": fee_expression,
+        "net_amount": {"$subtract": ["$amount", fee_expression]},
+        "approval_batch": batch_id,
+        "approved_by": source,
+        "credited": False,
+        "credit_claimed_at": current_time
+    }
+    for field, value in (details or {}).items():
+        approval[field] = {"$literal": value}
+    await db.transactions.update_many(
+        {"id": {"$in": transaction_ids}, "status": TransactionStatus.PENDING, "type": TransactionType.DEPOSIT},
+        [{"$set": approval}]
+    )
+    approved = await credit_approved_deposits(batch_id)
+    if approved:
+        print(f"✅ Approved {len(approved)} deposits via {source}")
+    return approved
+
+async def credit_approved_deposits(batch_id: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Credit users for approved deposits not credited yet
+
+    With batch_id only deposits claimed by that approval batch are credited.
+    Without it, deposits whose claim is older than DEPOSIT_CREDIT_GRACE_SECONDS
+    (left by a failed run) are claimed again under a fresh token first, so
+    overlapping sweeps do not pick up the same rows. Each credit carries the
+    ledger id deposit:<transaction_id>:<user_id>, so a deposit whose balance
+    update landed before a failure is never credited a second time.
+    """
+    query = {"type": TransactionType.DEPOSIT, "status": TransactionStatus.APPROVED, "credited": False}
+    if batch_id:
+        token = batch_id
+    else:
+        token = str(uuid.uuid4())
+        current_time = datetime.utcnow()
+        await db.transactions.update_many(
+            {**query, "credit_claimed_at": {"$not": {"$gt": current_time - timedelta(seconds=DEPOSIT_CREDIT_GRACE_SECONDS)}}},
+            {"$set": {"approval_batch": token, "credit_claimed_at": current_time}}
+        )
+    query["approval_batch"] = token
+    credited = []
+    
+    while True:
+        approved = await db.transactions.find(
+            query, {"_id": 0, "id": 1, "user_id": 1, "amount": 1}
+        ).limit(RECONCILE_PAGE_SIZE).to_list(length=RECONCILE_PAGE_SIZE)
+        if not approved:
+            break
+        
+        # Credit user balance - FULL AMOUNT (AbacatePay fee absorbed by platform)
+        await db.users.bulk_write(
+            [
+                ledger_credit(
+                    transaction["user_id"], transaction["amount"],
+                    f"deposit:{transaction['id']}:{transaction['user_id']}"
+                )
+                for transaction in approved
+            ],
+            ordered=False
+        )
+        await db.transactions.update_many(
+            {"id": {"$in": [transaction["id"] for transaction in approved]}, "approval_batch": token},
+            {"$set": {"credited": True}}
+        )
+        credited += approved
+        print(f"💰 Credited {len(approved)} approved deposits")
     
-    for transaction in pending_transactions:
-        try:
-            # Update transaction to approved
-            await db.transactions.update_one(
-                {"id": transaction["id"]},
-                {"$set": {
-                    "status": TransactionStatus.APPROVED,
-                    "updated_at": current_time
-                }}
-            )
+    return credited
+
+class DepositReconciler:
+    """Periodically settles PENDING deposits with the gateway's view of them"""
+
+    def __init__(self):
+        self.task: Optional[asyncio.Task] = None
+        self.running = asyncio.Lock()
+        self.runs = 0
+        self.checked_total = 0
+        self.approved_total = 0
+        self.errors_total = 0
+        self.last_run: Dict[str, Any] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return abacatepay_gateway.can_lookup_billings
+
+    async def _is_paid(self, semaphore: asyncio.Semaphore, transaction: Dict[str, Any],
+                       listed: Optional[Dict[str, Any]]) -> bool:
+        if listed is not None:
+            billing = listed.get(transaction["payment_id"])
+        else:
+            async with semaphore:
+                try:
+                    billing = await abacatepay_gateway.retrieve_billing(transaction["payment_id"])
+                except Exception as e:
+                    self.errors_total += 1
+                    print(f"❌ Reconciliation lookup failed for {transaction['id']}: {type(e).__name__}: {str(e)}")
+                    return False
+        return str(getattr(billing, 'status', '')).lower() == 'paid'
+
+    async def _list_billings(self) -> Optional[Dict[str, Any]]:
+        """Every billing by id when the client can only list them, else None"""
+        if abacatepay_gateway.can_retrieve_billing:
+            return None
+        # One list call per pass instead of one per pending deposit
+        return {billing.id: billing for billing in await abacatepay_gateway.list_billings()}
+
+    async def reconcile_once(self) -> Dict[str, Any]:
+        """One pass over every PENDING deposit older than the minimum age"""
+        async with self.running:
+            # Finish approvals whose credit failed on an earlier pass
+            await credit_approved_deposits()
             
-            # Credit user balance - FULL AMOUNT (AbacatePay fee absorbed by platform)
-            net_amount = transaction["amount"]  # User gets full amount, platform absorbs AbacatePay fee
-            await db.users.update_one(
-                {"id": transaction["user_id"]},
-                {"$inc": {"balance": net_amount}}
-            )
+            started = time.perf_counter()
+            current_time = datetime.utcnow()
+            cutoff = current_time - timedelta(seconds=RECONCILE_MIN_AGE_SECONDS)
+            semaphore = asyncio.Semaphore(RECONCILE_CONCURRENCY)
+            base_query = {
+                "status": TransactionStatus.PENDING,
+                "type": TransactionType.DEPOSIT,
+                "created_at": {"$lt": cutoff}
+            }
+            checked = 0
+            approved = 0
+            oldest: Optional[datetime] = None
+            last_key: Optional[tuple] = None
+            listed: Optional[Dict[str, Any]] = None
+            listed_fetched = False
             
-            processed_count += 1
-            print(f"✅ Auto-verified transaction {transaction['id']}, credited: R$ {net_amount}")
+            while True:
+                query = dict(base_query)
+                if last_key:
+                    # Keyset pagination: resume strictly after the last (created_at, id)
+                    query["$or"] = [
+                        {"created_at": {"$gt": last_key[0], "$lt": cutoff}},
+                        {"created_at": last_key[0], "id": {"$gt": last_key[1]}}
+                    ]
+                    del query["created_at"]
+                page = await db.transactions.find(
+                    query, {"_id": 0, "id": 1, "payment_id": 1, "created_at": 1}
+                ).sort([("created_at", ASCENDING), ("id", ASCENDING)]).limit(RECONCILE_PAGE_SIZE).to_list(length=RECONCILE_PAGE_SIZE)
+                if not page:
+                    break
+                if oldest is None:
+                    oldest = page[0]["created_at"]
+                last_key = (page[-1]["created_at"], page[-1]["id"])
+                
+                lookups = [transaction for transaction in page if transaction.get("payment_id")]
+                if lookups and not listed_fetched:
+                    try:
+                        listed = await self._list_billings()
+                    except Exception as e:
+                        self.errors_total += 1
+                        print(f"❌ Reconciliation billing list failed: {type(e).__name__}: {str(e)}")
+                        break
+                    listed_fetched = True
+                paid = await asyncio.gather(*(self._is_paid(semaphore, transaction, listed) for transaction in lookups))
+                paid_ids = [transaction["id"] for transaction, is_paid in zip(lookups, paid) if is_paid]
+                checked += len(lookups)
+                approved += len(await approve_deposits(paid_ids, "reconciliation"))
+                
+                if len(page) < RECONCILE_PAGE_SIZE or abacatepay_gateway.breaker_open:
+                    break
             
-        except Exception as e:
-            print(f"❌ Failed to auto-verify transaction {transaction['id']}: {str(e)}")
+            elapsed = time.perf_counter() - started
+            self.runs += 1
+            self.checked_total += checked
+            self.approved_total += approved
+            self.last_run = {
+                "started_at": current_time.isoformat(),
+                "duration_seconds": round(elapsed, 3),
+                "checked": checked,
+                "approved": approved,
+                # Age of the oldest deposit still pending when the pass began
+                "lag_seconds": round((current_time - oldest).total_seconds(), 1) if oldest else 0.0,
+                "checks_per_second": round(checked / elapsed, 1) if elapsed > 0 else 0.0
+            }
+            if checked:
+                print(f"🔄 Reconciliation checked {checked} deposits, approved {approved} in {elapsed:.2f}s")
+            return self.last_run
+
+    def start(self):
+        if self.task is None and self.enabled:
+            self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.reconcile_once()
+            except Exception as e:
+                print(f"❌ Reconciliation pass failed: {str(e)}")
+            await asyncio.sleep(RECONCILE_INTERVAL_SECONDS)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "worker_running": self.task is not None,
+            "runs": self.runs,
+            "checked_total": self.checked_total,
+            "approved_total": self.approved_total,
+            "lookup_errors_total": self.errors_total,
+            "last_run": self.last_run,
+            "interval_seconds": RECONCILE_INTERVAL_SECONDS,
+            "concurrency": RECONCILE_CONCURRENCY
+        }
+
+deposit_reconciler = DepositReconciler()
+
+@api_router.get("/admin/reconciliation/stats")
+async def get_reconciliation_stats():
+    """Lag and throughput of the deposit reconciliation worker"""
+    return deposit_reconciler.stats()
+
+@api_router.post("/admin/auto-verify-payments")
+async def auto_verify_pending_payments():
+    """Verify pending payments now
+
+    Runs a reconciliation pass, which only approves what AbacatePay reports
+    as paid. Without a configured gateway nothing is approved.
+    """
+    if not deposit_reconciler.enabled:
+        return {
+            "message": "AbacatePay is not configured - pending payments were not verified",
+            "processed_count": 0,
+            "checked_count": 0,
+            "auto_verification": False
+        }
     
+    print("🔄 Reconciling pending payments with AbacatePay")
+    result = await deposit_reconciler.reconcile_once()
     return {
-        "message": f"Auto-verified {processed_count} pending payments",
-        "processed_count": processed_count,
+        "message": f"Auto-verified {result['approved']} pending payments",
+        "processed_count": result["approved"],
+        "checked_count": result["checked"],
         "auto_verification": True
     }
 
@@ -1862,11 +4349,17 @@ async def fix_historical_deposits():
         
         print(f"👥 Found {len(user_corrections)} users affected by incorrect fee deductions")
         
+        # Fetch every affected user in one query
+        affected_users = dict(zip(
+            user_corrections,
+            await get_user_loader().load_many(list(user_corrections))
+        ))
+        
         # Apply corrections for each affected user
         for user_id, correction_data in user_corrections.items():
             try:
                 # Get user information
-                user = await db.users.find_one({"id": user_id})
+                user = affected_users[user_id]
                 if not user:
                     print(f"⚠️ User {user_id} not found, skipping")
                     continue
@@ -1880,10 +4373,7 @@ async def fix_historical_deposits():
                 # Credit back the incorrectly deducted fees
                 refund_amount = correction_data["total_fee_deducted"]
                 
-                await db.users.update_one(
-                    {"id": user_id},
-                    {"$inc": {"balance": refund_amount}}
-                )
+                updated_user = await credit_balance(user_id, refund_amount)
                 
                 # Create correction transaction record
                 correction_transaction = Transaction(
@@ -1897,8 +4387,6 @@ async def fix_historical_deposits():
                 )
                 await db.transactions.insert_one(correction_transaction.dict())
                 
-                # Get updated balance
-                updated_user = await db.users.find_one({"id": user_id})
                 correction_data["user_info"]["new_balance"] = updated_user["balance"]
                 correction_data["refund_amount"] = refund_amount
                 
@@ -1946,33 +4434,22 @@ async def fix_pending_payments():
     pending_transactions = await db.transactions.find({
         "status": TransactionStatus.PENDING,
         "type": TransactionType.DEPOSIT
-    }).to_list(length=1000)
+    }, {"_id": 0, "id": 1}).to_list(length=1000)
     
     fixed_count = 0
     errors = []
     
-    for transaction in pending_transactions:
-        try:
-            # Update transaction to approved
-            await db.transactions.update_one(
-                {"id": transaction["id"]},
-                {"$set": {"status": TransactionStatus.APPROVED}}
-            )
-            
-            # Credit user balance - FULL AMOUNT (AbacatePay fee absorbed by platform)
-            net_amount = transaction["amount"]  # User gets full amount, platform absorbs AbacatePay fee
-            await db.users.update_one(
-                {"id": transaction["user_id"]},
-                {"$inc": {"balance": net_amount}}
-            )
-            
-            fixed_count += 1
-            print(f"✅ Fixed transaction {transaction['id']} for user {transaction['user_id']}, credited: R$ {net_amount}")
-            
-        except Exception as e:
-            error_msg = f"Failed to fix transaction {transaction['id']}: {str(e)}"
-            errors.append(error_msg)
-            print(f"❌ {error_msg}")
+    try:
+        # Credits the FULL AMOUNT (AbacatePay fee absorbed by platform)
+        fixed = await approve_deposits([transaction["id"] for transaction in pending_transactions], "emergency_fix")
+        fixed_count = len(fixed)
+        for transaction in fixed:
+            print(f"✅ Fixed transaction {transaction['id']} for user {transaction['user_id']}, credited: R$ {transaction['amount']}")
+    except Exception as e:
+        # Whatever was approved is credited by the next credit_approved_deposits sweep
+        error_msg = f"Failed to fix pending transactions: {str(e)}"
+        errors.append(error_msg)
+        print(f"❌ {error_msg}")
     
     return {
         "message": f"Emergency balance fix completed",
@@ -1990,7 +4467,7 @@ async def get_user_details_by_email(email: str):
         raise HTTPException(status_code=404, detail="User not found")
     
     # Get recent login attempts
-    login_logs = await db.login_logs.find({"email": email}).sort("timestamp", -1).limit(10).to_list(length=10)
+    login_logs = await db.login_logs.find({"email": email}).sort("login_time", -1).limit(10).to_list(length=10)
     
     # Get user transactions
     transactions = await db.transactions.find({"user_id": user["id"]}).sort("created_at", -1).limit(5).to_list(length=5)
@@ -2008,7 +4485,7 @@ async def get_user_details_by_email(email: str):
         },
         "recent_login_attempts": [
             {
-                "timestamp": log.get("timestamp"),
+                "timestamp": log.get("login_time"),
                 "success": log.get("success"),
                 "failure_reason": log.get("failure_reason"),
                 "ip_address": log.get("ip_address")
@@ -2041,16 +4518,16 @@ async def admin_reset_user_password(reset_data: dict):
         raise HTTPException(status_code=404, detail="User not found")
     
     # Hash new password
-    hashed_password = bcrypt.hashpw(new_password.encode('utf-8'), bcrypt.gensalt())
+    hashed_password = await hash_password_async(new_password)
     
     # Update user password and ensure email is verified
     await db.users.update_one(
         {"email": email},
         {"$set": {
-            "password": hashed_password,
+            "password_hash": hashed_password,
             "email_verified": True,  # Ensure user can login
             "email_verification_token": None  # Clear any pending token
-        }}
+        }, "$unset": {"password": ""}}
     )
     
     return {
@@ -2063,12 +4540,15 @@ async def admin_reset_user_password(reset_data: dict):
 @api_router.post("/debug/check-password/{user_id}")
 async def debug_check_password(user_id: str, password_data: dict):
     """DEBUG: Check if password matches for troubleshooting"""
-    user = await db.users.find_one({"id": user_id})
+    user = await get_user_loader().load(user_id)
     if not user:
         return {"found": False}
     
     password = password_data.get("password", "")
-    password_match = bcrypt.checkpw(password.encode('utf-8'), user["password"])
+    stored_hash = stored_password_hash(user)
+    password_match = bool(stored_hash) and await verify_password_async(password, stored_hash)
+    if password_match:
+        await upgrade_password_hash(user, password, stored_hash)
     
     return {
         "found": True,
@@ -2076,9 +4556,94 @@ async def debug_check_password(user_id: str, password_data: dict):
         "user_email": user["email"],
         "password_match": password_match,
         "tried_password": password,
-        "has_password_hash": bool(user.get("password"))
+        "has_password_hash": bool(stored_hash),
+        "hash_cost": hash_cost(stored_hash) if stored_hash else None,
+        "needs_rehash": bool(stored_hash) and needs_rehash(stored_hash)
     }
 
+# Streaming exports
+# Documents go straight from a Motor cursor to the response, batch_size at a
+# time, so an export of any size uses constant memory. Date ranges filter on
+# each collection's timestamp field, which leads an index in every case.
+EXPORTS = {
+    "transactions": {"time_field": "created_at", "columns": list(Transaction.model_fields)},
+    "bets": {"time_field": "created_at", "columns": list(Bet.model_fields)},
+    "login_logs": {"time_field": "login_time", "columns": list(LoginLog.model_fields)},
+}
+EXPORT_MAX_BATCH_SIZE = 10000
+
+def export_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, default=str)
+    return "" if value is None else value
+
+async def export_rows(cursor, export_format: str, columns: List[str], batch_size: int):
+    """Yield the export one batch of documents at a time"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if export_format == "csv":
+        writer.writerow(columns)
+    
+    count = 0
+    async for doc in cursor:
+        if export_format == "csv":
+            writer.writerow([export_value(doc.get(column)) for column in columns])
+        else:
+            buffer.write(json.dumps(doc, default=export_value) + "\n")
+        count += 1
+        if count % batch_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+    print(f"📤 Export finished: {count} documents")
+
+@api_router.get("/admin/export/{collection_name}")
+async def export_collection(
+    collection_name: str,
+    admin_user_id: str,
+    format: str = "ndjson",
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    batch_size: int = 1000
+):
+    """ADMIN: Stream transactions, bets or login_logs as NDJSON or CSV
+
+    start is inclusive and end exclusive. Both are applied to created_at,
+    or to login_time for login_logs.
+    """
+    export = EXPORTS.get(collection_name)
+    if not export:
+        raise HTTPException(status_code=404, detail=f"Unknown export: {collection_name}")
+    if format not in ("ndjson", "csv"):
+        raise HTTPException(status_code=400, detail="format must be ndjson or csv")
+    
+    await verify_admin_access(admin_user_id)
+    
+    batch_size = max(1, min(batch_size, EXPORT_MAX_BATCH_SIZE))
+    time_field = export["time_field"]
+    query: Dict[str, Any] = {}
+    if start or end:
+        query[time_field] = {}
+        if start:
+            query[time_field]["$gte"] = start
+        if end:
+            query[time_field]["$lt"] = end
+    
+    cursor = db[collection_name].find(
+        query, {"_id": 0, "password_hash": 0, "password": 0, "applied_credits": 0}
+    ).sort([(time_field, ASCENDING), ("id", ASCENDING)]).batch_size(batch_size)
+    
+    print(f"📤 Exporting {collection_name} as {format} (start={start}, end={end})")
+    filename = f"{collection_name}_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.{format}"
+    return StreamingResponse(
+        export_rows(cursor, format, export["columns"], batch_size),
+        media_type="text/csv" if format == "csv" else "application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
 # Demo/Testing Endpoints
 class DemoBalanceRequest(BaseModel):
     amount: float
@@ -2088,17 +4653,11 @@ async def demo_add_balance_v2(user_id: str, request: DemoBalanceRequest):
     """Demo endpoint to add balance to users for testing purposes (JSON body version)"""
     amount = request.amount
     
-    # Check if user exists
-    user = await db.users.find_one({"id": user_id})
-    if not user:
+    # Add balance (None means the user does not exist)
+    updated_user = await credit_balance(user_id, amount)
+    if not updated_user:
         raise HTTPException(status_code=404, detail="User not found")
     
-    # Add balance
-    await db.users.update_one(
-        {"id": user_id},
-        {"$inc": {"balance": amount}}
-    )
-    
     # Create demo transaction record
     transaction = Transaction(
         user_id=user_id,
@@ -2111,14 +4670,11 @@ async def demo_add_balance_v2(user_id: str, request: DemoBalanceRequest):
     )
     await db.transactions.insert_one(transaction.dict())
     
-    # Get updated user data
-    updated_user = await db.users.find_one({"id": user_id})
-    
     return {
-        "message": f"Added R$ {amount:.2f} to user {user['name']}",
+        "message": f"Added R$ {amount:.2f} to user {updated_user['name']}",
         "user_id": user_id,
-        "user_name": user["name"],
-        "previous_balance": user["balance"],
+        "user_name": updated_user["name"],
+        "previous_balance": updated_user["balance"] - amount,
         "added_amount": amount,
         "new_balance": updated_user["balance"],
         "demo_mode": True
@@ -2127,53 +4683,220 @@ async def demo_add_balance_v2(user_id: str, request: DemoBalanceRequest):
 # Include the router in the main app
 app.include_router(api_router)
 
-@app.post("/api/bets/process-expired")
-async def process_expired_bets():
-    """Process and cancel expired bets, refunding money to creators"""
-    current_time = datetime.utcnow()
-    
-    # Find expired bets that are still waiting
-    expired_bets = await db.bets.find({
-        "status": BetStatus.WAITING,
-        "expires_at": {"$lt": current_time}
-    }).to_list(1000)
-    
-    refunded_count = 0
-    
-    for bet in expired_bets:
-        # Refund money to creator
-        await db.users.update_one(
-            {"id": bet["creator_id"]},
-            {"$inc": {"balance": bet["amount"]}}
+# Bet expiry scheduling
+# Waiting bets are refunded the moment they expire instead of whenever
+# someone calls /bets/process-expired. Deadlines that fall within
+# EXPIRY_BATCH_WINDOW_MS of each other are refunded as one batch.
+EXPIRY_BATCH_WINDOW_MS = int(os.environ.get('EXPIRY_BATCH_WINDOW_MS', '200'))
+EXPIRY_BATCH_SIZE = 1000
+# A batch still unrefunded this long after expiring was left by a failed run
+EXPIRY_REFUND_GRACE_SECONDS = 60
+
+async def expire_bets(bet_ids: List[str], current_time: datetime, batch_id: Optional[str] = None) -> int:
+    """Expire and refund a batch of waiting bets with bulk writes
+
+    Only bets that are still waiting and past their deadline are touched, so
+    a bet joined at the last moment is never refunded. Expired bets carry
+    refunded=False until their creators are credited, so a failed refund is
+    finished later by refund_expired_bets(batch_id).
+    """
+    if not bet_ids:
+        return 0
+    
+    batch_id = batch_id or str(uuid.uuid4())
+    await db.bets.update_many(
+        {"id": {"$in": bet_ids}, "status": BetStatus.WAITING, "expires_at": {"$lte": current_time}},
+        {"$set": {
+            "status": BetStatus.EXPIRED,
+            "completed_at": current_time,
+            "expiry_batch": batch_id,
+            "refunded": False,
+            # The batch id doubles as the refund claim for this run
+            "refund_token": batch_id,
+            "refund_claimed_at": current_time
+        }}
+    )
+    return await refund_expired_bets(batch_id)
+
+async def refund_expired_bets(batch_id: Optional[str] = None) -> int:
+    """Credit creators of expired bets not refunded yet
+
+    With batch_id the bets expire_bets claimed for that batch are refunded.
+    Without it, bets whose refund claim is older than
+    EXPIRY_REFUND_GRACE_SECONDS (left by a run that failed or died) are
+    claimed under a new token and refunded. Each credit is keyed by a ledger
+    id, so a bet is never refunded twice even if a claim is retried.
+    """
+    if batch_id:
+        token = batch_id
+    else:
+        token = str(uuid.uuid4())
+        current_time = datetime.utcnow()
+        await db.bets.update_many(
+            {
+                "status": BetStatus.EXPIRED,
+                "refunded": False,
+                "refund_claimed_at": {"$not": {"$gt": current_time - timedelta(seconds=EXPIRY_REFUND_GRACE_SECONDS)}}
+            },
+            {"$set": {"refund_token": token, "refund_claimed_at": current_time}}
         )
+    query = {"refund_token": token, "refunded": False}
+    refunded = 0
+    
+    while True:
+        expired_bets = await db.bets.find(
+            query,
+            {"_id": 0, "id": 1, "creator_id": 1, "amount": 1, "event_description": 1}
+        ).limit(EXPIRY_BATCH_SIZE).to_list(length=EXPIRY_BATCH_SIZE)
+        if not expired_bets:
+            break
         
-        # Create refund transaction
-        fee = 0.0  # No fee for refund
-        net_amount = bet["amount"]
+        for bet in expired_bets:
+            forget_waiting_bet(bet["id"])
+        await db.users.bulk_write([
+            ledger_credit(bet["creator_id"], bet["amount"], f"refund:{bet['id']}:{bet['creator_id']}")
+            for bet in expired_bets
+        ], ordered=False)
         
-        refund_transaction = Transaction(
-            user_id=bet["creator_id"],
-            amount=bet["amount"],
-            fee=fee,
-            net_amount=net_amount,
-            type=TransactionType.BET_CREDIT,  # Using bet_credit for refund
-            status=TransactionStatus.APPROVED,
-            description=f"Reembolso - aposta expirada: {bet['event_description']}"
-        )
-        await db.transactions.insert_one(refund_transaction.dict())
+        await insert_ledger_transactions([
+            {"_id": f"refund:{bet['id']}:{bet['creator_id']}", **Transaction(
+                user_id=bet["creator_id"],
+                amount=bet["amount"],
+                fee=0.0,  # No fee for refund
+                net_amount=bet["amount"],
+                type=TransactionType.BET_CREDIT,  # Using bet_credit for refund
+                status=TransactionStatus.APPROVED,
+                description=f"Reembolso - aposta expirada: {bet['event_description']}"
+            ).dict()} for bet in expired_bets
+        ])
         
-        # Update bet status to expired
-        await db.bets.update_one(
-            {"id": bet["id"]},
-            {
-                "$set": {
-                    "status": BetStatus.EXPIRED,
-                    "completed_at": current_time
-                }
-            }
+        await db.bets.update_many(
+            {"id": {"$in": [bet["id"] for bet in expired_bets]}, "refund_token": token},
+            {"$set": {"refunded": True}}
         )
-        
-        refunded_count += 1
+        refunded += len(expired_bets)
+    
+    if refunded:
+        print(f"⌛ Expired and refunded {refunded} bets")
+    return refunded
+
+class ExpiryScheduler:
+    """Min-heap of (expires_at, bet_id) drained by a single background task"""
+
+    def __init__(self):
+        self.heap: List[tuple] = []
+        self.wakeup = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+        self.sweep_task: Optional[asyncio.Task] = None
+        # Expiry batches marked expired whose refund has not gone through yet
+        self.unrefunded_batches: List[str] = []
+
+    def schedule(self, bet_id: str, expires_at: datetime):
+        heapq.heappush(self.heap, (expires_at, bet_id))
+        # Only an earlier deadline changes how long the task should sleep
+        if self.heap[0][1] == bet_id:
+            self.wakeup.set()
+
+    async def rebuild(self):
+        """Load the deadline of every waiting bet from Mongo"""
+        cursor = db.bets.find({"status": BetStatus.WAITING}, {"_id": 0, "id": 1, "expires_at": 1})
+        self.heap = [(bet["expires_at"], bet["id"]) async for bet in cursor if bet.get("expires_at")]
+        heapq.heapify(self.heap)
+        print(f"⏰ Expiry scheduler tracking {len(self.heap)} waiting bets")
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self._run())
+            self.sweep_task = asyncio.create_task(self._sweep_abandoned_refunds())
+
+    async def stop(self):
+        for task in (self.task, self.sweep_task):
+            if task:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self.task = None
+        self.sweep_task = None
+
+    async def _sweep_abandoned_refunds(self):
+        """Finish refunds a previous process stopped in the middle of"""
+        await asyncio.sleep(EXPIRY_REFUND_GRACE_SECONDS)
+        try:
+            await refund_expired_bets()
+        except Exception as e:
+            print(f"❌ Refund of abandoned expiry batches failed: {str(e)}")
+
+    async def _run(self):
+        while True:
+            if self.unrefunded_batches:
+                try:
+                    await refund_expired_bets(self.unrefunded_batches[0])
+                    self.unrefunded_batches.pop(0)
+                except Exception as e:
+                    print(f"❌ Refund of expiry batch failed: {str(e)}")
+                    await asyncio.sleep(1)
+                continue
+
+            self.wakeup.clear()
+            if not self.heap:
+                await self.wakeup.wait()
+                continue
+
+            delay = (self.heap[0][0] - datetime.utcnow()).total_seconds()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            # Take everything due now plus what expires within the batch window
+            current_time = datetime.utcnow()
+            horizon = current_time + timedelta(milliseconds=EXPIRY_BATCH_WINDOW_MS)
+            due = []
+            while self.heap and self.heap[0][0] <= horizon and len(due) < EXPIRY_BATCH_SIZE:
+                due.append(heapq.heappop(self.heap))
+            if due[-1][0] > current_time:
+                await asyncio.sleep((due[-1][0] - current_time).total_seconds())
+
+            batch_id = str(uuid.uuid4())
+            try:
+                await expire_bets([bet_id for _, bet_id in due], datetime.utcnow(), batch_id)
+            except Exception as e:
+                # Put them back and retry on the next pass; bets that were
+                # already marked expired are refunded through their batch
+                print(f"❌ Expiry batch failed: {str(e)}")
+                for entry in due:
+                    heapq.heappush(self.heap, entry)
+                self.unrefunded_batches.append(batch_id)
+                await asyncio.sleep(1)
+
+expiry_scheduler = ExpiryScheduler()
+
+@app.post("/api/bets/process-expired")
+async def process_expired_bets():
+    """Process and cancel expired bets, refunding money to creators
+
+    The expiry scheduler normally does this on time; this sweep remains for
+    manual recovery.
+    """
+    current_time = datetime.utcnow()
+    # Expired earlier but never credited
+    refunded_count = await refund_expired_bets()
+    
+    while True:
+        # Find expired bets that are still waiting
+        expired_ids = [
+            bet["id"] async for bet in db.bets.find(
+                {"status": BetStatus.WAITING, "expires_at": {"$lt": current_time}},
+                {"_id": 0, "id": 1}
+            ).limit(EXPIRY_BATCH_SIZE)
+        ]
+        if not expired_ids:
+            break
+        refunded_count += await expire_bets(expired_ids, current_time)
     
     return {
         "message": f"Processed {refunded_count} expired bets",
@@ -2214,6 +4937,97 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def create_db_indexes():
+    await ensure_login_log_store()
+    await ensure_indexes()
+
+@app.on_event("startup")
+async def calibrate_password_hashing():
+    global password_hash_rounds
+    if BCRYPT_TARGET_MS > 0:
+        password_hash_rounds = await asyncio.get_running_loop().run_in_executor(
+            password_executor, calibrate_bcrypt_rounds, BCRYPT_TARGET_MS, BCRYPT_MIN_ROUNDS, BCRYPT_MAX_ROUNDS
+        )
+    print(f"🔐 bcrypt cost {password_hash_rounds}" + (f" (calibrated to {BCRYPT_TARGET_MS:.0f} ms)" if BCRYPT_TARGET_MS > 0 else ""))
+
+@app.on_event("startup")
+async def load_order_book():
+    try:
+        await order_book.rebuild()
+    except PyMongoError as e:
+        # find_matching_bet falls back to Mongo while the book is not loaded
+        print(f"⚠️ Could not rebuild order book: {str(e)}")
+
+@app.on_event("startup")
+async def finish_pool_settlements():
+    try:
+        await resume_pool_settlements()
+    except PyMongoError as e:
+        print(f"⚠️ Could not resume pool settlements: {str(e)}")
+
+@app.on_event("startup")
+async def start_expiry_scheduler():
+    try:
+        await expiry_scheduler.rebuild()
+    except PyMongoError as e:
+        print(f"⚠️ Could not load bet deadlines: {str(e)}")
+    expiry_scheduler.start()
+
+@app.on_event("startup")
+async def start_webhook_inbox():
+    await webhook_inbox.start()
+
+@app.on_event("startup")
+async def start_deposit_reconciler():
+    deposit_reconciler.start()
+    if deposit_reconciler.enabled:
+        print(f"🔄 Deposit reconciliation every {RECONCILE_INTERVAL_SECONDS:.0f}s")
+
+@app.on_event("startup")
+async def start_login_throttle():
+    login_throttle.start()
+
+@app.on_event("startup")
+async def start_login_log_writer():
+    login_log_writer.start()
+
+@app.on_event("startup")
+async def backfill_legacy_bets():
+    if BET_BACKFILL_ON_STARTUP:
+        start_bet_backfill(skip_completed=True)
+
+@app.on_event("shutdown")
+async def stop_bet_backfill():
+    # Progress is saved per chunk, so the next run resumes from there
+    if bet_backfill_task and not bet_backfill_task.done():
+        bet_backfill_task.cancel()
+
+@app.on_event("shutdown")
+async def stop_login_throttle():
+    await login_throttle.stop()
+
+@app.on_event("shutdown")
+async def drain_login_log_writer():
+    # After the throttle, whose final summaries go through the writer
+    await login_log_writer.stop()
+
+@app.on_event("shutdown")
+async def stop_webhook_inbox():
+    await webhook_inbox.stop()
+
+@app.on_event("shutdown")
+async def stop_deposit_reconciler():
+    await deposit_reconciler.stop()
+
+@app.on_event("shutdown")
+async def flush_auctions():
+    await call_auction.clear_all()
+
+@app.on_event("shutdown")
+async def stop_expiry_scheduler():
+    await expiry_scheduler.stop()
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
     client.close()
\ No newline at end of file
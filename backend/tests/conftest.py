@@ -0,0 +1,299 @@
+import copy
+import os
+import sys
+from pathlib import Path
+
+import pytest
+from pymongo.errors import AutoReconnect, BulkWriteError, DuplicateKeyError
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "betarena_test")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import server  # noqa: E402
+
+MISSING = object()
+
+
+def compare(value, op, operand):
+    if op == "$in":
+        return any(matches_value(value, item) for item in operand)
+    if op == "$nin":
+        return not any(matches_value(value, item) for item in operand)
+    if op == "$ne":
+        return not matches_value(value, operand)
+    if op == "$exists":
+        return (value is not MISSING) == operand
+    if op == "$not":
+        return not matches_condition(value, operand)
+    if value is MISSING or value is None:
+        return False
+    return {
+        "$gt": lambda: value > operand,
+        "$gte": lambda: value >= operand,
+        "$lt": lambda: value < operand,
+        "$lte": lambda: value <= operand,
+    }[op]()
+
+
+def matches_value(value, expected):
+    if isinstance(value, list) and not isinstance(expected, list):
+        return any(matches_value(item, expected) for item in value)
+    if expected is None:
+        return value is MISSING or value is None
+    return value is not MISSING and value == expected
+
+
+def matches_condition(value, condition):
+    if isinstance(condition, dict) and condition and all(key.startswith("$") for key in condition):
+        return all(compare(value, op, operand) for op, operand in condition.items())
+    return matches_value(value, condition)
+
+
+def matches(document, query):
+    for key, condition in query.items():
+        if key == "$or":
+            if not any(matches(document, branch) for branch in condition):
+                return False
+        elif key == "$and":
+            if not all(matches(document, branch) for branch in condition):
+                return False
+        elif not matches_condition(document.get(key, MISSING), condition):
+            return False
+    return True
+
+
+def evaluate(document, expression):
+    """The few aggregation expressions server code uses in pipeline updates"""
+    if isinstance(expression, str) and expression.startswith("$"):
+        return document.get(expression[1:])
+    if isinstance(expression, dict) and "$literal" in expression:
+        return expression["$literal"]
+    if isinstance(expression, dict) and "$ifNull" in expression:
+        value, default = (evaluate(document, item) for item in expression["$ifNull"])
+        return default if value is None else value
+    if isinstance(expression, dict) and "$subtract" in expression:
+        left, right = (evaluate(document, item) for item in expression["$subtract"])
+        return left - right
+    return expression
+
+
+def apply_update(document, update, inserting=False):
+    if isinstance(update, list):
+        for stage in update:
+            values = {field: evaluate(document, value) for field, value in stage["$set"].items()}
+            document.update(values)
+        return
+    for field, value in update.get("$set", {}).items():
+        document[field] = value
+    if inserting:
+        for field, value in update.get("$setOnInsert", {}).items():
+            document[field] = value
+    for field, value in update.get("$inc", {}).items():
+        document[field] = document.get(field, 0) + value
+    for field in update.get("$unset", {}):
+        document.pop(field, None)
+    for field, value in update.get("$push", {}).items():
+        items = document.setdefault(field, [])
+        if isinstance(value, dict) and "$each" in value:
+            items.extend(value["$each"])
+            if "$slice" in value:
+                document[field] = items[value["$slice"]:]
+        else:
+            items.append(value)
+
+
+class Result:
+    def __init__(self, matched=0, modified=0, upserted_id=None):
+        self.matched_count = matched
+        self.modified_count = modified
+        self.upserted_id = upserted_id
+
+
+class FakeCursor:
+    def __init__(self, documents, project=lambda document: document):
+        # Sorted and limited on the stored documents, projected when read
+        self.matched = documents
+        self.project = project
+
+    @property
+    def documents(self):
+        return [self.project(document) for document in self.matched]
+
+    def sort(self, key, direction=None):
+        keys = [(key, direction)] if isinstance(key, str) else key
+        for field, order in reversed(keys):
+            self.matched.sort(key=lambda document: document.get(field), reverse=order == -1)
+        return self
+
+    def limit(self, count):
+        if count:
+            self.matched = self.matched[:count]
+        return self
+
+    def batch_size(self, size):
+        return self
+
+    async def to_list(self, length=None):
+        return self.documents[:length] if length else self.documents
+
+    def __aiter__(self):
+        self._iter = iter(self.documents)
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._iter)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+class FakeCollection:
+    """Just enough of a Motor collection to run server code in memory
+
+    fail(operation, after=n) makes the (n+1)th following call of that write
+    raise AutoReconnect before writing anything, like a lost connection.
+    """
+
+    def __init__(self):
+        self.documents = []
+        self.failures = {}
+        self.next_id = 0
+
+    def fail(self, operation, after=0):
+        self.failures[operation] = after
+
+    def _maybe_fail(self, operation):
+        if operation not in self.failures:
+            return
+        if self.failures[operation] > 0:
+            self.failures[operation] -= 1
+            return
+        del self.failures[operation]
+        raise AutoReconnect(f"injected {operation} failure")
+
+    def with_options(self, **options):
+        return self
+
+    @staticmethod
+    def _project(document, projection):
+        document = copy.deepcopy(document)
+        if projection:
+            excluded = [field for field, keep in projection.items() if not keep]
+            included = [field for field, keep in projection.items() if keep]
+            if included:
+                document = {field: document[field] for field in included if field in document}
+            for field in excluded:
+                document.pop(field, None)
+        return document
+
+    def find(self, query=None, projection=None):
+        return FakeCursor(
+            [document for document in self.documents if matches(document, query or {})],
+            lambda document: self._project(document, projection)
+        )
+
+    async def find_one(self, query=None, projection=None, sort=None):
+        cursor = self.find(query, projection)
+        if sort:
+            cursor.sort(sort)
+        return cursor.documents[0] if cursor.documents else None
+
+    async def count_documents(self, query):
+        return len(self.find(query).documents)
+
+    async def insert_one(self, document):
+        self._maybe_fail("insert_one")
+        self._insert(document)
+
+    def _insert(self, document):
+        if "_id" not in document:
+            self.next_id += 1
+            document["_id"] = self.next_id
+        if any(existing["_id"] == document["_id"] for existing in self.documents):
+            raise DuplicateKeyError("duplicate _id")
+        self.documents.append(copy.deepcopy(document))
+
+    async def insert_many(self, documents, ordered=True):
+        self._maybe_fail("insert_many")
+        errors = []
+        for index, document in enumerate(documents):
+            try:
+                self._insert(document)
+            except DuplicateKeyError:
+                errors.append({"index": index, "code": 11000})
+        if errors:
+            raise BulkWriteError({"writeErrors": errors})
+
+    async def update_one(self, query, update, upsert=False):
+        self._maybe_fail("update_one")
+        return self._update(query, update, upsert, many=False)
+
+    async def update_many(self, query, update, upsert=False):
+        self._maybe_fail("update_many")
+        return self._update(query, update, upsert, many=True)
+
+    def _update(self, query, update, upsert, many):
+        targets = [document for document in self.documents if matches(document, query)]
+        if not many:
+            targets = targets[:1]
+        for document in targets:
+            apply_update(document, update)
+        if not targets and upsert:
+            document = {key: value for key, value in query.items() if not key.startswith("$") and not isinstance(value, dict)}
+            apply_update(document, update, inserting=True)
+            self._insert(document)
+            return Result(upserted_id=document["_id"])
+        return Result(len(targets), len(targets))
+
+    async def find_one_and_update(self, query, update, upsert=False, return_document=False, projection=None):
+        self._maybe_fail("find_one_and_update")
+        targets = [document for document in self.documents if matches(document, query)]
+        if not targets:
+            if upsert:
+                self._update(query, update, True, many=False)
+            return None
+        before = copy.deepcopy(targets[0])
+        apply_update(targets[0], update)
+        return self._project(targets[0] if return_document else before, projection)
+
+    async def delete_one(self, query):
+        for document in self.documents:
+            if matches(document, query):
+                self.documents.remove(document)
+                break
+
+    async def delete_many(self, query):
+        self.documents = [document for document in self.documents if not matches(document, query)]
+
+    async def bulk_write(self, operations, ordered=True):
+        self._maybe_fail("bulk_write")
+        modified = 0
+        for operation in operations:
+            # pymongo keeps the filter and update of an UpdateOne private
+            modified += self._update(operation._filter, operation._doc, operation._upsert, many=False).modified_count
+        return Result(modified, modified)
+
+    def by_id(self, document_id):
+        return next((document for document in self.documents if document.get("id") == document_id), None)
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.collections = {}
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return self.collections.setdefault(name, FakeCollection())
+
+
+@pytest.fixture
+def fake_db(monkeypatch):
+    database = FakeDatabase()
+    monkeypatch.setattr(server, "db", database)
+    monkeypatch.setattr(
+        server, "webhook_processing_cache",
+        server.WebhookDedupeCache(server.WEBHOOK_CACHE_TTL, server.WEBHOOK_CACHE_MAX_ENTRIES)
+    )
+    return database
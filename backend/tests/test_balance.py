@@ -0,0 +1,18 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+import server
+
+
+@pytest.mark.parametrize("mutate", [server.debit_balance, server.credit_balance])
+@pytest.mark.parametrize("amount", [0.0, -5.0, float("nan")])
+def test_non_positive_amounts_are_rejected(fake_db, mutate, amount):
+    fake_db.users.documents.append({"id": "u1", "name": "U", "balance": 10.0})
+
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(mutate("u1", amount))
+
+    assert error.value.status_code == 400
+    assert fake_db.users.by_id("u1")["balance"] == 10.0
@@ -0,0 +1,37 @@
+import asyncio
+from collections import OrderedDict
+
+import pytest
+from pymongo.errors import AutoReconnect
+
+import server
+
+
+def waiting_bet(bet_id, side):
+    return {
+        "id": bet_id, "event_id": "final", "side": side, "side_name": f"Lado {side}", "amount": 10.0,
+        "creator_id": f"user-{bet_id}", "creator_name": bet_id, "expires_at": None,
+        "status": server.BetStatus.WAITING, "opponent_id": None
+    }
+
+
+def test_failed_clear_puts_every_bet_back_in_the_book(fake_db, monkeypatch):
+    book = server.BetOrderBook()
+    monkeypatch.setattr(server, "order_book", book)
+    auction = server.CallAuction(0)
+    resting = [waiting_bet("r1", "A"), waiting_bet("r2", "A")]
+    incoming = [waiting_bet("i1", "B")]
+    for bet in resting + incoming:
+        fake_db.bets.documents.append(dict(bet))
+    for bet in resting:
+        book.add(bet)
+    auction.pending["final"] = OrderedDict((bet["id"], bet) for bet in incoming)
+    fake_db.bets.fail("bulk_write")
+
+    with pytest.raises(AutoReconnect):
+        asyncio.run(auction.clear("final"))
+
+    assert set(book.entries) == {"r1", "r2", "i1"}
+    # Resting bets keep their order in line
+    assert [entry["id"] for entry in book.take_event("final") if entry["side"] == "A"] == ["r1", "r2"]
+    assert all(bet["status"] == server.BetStatus.WAITING for bet in fake_db.bets.documents)
@@ -0,0 +1,116 @@
+import asyncio
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+from pymongo.errors import AutoReconnect
+
+import server
+
+
+def seed(fake_db, amount=25.0, deposits=1):
+    fake_db.users.documents.append({"_id": "u1", "id": "u1", "name": "U", "balance": 0.0})
+    for index in range(deposits):
+        fake_db.transactions.documents.append({
+            "_id": f"t{index}", "id": f"t{index}", "user_id": "u1", "amount": amount,
+            "type": server.TransactionType.DEPOSIT, "status": server.TransactionStatus.PENDING,
+            "created_at": datetime.utcnow()
+        })
+    return [f"t{index}" for index in range(deposits)]
+
+
+def test_failed_credit_is_finished_once(fake_db, monkeypatch):
+    monkeypatch.setattr(server, "DEPOSIT_CREDIT_GRACE_SECONDS", 0)
+    transaction_ids = seed(fake_db, deposits=2)
+    fake_db.transactions.fail("update_many", after=1)  # Lost after the credit, before credited=True
+
+    with pytest.raises(AutoReconnect):
+        asyncio.run(server.approve_deposits(transaction_ids, "test"))
+    # Two overlapping sweeps both find the abandoned claim
+    asyncio.run(server.credit_approved_deposits())
+    asyncio.run(server.credit_approved_deposits())
+
+    assert fake_db.users.by_id("u1")["balance"] == 50.0
+    assert all(transaction["credited"] for transaction in fake_db.transactions.documents)
+    assert fake_db.transactions.by_id("t0")["net_amount"] == 25.0 - 0.80
+
+
+def test_deposit_is_approved_once(fake_db):
+    transaction_ids = seed(fake_db)
+
+    first = asyncio.run(server.approve_deposits(transaction_ids, "webhook"))
+    second = asyncio.run(server.approve_deposits(transaction_ids, "reconciliation"))
+
+    assert [transaction["id"] for transaction in first] == ["t0"]
+    assert second == []
+    assert fake_db.users.by_id("u1")["balance"] == 25.0
+
+
+class ListOnlyBilling:
+    """The SDK's billing client, which can list billings but not fetch one"""
+
+    def __init__(self, statuses):
+        self.statuses = statuses
+        self.calls = 0
+
+    def list(self):
+        self.calls += 1
+        return [SimpleNamespace(id=billing_id, status=status) for billing_id, status in self.statuses.items()]
+
+
+def test_reconciler_works_with_a_list_only_client(fake_db, monkeypatch):
+    billing = ListOnlyBilling({"bill-0": "PAID", "bill-1": "PENDING"})
+    gateway = server.AbacatePayGateway(
+        SimpleNamespace(billing=billing), max_workers=1, timeout=5, max_retries=0,
+        breaker_threshold=5, breaker_cooldown=30
+    )
+    monkeypatch.setattr(server, "abacatepay_gateway", gateway)
+    seed(fake_db, deposits=2)
+    for index, transaction in enumerate(fake_db.transactions.documents):
+        transaction["payment_id"] = f"bill-{index}"
+        transaction["created_at"] = datetime.utcnow() - timedelta(seconds=server.RECONCILE_MIN_AGE_SECONDS + 1)
+
+    reconciler = server.DepositReconciler()
+    result = asyncio.run(reconciler.reconcile_once())
+
+    assert reconciler.enabled
+    assert (result["checked"], result["approved"]) == (2, 1)
+    assert billing.calls == 1
+    assert fake_db.users.by_id("u1")["balance"] == 25.0
+    assert fake_db.transactions.by_id("t1")["status"] == server.TransactionStatus.PENDING
+
+
+def paid_webhook(transaction_id, amount, fee=80):
+    return {"event": "billing.paid", "data": {
+        "externalId": transaction_id, "payment": {"amount": int(amount * 100), "fee": fee}
+    }}
+
+
+def test_webhook_and_simulation_credit_through_approve_deposits(fake_db):
+    seed(fake_db, deposits=2)
+
+    result = asyncio.run(server.process_abacatepay_payment_success(paid_webhook("t0", 25.0, fee=100)))
+    asyncio.run(server.simulate_payment_approval("t1"))
+    # A second path approving the same deposit credits nothing
+    asyncio.run(server.simulate_payment_approval("t0"))
+
+    assert result["status"] == "processed"
+    assert fake_db.users.by_id("u1")["balance"] == 50.0
+    webhook_deposit = fake_db.transactions.by_id("t0")
+    assert (webhook_deposit["approved_by"], webhook_deposit["fee"], webhook_deposit["credited"]) == ("webhook", 1.0, True)
+    assert fake_db.transactions.by_id("t1")["mp_payment_id"] == "demo_payment_t1"
+
+
+def test_webhook_retry_finishes_a_failed_credit(fake_db):
+    seed(fake_db)
+    fake_db.users.fail("bulk_write")
+
+    with pytest.raises(AutoReconnect):
+        asyncio.run(server.process_abacatepay_payment_success(paid_webhook("t0", 25.0)))
+    retry = asyncio.run(server.process_abacatepay_payment_success(paid_webhook("t0", 25.0)))
+    again = asyncio.run(server.process_abacatepay_payment_success(paid_webhook("t0", 25.0)))
+
+    assert retry["status"] == "processed"
+    assert again["status"] in ("duplicate_ignored", "already_processed")
+    assert fake_db.users.by_id("u1")["balance"] == 25.0
+    assert fake_db.transactions.by_id("t0")["credited"] is True
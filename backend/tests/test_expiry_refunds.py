@@ -0,0 +1,48 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from pymongo.errors import AutoReconnect
+
+import server
+
+
+def seed(fake_db, stake=10.0, bets=1):
+    fake_db.users.documents.append({"_id": "u1", "id": "u1", "name": "U", "balance": 0.0})
+    expired = datetime.utcnow() - timedelta(seconds=1)
+    for index in range(bets):
+        fake_db.bets.documents.append({
+            "_id": f"b{index}", "id": f"b{index}", "creator_id": "u1", "amount": stake,
+            "event_description": "Final", "status": server.BetStatus.WAITING, "expires_at": expired
+        })
+    return [f"b{index}" for index in range(bets)]
+
+
+def test_failed_ledger_write_does_not_refund_twice(fake_db):
+    bet_ids = seed(fake_db)
+    fake_db.transactions.fail("insert_many")
+
+    with pytest.raises(AutoReconnect):
+        asyncio.run(server.expire_bets(bet_ids, datetime.utcnow(), "batch-1"))
+    assert asyncio.run(server.refund_expired_bets("batch-1")) == 1
+    assert asyncio.run(server.refund_expired_bets("batch-1")) == 0
+
+    assert fake_db.users.by_id("u1")["balance"] == 10.0
+    assert len(fake_db.transactions.documents) == 1
+    assert fake_db.bets.by_id("b0")["refunded"] is True
+
+
+def test_abandoned_claim_is_swept_once(fake_db, monkeypatch):
+    monkeypatch.setattr(server, "EXPIRY_REFUND_GRACE_SECONDS", 0)
+    bet_ids = seed(fake_db, bets=3)
+    fake_db.bets.fail("update_many", after=1)  # Lost after the credit, before refunded=True
+
+    with pytest.raises(AutoReconnect):
+        asyncio.run(server.expire_bets(bet_ids, datetime.utcnow(), "batch-1"))
+    # Two overlapping sweeps both claim the abandoned bets
+    asyncio.run(server.refund_expired_bets())
+    asyncio.run(server.refund_expired_bets())
+
+    assert fake_db.users.by_id("u1")["balance"] == 30.0
+    assert len(fake_db.transactions.documents) == 3
+    assert all(bet["refunded"] for bet in fake_db.bets.documents)
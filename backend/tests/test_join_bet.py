@@ -0,0 +1,30 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from pymongo.errors import AutoReconnect
+
+import server
+
+
+@pytest.mark.parametrize("join", ["id", "invite"])
+def test_failed_debit_releases_the_claim(fake_db, monkeypatch, join):
+    monkeypatch.setattr(server, "order_book", server.BetOrderBook())
+    fake_db.users.documents.append({"id": "joiner", "name": "J", "balance": 50.0})
+    fake_db.bets.documents.append({
+        "id": "b1", "event_id": "final", "side": "A", "amount": 10.0, "creator_id": "creator",
+        "creator_name": "C", "invite_code": "code", "status": server.BetStatus.WAITING,
+        "opponent_id": None, "expires_at": datetime.utcnow() + timedelta(hours=1)
+    })
+    fake_db.users.fail("find_one_and_update")
+    join_data = server.JoinBet(user_id="joiner")
+
+    with pytest.raises(AutoReconnect):
+        if join == "id":
+            asyncio.run(server.join_bet("b1", join_data))
+        else:
+            asyncio.run(server.join_bet_by_invite("code", join_data))
+
+    bet = fake_db.bets.by_id("b1")
+    assert (bet["status"], bet["opponent_id"]) == (server.BetStatus.WAITING, None)
+    assert "b1" in server.order_book.entries
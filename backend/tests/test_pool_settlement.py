@@ -0,0 +1,36 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from pymongo.errors import AutoReconnect
+
+import server
+
+
+def seed(fake_db):
+    fake_db.users.documents.append({"id": "admin", "name": "Admin", "balance": 0.0, "is_admin": True})
+    for user_id, side in (("u1", "A"), ("u2", "A"), ("u3", "B")):
+        fake_db.users.documents.append({"id": user_id, "name": user_id, "balance": 0.0})
+        fake_db.pool_stakes.documents.append(server.PoolStake(
+            event_id="final", side=side, user_id=user_id, amount=100.0
+        ).dict())
+
+
+def test_crashed_settlement_is_resumed_without_paying_twice(fake_db, monkeypatch):
+    monkeypatch.setattr(server, "POOL_WRITE_CHUNK_SIZE", 1)
+    seed(fake_db)
+    fake_db.users.fail("bulk_write", after=1)  # u1 is paid, then the process dies
+    settle = server.SettlePool(winning_side="A", admin_user_id="admin")
+
+    with pytest.raises(AutoReconnect):
+        asyncio.run(server.settle_pool("final", settle))
+    assert asyncio.run(server.resume_pool_settlements()) == 0  # Lease still held
+
+    fake_db.pool_settlements.documents[0]["lease_until"] = datetime.utcnow() - timedelta(seconds=1)
+    assert asyncio.run(server.resume_pool_settlements()) == 1
+
+    balances = {user["id"]: user["balance"] for user in fake_db.users.documents}
+    assert balances == {"admin": 0.0, "u1": 120.0, "u2": 120.0, "u3": 0.0}
+    assert fake_db.pool_settlements.documents[0]["status"] == "completed"
+    assert len([t for t in fake_db.transactions.documents if t["type"] == server.TransactionType.BET_CREDIT]) == 2
+    assert {stake["status"] for stake in fake_db.pool_stakes.documents} == {server.PoolStakeStatus.WON, server.PoolStakeStatus.LOST}
@@ -0,0 +1,85 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+from fastapi import HTTPException
+
+import server
+
+
+def matched_pair(stake):
+    """Both halves of an auto-matched pair as create_bet leaves them"""
+    resting = server.Bet(
+        event_title="Brasil x Argentina", event_type="sports", event_description="Final",
+        amount=stake, creator_id="user-a", creator_name="A", side="A", event_id="final"
+    )
+    incoming = server.Bet(
+        event_title="Brasil x Argentina", event_type="sports", event_description="Final",
+        amount=stake, creator_id="user-b", creator_name="B", side="B", event_id="final"
+    )
+    resting.opponent_id, resting.opponent_name = incoming.creator_id, incoming.creator_name
+    incoming.opponent_id, incoming.opponent_name = resting.creator_id, resting.creator_name
+    resting.status = incoming.status = server.BetStatus.ACTIVE
+    resting.pair_id = incoming.pair_id = resting.id
+    return [resting.dict(), incoming.dict()]
+
+
+def seed(fake_db, bets):
+    for user_id, is_admin in (("user-a", False), ("user-b", False), ("admin", True)):
+        fake_db.users.documents.append({"id": user_id, "name": user_id, "balance": 0.0, "is_admin": is_admin})
+    for bet in bets:
+        fake_db.bets.documents.append(dict(bet))
+
+
+def balances(fake_db):
+    return {user["id"]: user["balance"] for user in fake_db.users.documents}
+
+
+def test_matched_pair_pays_no_more_than_its_stakes(fake_db):
+    stake = 50.0
+    bets = matched_pair(stake)
+    seed(fake_db, bets)
+
+    totals = asyncio.run(server.settle_bet_chunk(bets, "A", datetime.utcnow()))
+
+    assert sum(balances(fake_db).values()) == totals["paid"]
+    assert totals["paid"] + totals["fees"] == 2 * stake
+    assert balances(fake_db)["user-a"] == 2 * stake * (1 - server.PLATFORM_FEE_RATE)
+    assert all(bet["status"] == server.BetStatus.COMPLETED for bet in fake_db.bets.documents)
+
+
+def test_pair_halves_in_separate_chunks_pay_once(fake_db):
+    stake = 30.0
+    resting, incoming = matched_pair(stake)
+    seed(fake_db, [resting, incoming])
+
+    first = asyncio.run(server.settle_bet_chunk([incoming], "B", datetime.utcnow()))
+    second = asyncio.run(server.settle_bet_chunk([resting], "B", datetime.utcnow()))
+
+    assert first["paid"] == 0.0
+    assert first["paid"] + second["paid"] + first["fees"] + second["fees"] == 2 * stake
+    assert balances(fake_db)["user-b"] == second["paid"]
+
+
+@pytest.mark.parametrize("tag_cleared", [True, False])
+def test_failed_settlement_is_finished_by_a_rerun(fake_db, monkeypatch, tag_cleared):
+    stake = 40.0
+    seed(fake_db, matched_pair(stake))
+    # The payout lands, then marking the bets COMPLETED fails
+    fake_db.bets.fail("bulk_write")
+    if not tag_cleared:
+        # Handing the chunk back fails too, so the re-run waits out the claim
+        fake_db.bets.fail("update_many", after=1)
+        monkeypatch.setattr(server, "SETTLEMENT_CLAIM_GRACE_SECONDS", 0)
+    settle = server.SettleEvent(winning_side="A", admin_user_id="admin")
+
+    with pytest.raises(HTTPException):
+        asyncio.run(server.settle_event("final", settle))
+    assert all(bet["status"] == server.BetStatus.ACTIVE for bet in fake_db.bets.documents)
+
+    progress = asyncio.run(server.settle_event("final", settle))
+
+    assert progress["settled_bets"] == 2
+    assert all(bet["status"] == server.BetStatus.COMPLETED for bet in fake_db.bets.documents)
+    assert balances(fake_db)["user-a"] == 2 * stake * (1 - server.PLATFORM_FEE_RATE)
+    assert len(fake_db.transactions.documents) == 2
@@ -0,0 +1,38 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import server
+
+
+def entry(fake_db, entry_id, key, seconds_ago, status="pending", retry_in=0.0, locked_ago=0.0):
+    now = datetime.utcnow()
+    fake_db.webhook_inbox.documents.append({
+        "_id": entry_id, "id": entry_id, "ordering_key": key, "shard": 0, "status": status,
+        "received_at": now - timedelta(seconds=seconds_ago),
+        "next_attempt_at": now + timedelta(seconds=retry_in),
+        "locked_at": now - timedelta(seconds=locked_ago)
+    })
+
+
+def test_entry_in_backoff_only_blocks_its_own_key(fake_db):
+    inbox = server.WebhookInbox(1)
+    entry(fake_db, "a1", "txn-a", 30, retry_in=60)
+    entry(fake_db, "a2", "txn-a", 20)
+    entry(fake_db, "b1", "txn-b", 10)
+
+    head, _ = asyncio.run(inbox._next_entry(0))
+
+    assert head["id"] == "b1"
+
+
+def test_leased_entry_blocks_its_key_until_the_lease_expires(fake_db):
+    inbox = server.WebhookInbox(1)
+    entry(fake_db, "a1", "txn-a", 30, status="processing")
+    entry(fake_db, "a2", "txn-a", 20)
+
+    head, wait = asyncio.run(inbox._next_entry(0))
+    assert head is None and wait > 0
+
+    fake_db.webhook_inbox.by_id("a1")["locked_at"] -= timedelta(seconds=server.WEBHOOK_LEASE_SECONDS + 1)
+    head, _ = asyncio.run(inbox._next_entry(0))
+    assert head["id"] == "a1"
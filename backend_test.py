@@ -99,7 +99,7 @@ class BetArenaAPITester:
             "users",
             200
         )
-        return response if success else []
+        return response["items"] if success else []
 
     def test_create_bet(self, event_title, event_type, event_description, amount, creator_id, event_id=None, side=None, side_name=None):
         """Test bet creation with automatic matching system fields"""
@@ -162,7 +162,7 @@ class BetArenaAPITester:
             "bets",
             200
         )
-        return response if success else []
+        return response["items"] if success else []
 
     def test_get_waiting_bets(self):
         """Test get waiting bets"""
@@ -172,7 +172,7 @@ class BetArenaAPITester:
             "bets/waiting",
             200
         )
-        return response if success else []
+        return response["items"] if success else []
 
     def test_get_user_bets(self, user_id):
         """Test get user bets"""
@@ -182,7 +182,7 @@ class BetArenaAPITester:
             f"bets/user/{user_id}",
             200
         )
-        return response if success else []
+        return response["items"] if success else []
 
     def test_create_payment_preference(self, user_id, amount):
         """Test creating AbacatePay payment preference - PRIORITY TEST"""
@@ -258,7 +258,7 @@ class BetArenaAPITester:
             f"transactions/{user_id}",
             200
         )
-        return response if success else []
+        return response["items"] if success else []
 
     def test_abacatepay_integration_comprehensive(self):
         """Comprehensive test for AbacatePay integration - MAIN FOCUS"""
@@ -609,8 +609,8 @@ class BetArenaAPITester:
             200
         )
         
-        if waiting_bets_success and len(waiting_bets) > 0:
-            print(f"✅ Waiting bets retrieved: {len(waiting_bets)} bets found")
+        if waiting_bets_success and len(waiting_bets["items"]) > 0:
+            print(f"✅ Waiting bets retrieved: {len(waiting_bets['items'])} bets found")
         else:
             print("❌ No waiting bets found or request failed")
             return False
@@ -623,8 +623,8 @@ class BetArenaAPITester:
             200
         )
         
-        if user_bets_success and len(user_bets) > 0:
-            print(f"✅ User bets retrieved: {len(user_bets)} bets found")
+        if user_bets_success and len(user_bets["items"]) > 0:
+            print(f"✅ User bets retrieved: {len(user_bets['items'])} bets found")
         else:
             print("❌ No user bets found or request failed")
             return False
@@ -2885,7 +2885,7 @@ class BetArenaAPITester:
         )
         
         if regular_user_bets[0]:
-            user_bets_count = len(regular_user_bets[1])
+            user_bets_count = len(regular_user_bets[1]["items"])
             print(f"✅ Regular user can view their bets ({user_bets_count} bets)")
         else:
             print(f"❌ CRITICAL: Regular user cannot view their bets")
@@ -2900,7 +2900,7 @@ class BetArenaAPITester:
         )
         
         if regular_transactions[0]:
-            transactions_count = len(regular_transactions[1])
+            transactions_count = len(regular_transactions[1]["items"])
             print(f"✅ Regular user can view transaction history ({transactions_count} transactions)")
         else:
             print(f"❌ CRITICAL: Regular user cannot view transaction history")
@@ -3196,7 +3196,7 @@ class BetArenaAPITester:
             print("❌ CRITICAL: Failed to retrieve updated first bet")
             return False
         
-        user1_bets = updated_bet1[1]
+        user1_bets = updated_bet1[1]["items"]
         first_bet_updated = None
         for bet in user1_bets:
             if bet['id'] == bet1_id:
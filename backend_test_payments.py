@@ -138,7 +138,7 @@ class BetArenaPaymentTester:
             f"transactions/{user_id}",
             200
         )
-        return response if success else []
+        return response["items"] if success else []
 
     def test_payment_edge_cases(self):
         """Test payment system edge cases"""
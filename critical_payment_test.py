@@ -99,7 +99,7 @@ def test_critical_payment_bug():
     tx_response = requests.get(f"{api_url}/transactions/{user_id}")
     
     if tx_response.status_code == 200:
-        transactions = tx_response.json()
+        transactions = tx_response.json()["items"]
         print(f"   Retrieved {len(transactions)} transactions")
         
         if transactions:
@@ -18,6 +18,25 @@ const API = `${BACKEND_URL}/api`;
 console.log('🥑 AbacatePay: Frontend configured to use backend API for payments');
 const MP_PUBLIC_KEY = process.env.REACT_APP_MERCADO_PAGO_PUBLIC_KEY;
 
+// List endpoints return one page at a time; pass next_cursor back for the next one
+const getPage = async (url, cursor = null, itemsKey = 'items') => {
+  const response = await axios.get(url, { params: cursor ? { cursor } : {} });
+  return { items: response.data[itemsKey] || [], nextCursor: response.data.next_cursor || null };
+};
+
+// Shown under a paged list while the server has more of it
+const LoadMoreButton = ({ cursor, onClick, disabled }) => (cursor ? (
+  <div className="flex justify-center mt-4">
+    <Button
+      onClick={onClick}
+      disabled={disabled}
+      className="bg-white/10 hover:bg-white/20 text-white border border-white/20"
+    >
+      Carregar mais
+    </Button>
+  </div>
+) : null);
+
 function App() {
   const [currentUser, setCurrentUser] = useState(() => {
     // Try to load user from localStorage on app start
@@ -30,6 +49,7 @@ function App() {
   const [userBets, setUserBets] = useState([]);
   const [userTransactions, setUserTransactions] = useState([]);
   const [pendingDeposits, setPendingDeposits] = useState([]); // New state for admin
+  const [nextCursors, setNextCursors] = useState({}); // next_cursor of each paged list
   const [loading, setLoading] = useState(false);
 
   // Login/Register form
@@ -152,10 +172,18 @@ function App() {
     }
   }, [currentUser]);
 
+  // First page of a list, or its next page appended when more is true
+  const loadPage = async (list, url, setItems, more = false, itemsKey = 'items') => {
+    if (more && !nextCursors[list]) return [];
+    const page = await getPage(url, more ? nextCursors[list] : null, itemsKey);
+    setItems(previous => (more ? [...previous, ...page.items] : page.items));
+    setNextCursors(previous => ({ ...previous, [list]: page.nextCursor }));
+    return page.items;
+  };
+
   const loadUsers = async () => {
     try {
-      const response = await axios.get(`${API}/users`);
-      setUsers(response.data);
+      await loadPage('users', `${API}/users`, setUsers);
     } catch (error) {
       console.error('Error loading users:', error);
     }
@@ -256,10 +284,9 @@ function App() {
     return () => clearInterval(balanceRefreshInterval);
   }, [currentUser]);
 
-  const loadBets = async () => {
+  const loadBets = async (more = false) => {
     try {
-      const response = await axios.get(`${API}/bets`);
-      setBets(response.data);
+      await loadPage('bets', `${API}/bets`, setBets, more);
     } catch (error) {
       console.error('Error loading bets:', error);
     }
@@ -267,28 +294,25 @@ function App() {
 
   const loadWaitingBets = async () => {
     try {
-      const response = await axios.get(`${API}/bets/waiting`);
-      setWaitingBets(response.data);
+      await loadPage('waitingBets', `${API}/bets/waiting`, setWaitingBets);
     } catch (error) {
       console.error('Error loading waiting bets:', error);
     }
   };
 
-  const loadUserBets = async () => {
+  const loadUserBets = async (more = false) => {
     if (!currentUser) return;
     try {
-      const response = await axios.get(`${API}/bets/user/${currentUser.id}`);
-      setUserBets(response.data);
+      await loadPage('userBets', `${API}/bets/user/${currentUser.id}`, setUserBets, more);
     } catch (error) {
       console.error('Error loading user bets:', error);
     }
   };
 
-  const loadUserTransactions = async () => {
+  const loadUserTransactions = async (more = false) => {
     if (!currentUser) return;
     try {
-      const response = await axios.get(`${API}/transactions/${currentUser.id}`);
-      setUserTransactions(response.data);
+      await loadPage('userTransactions', `${API}/transactions/${currentUser.id}`, setUserTransactions, more);
     } catch (error) {
       console.error('Error loading transactions:', error);
     }
@@ -549,13 +573,12 @@ function App() {
   };
 
   // Load pending deposits for admin
-  const loadPendingDeposits = async () => {
+  const loadPendingDeposits = async (more = false) => {
     if (!currentUser?.is_admin) return;
     
     try {
-      const response = await axios.get(`${API}/admin/pending-deposits`);
-      setPendingDeposits(response.data.pending_deposits || []);
-      console.log('📋 Loaded pending deposits:', response.data);
+      const deposits = await loadPage('pendingDeposits', `${API}/admin/pending-deposits`, setPendingDeposits, more, 'pending_deposits');
+      console.log('📋 Loaded pending deposits:', deposits.length);
     } catch (error) {
       console.error('Error loading pending deposits:', error);
     }
@@ -2009,6 +2032,7 @@ function App() {
                   </Card>
                 ))}
               </div>
+              <LoadMoreButton cursor={nextCursors.userBets} onClick={() => loadUserBets(true)} disabled={loading} />
               {userBets.length === 0 && (
                 <div className="text-center py-12">
                   <Trophy className="w-16 h-16 text-gray-400 mx-auto mb-4" />
@@ -2184,6 +2208,7 @@ function App() {
                   </Card>
                 ))}
               </div>
+              <LoadMoreButton cursor={nextCursors.userTransactions} onClick={() => loadUserTransactions(true)} disabled={loading} />
               {userTransactions.length === 0 && (
                 <div className="text-center py-12">
                   <History className="w-16 h-16 text-gray-400 mx-auto mb-4" />
@@ -2217,7 +2242,7 @@ function App() {
                         {loading ? 'Verificando...' : '🔄 Verificar Pagamentos Pendentes'}
                       </Button>
                       <Button
-                        onClick={loadPendingDeposits}
+                        onClick={() => loadPendingDeposits()}
                         disabled={loading}
                         className="bg-blue-600 hover:bg-blue-700 text-white text-xs px-3 py-2"
                       >
@@ -2348,6 +2373,7 @@ function App() {
                             </CardContent>
                           </Card>
                         ))}
+                        <LoadMoreButton cursor={nextCursors.pendingDeposits} onClick={() => loadPendingDeposits(true)} disabled={loading} />
                       </div>
                     ) : (
                       <div className="text-center py-8">
@@ -2436,6 +2462,7 @@ function App() {
                   </Card>
                 ))}
               </div>
+              <LoadMoreButton cursor={nextCursors.bets} onClick={() => loadBets(true)} disabled={loading} />
               {bets.filter(bet => bet.status === 'active').length === 0 && (
                 <div className="text-center py-12">
                   <CheckCircle className="w-16 h-16 text-gray-400 mx-auto mb-4" />
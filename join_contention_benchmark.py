@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+JOIN CONTENTION BENCHMARK
+=========================
+
+FOCUS: 100 users try to join the same waiting bet at the same moment
+EXPECTED: Exactly one join succeeds and only that user is debited
+"""
+
+import requests
+import sys
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+BASE_URL = "https://1cc3498b-223f-4c5c-814b-3a8c8cb327ab.preview.emergentagent.com"
+JOINERS = 100
+BET_AMOUNT = 10.0
+
+def create_funded_user(api_url, label, amount):
+    """Create a verified user with demo balance"""
+    timestamp = f"{int(time.time() * 1000)}"
+    email = f"contention.{label}.{timestamp}@gmail.com"
+    response = requests.post(f"{api_url}/users", json={
+        "name": f"Contention {label}",
+        "email": email,
+        "phone": "11987654321",
+        "password": "contention123"
+    })
+    if response.status_code != 200:
+        raise RuntimeError(f"Failed to create user {label}: {response.status_code} {response.text}")
+
+    user = response.json()
+    requests.post(f"{api_url}/users/manual-verify?email={email}")
+    requests.post(f"{api_url}/demo/add-balance-v2/{user['id']}", json={"amount": amount})
+    return user
+
+def get_balance(api_url, user_id):
+    return requests.get(f"{api_url}/users/{user_id}").json()["balance"]
+
+def run_benchmark(base_url=BASE_URL, joiners=JOINERS):
+    api_url = f"{base_url}/api"
+
+    print("⚔️ JOIN CONTENTION BENCHMARK")
+    print("=" * 60)
+    print(f"Joiners: {joiners} concurrent requests on one bet")
+    print("=" * 60)
+
+    print("\n1. Creating creator and joiners...")
+    creator = create_funded_user(api_url, "creator", BET_AMOUNT)
+    with ThreadPoolExecutor(max_workers=20) as pool:
+        users = list(pool.map(lambda i: create_funded_user(api_url, f"joiner{i}", BET_AMOUNT), range(joiners)))
+    print(f"✅ {len(users)} joiners funded with R$ {BET_AMOUNT:.2f}")
+
+    print("\n2. Creating the contended bet...")
+    # Unique event so automatic matching cannot pair it first
+    response = requests.post(f"{api_url}/bets", json={
+        "event_title": "Contention Benchmark",
+        "event_type": "custom",
+        "event_description": "Join contention benchmark",
+        "amount": BET_AMOUNT,
+        "creator_id": creator["id"],
+        "side": "A",
+        "event_id": f"contention_{int(time.time() * 1000)}",
+        "side_name": "Lado A"
+    })
+    if response.status_code != 200:
+        print(f"❌ Failed to create bet: {response.status_code} {response.text}")
+        return False
+    bet = response.json()
+    print(f"✅ Bet created: {bet['id']}")
+
+    print("\n3. Firing joins...")
+    barrier = threading.Barrier(joiners)
+    session = requests.Session()
+
+    def join(user):
+        barrier.wait()
+        started = time.perf_counter()
+        result = session.post(f"{api_url}/bets/{bet['id']}/join", json={"user_id": user["id"]})
+        return user["id"], result.status_code, time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=joiners) as pool:
+        results = list(pool.map(join, users))
+    elapsed = time.perf_counter() - started
+
+    winners = [user_id for user_id, status, _ in results if status == 200]
+    latencies = sorted(latency for _, _, latency in results)
+    print(f"   Requests: {len(results)} in {elapsed:.3f}s ({len(results) / elapsed:.1f} req/s)")
+    print(f"   p50 latency: {latencies[len(latencies) // 2] * 1000:.1f} ms")
+    print(f"   p99 latency: {latencies[int(len(latencies) * 0.99) - 1] * 1000:.1f} ms")
+    print(f"   Successful joins: {len(winners)}")
+
+    print("\n4. Checking balances...")
+    debited = [user["id"] for user in users if get_balance(api_url, user["id"]) < BET_AMOUNT]
+    final_bet = requests.get(f"{api_url}/bets/invite/{bet['invite_code']}").json()
+    print(f"   Joiners debited: {len(debited)}")
+    print(f"   Bet opponent: {final_bet.get('opponent_id')}")
+
+    print(f"\n" + "=" * 60)
+    success = (
+        len(winners) == 1
+        and debited == winners
+        and final_bet.get("opponent_id") == winners[0]
+    )
+    if success:
+        print("🎉 SUCCESS: one join, one debit, no double-joins")
+    else:
+        print("❌ FAILURE: double-join or stray debit detected")
+    return success
+
+if __name__ == "__main__":
+    url = sys.argv[1] if len(sys.argv) > 1 else BASE_URL
+    sys.exit(0 if run_benchmark(url) else 1)
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+LOGIN BURST BENCHMARK
+=====================
+
+FOCUS: 200 logins/s for several seconds while an unrelated endpoint is probed
+EXPECTED: p99 latency of the unrelated endpoint stays flat during the burst
+
+Every login uses the right password, so the login throttle (which only
+counts failures) lets the whole burst through from one address.
+"""
+
+import requests
+import sys
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+BASE_URL = "https://1cc3498b-223f-4c5c-814b-3a8c8cb327ab.preview.emergentagent.com"
+LOGIN_RATE = 200  # Logins per second
+BURST_SECONDS = 10
+USERS = 20
+PROBE_INTERVAL = 0.05
+PASSWORD = "burst12345"
+
+def create_verified_user(api_url, index):
+    """Create a user that can log in"""
+    email = f"burst.{index}.{int(time.time() * 1000)}@gmail.com"
+    response = requests.post(f"{api_url}/users", json={
+        "name": f"Burst {index}",
+        "email": email,
+        "phone": "11987654321",
+        "password": PASSWORD
+    })
+    if response.status_code != 200:
+        raise RuntimeError(f"Failed to create user {index}: {response.status_code} {response.text}")
+    requests.post(f"{api_url}/users/manual-verify?email={email}")
+    return email
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+def probe(api_url, stop, latencies):
+    """Hit a cheap endpoint that never touches bcrypt"""
+    session = requests.Session()
+    while not stop.is_set():
+        started = time.perf_counter()
+        session.get(f"{api_url}/")
+        latencies.append(time.perf_counter() - started)
+        time.sleep(PROBE_INTERVAL)
+
+def measure_probe(api_url, seconds):
+    stop = threading.Event()
+    latencies = []
+    thread = threading.Thread(target=probe, args=(api_url, stop, latencies))
+    thread.start()
+    time.sleep(seconds)
+    stop.set()
+    thread.join()
+    return latencies
+
+def run_benchmark(base_url=BASE_URL):
+    api_url = f"{base_url}/api"
+
+    print("🔐 LOGIN BURST BENCHMARK")
+    print("=" * 60)
+    print(f"Burst: {LOGIN_RATE} logins/s for {BURST_SECONDS}s")
+    print("=" * 60)
+
+    print("\n1. Creating users...")
+    with ThreadPoolExecutor(max_workers=10) as pool:
+        emails = list(pool.map(lambda i: create_verified_user(api_url, i), range(USERS)))
+    print(f"✅ {len(emails)} verified users")
+
+    print("\n2. Measuring baseline latency of GET /api/ ...")
+    baseline = measure_probe(api_url, 3)
+    print(f"   p50: {percentile(baseline, 0.5) * 1000:.1f} ms  p99: {percentile(baseline, 0.99) * 1000:.1f} ms")
+
+    print("\n3. Firing login burst...")
+    session = requests.Session()
+    statuses = {}
+    lock = threading.Lock()
+
+    def login(i):
+        response = session.post(f"{api_url}/users/login", json={
+            "email": emails[i % len(emails)],
+            "password": PASSWORD
+        })
+        with lock:
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    stop = threading.Event()
+    during = []
+    prober = threading.Thread(target=probe, args=(api_url, stop, during))
+    prober.start()
+    with ThreadPoolExecutor(max_workers=LOGIN_RATE) as pool:
+        started = time.perf_counter()
+        for i in range(LOGIN_RATE * BURST_SECONDS):
+            # Pace submissions to the target rate
+            delay = started + i / LOGIN_RATE - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(login, i)
+    stop.set()
+    prober.join()
+
+    print(f"   Login responses: {dict(sorted(statuses.items()))}")
+    if statuses.get(429):
+        print(f"❌ {statuses[429]} logins were throttled - the burst did not reach bcrypt")
+        return False
+    print(f"   p50: {percentile(during, 0.5) * 1000:.1f} ms  p99: {percentile(during, 0.99) * 1000:.1f} ms")
+
+    stats = requests.get(f"{api_url}/admin/password-hashing/stats").json()
+    print(f"   bcrypt pool: {stats}")
+
+    print(f"\n" + "=" * 60)
+    # Allow for network noise against the remote preview: 3x baseline p99
+    baseline_p99 = percentile(baseline, 0.99)
+    burst_p99 = percentile(during, 0.99)
+    success = burst_p99 <= max(3 * baseline_p99, baseline_p99 + 0.05)
+    if success:
+        print(f"🎉 SUCCESS: p99 stayed flat ({baseline_p99 * 1000:.1f} ms -> {burst_p99 * 1000:.1f} ms)")
+    else:
+        print(f"❌ FAILURE: p99 degraded ({baseline_p99 * 1000:.1f} ms -> {burst_p99 * 1000:.1f} ms)")
+    return success
+
+if __name__ == "__main__":
+    url = sys.argv[1] if len(sys.argv) > 1 else BASE_URL
+    sys.exit(0 if run_benchmark(url) else 1)
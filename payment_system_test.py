@@ -166,7 +166,7 @@ class BetArenaPaymentTester:
             f"transactions/{user_id}",
             200
         )
-        return response if success else []
+        return response["items"] if success else []
 
     def test_create_bet(self, event_title, event_type, event_description, amount, creator_id):
         """Test bet creation with real money"""
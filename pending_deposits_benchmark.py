@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+PENDING DEPOSITS BENCHMARK
+==========================
+
+FOCUS: Admin pending-deposits view with 10k pending deposits
+EXPECTED: Every page (first and deep) answers from the index, well under a second
+
+Seeds directly into the backend's MongoDB (MONGO_URL / DB_NAME from
+backend/.env), so run it next to a backend that uses the same database.
+Seeded documents are removed at the end.
+"""
+
+import asyncio
+import os
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import requests
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+
+load_dotenv(Path(__file__).parent / "backend" / ".env")
+
+BASE_URL = "http://localhost:8001"
+DEPOSITS = 10000
+USERS = 1000
+PAGE_SIZE = 200
+MARKER = f"pending_benchmark_{int(time.time())}"
+
+async def seed(db):
+    now = datetime.utcnow()
+    users = [{
+        "id": str(uuid.uuid4()),
+        "name": f"Pending Benchmark {i}",
+        "email": f"{MARKER}.{i}@gmail.com",
+        "phone": "11987654321",
+        "balance": 0.0,
+        "created_at": now,
+        "benchmark": MARKER
+    } for i in range(USERS)]
+    await db.users.insert_many(users, ordered=False)
+
+    deposits = [{
+        "id": str(uuid.uuid4()),
+        "user_id": users[i % USERS]["id"],
+        "amount": float(10 + i % 90),
+        "fee": 0.80,
+        "net_amount": float(10 + i % 90),
+        "type": "deposit",
+        "status": "pending",
+        "description": "Benchmark deposit",
+        "created_at": now - timedelta(seconds=i),
+        "benchmark": MARKER
+    } for i in range(DEPOSITS)]
+    for start in range(0, DEPOSITS, 1000):
+        await db.transactions.insert_many(deposits[start:start + 1000], ordered=False)
+
+async def cleanup(db):
+    await db.transactions.delete_many({"benchmark": MARKER})
+    await db.users.delete_many({"benchmark": MARKER})
+
+def timed_get(url, params):
+    started = time.perf_counter()
+    response = requests.get(url, params=params)
+    return response, time.perf_counter() - started
+
+def run_benchmark(base_url=BASE_URL):
+    api_url = f"{base_url}/api"
+    client = AsyncIOMotorClient(os.environ["MONGO_URL"])
+    db = client[os.environ["DB_NAME"]]
+    loop = asyncio.new_event_loop()
+
+    print("📋 PENDING DEPOSITS BENCHMARK")
+    print("=" * 60)
+    print(f"Seeding {DEPOSITS} pending deposits for {USERS} users")
+    print("=" * 60)
+
+    loop.run_until_complete(seed(db))
+    try:
+        print("\n1. First page...")
+        response, first_elapsed = timed_get(f"{api_url}/admin/pending-deposits", {"limit": PAGE_SIZE})
+        if response.status_code != 200:
+            print(f"❌ Request failed: {response.status_code} {response.text}")
+            return False
+        data = response.json()
+        print(f"   {len(data['pending_deposits'])} deposits in {first_elapsed * 1000:.1f} ms")
+        print(f"   Totals: {data['total_count']} deposits, R$ {data['total_amount']:.2f}")
+
+        print("\n2. Walking every page...")
+        pages = [first_elapsed]
+        seen = len(data["pending_deposits"])
+        cursor = data["next_cursor"]
+        while cursor:
+            response, elapsed = timed_get(f"{api_url}/admin/pending-deposits", {"limit": PAGE_SIZE, "cursor": cursor})
+            data = response.json()
+            pages.append(elapsed)
+            seen += len(data["pending_deposits"])
+            cursor = data["next_cursor"]
+        pages_sorted = sorted(pages)
+        print(f"   {len(pages)} pages, {seen} deposits")
+        print(f"   p50: {pages_sorted[len(pages) // 2] * 1000:.1f} ms  max: {pages_sorted[-1] * 1000:.1f} ms")
+        print(f"   last page: {pages[-1] * 1000:.1f} ms")
+
+        print(f"\n" + "=" * 60)
+        success = seen >= DEPOSITS and pages_sorted[-1] < 1.0
+        if success:
+            print("🎉 SUCCESS: full listing paged without N+1 lookups")
+        else:
+            print("❌ FAILURE: missing deposits or slow pages")
+        return success
+    finally:
+        loop.run_until_complete(cleanup(db))
+        client.close()
+
+if __name__ == "__main__":
+    url = sys.argv[1] if len(sys.argv) > 1 else BASE_URL
+    sys.exit(0 if run_benchmark(url) else 1)
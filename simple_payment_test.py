@@ -153,7 +153,7 @@ def main():
     )
     
     if success:
-        print(f"   ✅ Transaction history retrieved: {len(transactions)} transactions")
+        print(f"   ✅ Transaction history retrieved: {len(transactions['items'])} transactions")
     
     # Test 9: Test getting waiting bets
     success, waiting_bets = tester.run_test(
@@ -164,7 +164,7 @@ def main():
     )
     
     if success:
-        print(f"   ✅ Waiting bets retrieved: {len(waiting_bets)} bets")
+        print(f"   ✅ Waiting bets retrieved: {len(waiting_bets['items'])} bets")
     
     # Test 10: Test getting user bets
     success, user_bets = tester.run_test(
@@ -175,7 +175,7 @@ def main():
     )
     
     if success:
-        print(f"   ✅ User bets retrieved: {len(user_bets)} bets")
+        print(f"   ✅ User bets retrieved: {len(user_bets['items'])} bets")
     
     # Print final results
     print("\n" + "=" * 50)